@@ -50,6 +50,7 @@ setup(
             "tfic-stats=wai.tfimageclass.train.stats:sys_main",
             "tfic-labelimage=wai.tfimageclass.predict.label_image:sys_main",
             "tfic-poll=wai.tfimageclass.predict.poll:sys_main",
+            "tfic-serve=wai.tfimageclass.predict.serve:sys_main",
         ]
     }
 )
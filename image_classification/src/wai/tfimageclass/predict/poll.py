@@ -19,16 +19,18 @@ from __future__ import print_function
 
 import argparse
 from datetime import datetime
-from time import sleep
 import os
 import tensorflow as tf
 import traceback
-from wai.tfimageclass.utils.prediction_utils import load_graph, load_labels, read_tensor_from_image_file, tensor_to_probs, top_k_probs
+from wai.tfimageclass.utils.prediction_utils import load_graph, load_labels, read_tensor_from_image_file, tensor_to_probs, top_k_probs, warmup_graph
+from wai.tfimageclass.utils.watch_utils import ImageWatcher, WATCH_AUTO, WATCH_MODES
 
 
-def poll(sess, graph, input_layer, output_layer, labels, in_dir, out_dir, height, width, mean, std, top_x, delete):
+def poll(sess, graph, input_layer, output_layer, labels, in_dir, out_dir, height, width, mean, std, top_x, delete,
+         watch_mode=WATCH_AUTO):
     """
     Performs continuous predictions on files appearing in the "in_dir" and outputting the results in "out_dir".
+    Images only get processed once they have been written completely.
 
     :param sess: the tensorflow session to use
     :type sess: tf.Session
@@ -56,15 +58,19 @@ def poll(sess, graph, input_layer, output_layer, labels, in_dir, out_dir, height
     :type top_x: int
     :param delete: whether to delete the input images (True) or move them to the output directory (False)
     :type delete: bool
+    :param watch_mode: how to watch the input directory for new images (auto/inotify/poll)
+    :type watch_mode: str
     """
 
     print("Class labels: %s" % str(labels))
 
+    watcher = ImageWatcher(in_dir, mode=watch_mode)
+    print("Watching %s (%s)" % (in_dir, watcher.mode))
+
     while True:
-        any = False
-        files = [(in_dir + os.sep + x) for x in os.listdir(in_dir) if (x.lower().endswith(".png") or x.lower().endswith(".jpg"))]
+        # waits for images to appear
+        files = watcher.get(timeout=1.0)
         for f in files:
-            any = True
             start = datetime.now()
             print(start, "-", f)
 
@@ -122,10 +128,6 @@ def poll(sess, graph, input_layer, output_layer, labels, in_dir, out_dir, height
             timediff = datetime.now() - start
             print("  time:", timediff)
 
-        # nothing processed at all, lets wait for files to appear
-        if not any:
-            sleep(1)
-
 
 def main(args=None):
     """
@@ -138,6 +140,7 @@ def main(args=None):
     parser.add_argument("--in_dir", help="the input directory to poll for images", required=True)
     parser.add_argument("--out_dir", help="the output directory for processed images and predictions", required=True)
     parser.add_argument('--delete', default=False, help="Whether to delete images rather than move them to the output directory.", action='store_true')
+    parser.add_argument("--watch_mode", choices=WATCH_MODES, help="how to watch the input directory for new images: inotify (Linux) or polling; auto uses inotify if available", default=WATCH_AUTO)
     parser.add_argument("--graph", help="graph/model to be executed", required=True)
     parser.add_argument("--labels", help="name of file containing labels", required=True)
     parser.add_argument("--input_height", type=int, help="input height", default=299)
@@ -146,15 +149,22 @@ def main(args=None):
     parser.add_argument("--input_std", type=int, help="input std", default=255)
     parser.add_argument("--input_layer", help="name of input layer", default="Placeholder")
     parser.add_argument("--output_layer", help="name of output layer", default="final_result")
+    parser.add_argument("--optimize_graph", default=False, help="whether to optimize the graph for inference (strip unused nodes, fold constants/batch normalizations, fuse operations), caching the optimized graph", action="store_true")
+    parser.add_argument("--graph_cache_dir", help="the directory for caching the optimized graph (default: directory of the graph)", default=None)
+    parser.add_argument("--warmup_runs", type=int, help="the number of times to classify a dummy image before polling, so that the first image doesn't pay for the lazy initialization", default=0)
     parser.add_argument("--top_x", type=int, help="output only the top K labels; use <1 for all", default=5)
     args = parser.parse_args(args=args)
 
-    graph = load_graph(args.graph)
+    graph = load_graph(args.graph, optimize=args.optimize_graph, outputs=[args.output_layer],
+                       cache_dir=args.graph_cache_dir)
     labels = load_labels(args.labels)
 
     with tf.compat.v1.Session(graph=graph) as sess:
+        warmup_graph(sess, graph, args.input_layer, args.output_layer, args.input_height, args.input_width,
+                     runs=args.warmup_runs)
         poll(sess, graph, args.input_layer, args.output_layer, labels, args.in_dir, args.out_dir,
-             args.input_height, args.input_width, args.input_mean, args.input_std, args.top_x, args.delete)
+             args.input_height, args.input_width, args.input_mean, args.input_std, args.top_x, args.delete,
+             watch_mode=args.watch_mode)
 
 
 def sys_main() -> int:
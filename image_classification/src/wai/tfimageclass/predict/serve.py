@@ -0,0 +1,198 @@
+# Copyright 2019 University of Waikato, Hamilton, NZ.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import argparse
+import numpy as np
+import tensorflow as tf
+import traceback
+from wai.tfimageclass.utils.prediction_utils import load_graph, load_labels, top_k_probs, detect_image_format, create_image_decoder, warmup_graph
+from wai.tfimageclass.utils.serving_utils import MicroBatcher, PredictionServer
+
+
+def create_predictor(sess, graph, input_layer, output_layer, labels, decoder_sess, encoded, decoded, top_x,
+                     max_batch_size, max_wait):
+    """
+    Creates the function that turns an encoded image into predictions. The images get decoded in the calling
+    threads, but classified in batches (of concurrent requests).
+
+    :param sess: the tensorflow session to use for classifying
+    :type sess: tf.Session
+    :param graph: the tensorflow graph to use
+    :type graph: tf.Graph
+    :param input_layer: the name of input layer in the graph to use
+    :type input_layer: str
+    :param output_layer: the name of output layer in the graph to use
+    :type output_layer: str
+    :param labels: the list of labels to use
+    :type labels: list
+    :param decoder_sess: the tensorflow session for decoding the images (see create_image_decoder)
+    :type decoder_sess: tf.Session
+    :param encoded: the placeholder for the encoded image
+    :type encoded: tf.Tensor
+    :param decoded: the output tensor for each image format
+    :type decoded: dict
+    :param top_x: the default number of labels with the highest probabilities to return, <1 for all
+    :type top_x: int
+    :param max_batch_size: the maximum number of images to classify at once
+    :type max_batch_size: int
+    :param max_wait: the maximum time in seconds to wait for further images after the first image of a batch
+    :type max_wait: float
+    :return: the function, taking the encoded image and the query parameters (top_x) and returning the
+             predictions, and the batcher (needs starting)
+    :rtype: tuple
+    """
+
+    input_tensor = graph.get_operation_by_name("import/" + input_layer).outputs[0]
+    output_tensor = graph.get_operation_by_name("import/" + output_layer).outputs[0]
+
+    def classify(tensors):
+        probs = sess.run(output_tensor, {input_tensor: np.concatenate(tensors)})
+        return list(probs.reshape((len(tensors), -1)))
+
+    batcher = MicroBatcher(classify, max_batch_size=max_batch_size, max_wait=max_wait)
+
+    def predict(data, params):
+        try:
+            k = int(params.get("top_x", top_x))
+        except ValueError:
+            raise ValueError("Invalid top_x: %s" % params["top_x"])
+        image_format = detect_image_format(data)
+        try:
+            tensor = decoder_sess.run(decoded[image_format], {encoded: data})
+        except tf.errors.InvalidArgumentError:
+            raise ValueError("Failed to decode image (%s)" % image_format)
+        probs = batcher.submit(tensor)
+        return {
+            'predictions': [{'label': labels[i], 'probability': float(probs[i])} for i in top_k_probs(probs, k)]
+        }
+
+    return predict, batcher
+
+
+def serve(sess, graph, input_layer, output_layer, labels, host, port, height, width, mean, std, top_x,
+          max_batch_size, max_wait, verbose=False):
+    """
+    Serves predictions over HTTP until interrupted: images posted to /predict get classified (in batches of
+    concurrent requests) and the labels with their probabilities returned as JSON.
+
+    :param sess: the tensorflow session to use
+    :type sess: tf.Session
+    :param graph: the tensorflow graph to use
+    :type graph: tf.Graph
+    :param input_layer: the name of input layer in the graph to use
+    :type input_layer: str
+    :param output_layer: the name of output layer in the graph to use
+    :type output_layer: str
+    :param labels: the list of labels to use
+    :type labels: list
+    :param host: the host/IP to listen on
+    :type host: str
+    :param port: the port to listen on
+    :type port: int
+    :param height: the expected height of the images
+    :type height: int
+    :param width: the expected height of the images
+    :type width: int
+    :param mean: the mean to use for the images
+    :type mean: int
+    :param std: the std deviation to use for the images
+    :type std: int
+    :param top_x: the default number of labels with the highest probabilities to return, <1 for all
+    :type top_x: int
+    :param max_batch_size: the maximum number of images to classify at once
+    :type max_batch_size: int
+    :param max_wait: the maximum time in seconds to wait for further images after the first image of a batch
+    :type max_wait: float
+    :param verbose: whether to log the requests
+    :type verbose: bool
+    """
+
+    print("Class labels: %s" % str(labels))
+
+    decoder_graph, encoded, decoded = create_image_decoder(height, width, mean, std)
+    with tf.compat.v1.Session(graph=decoder_graph) as decoder_sess:
+        predict, batcher = create_predictor(sess, graph, input_layer, output_layer, labels, decoder_sess, encoded,
+                                            decoded, top_x, max_batch_size, max_wait)
+        batcher.start()
+        server = PredictionServer((host, port), predict, verbose=verbose)
+        print("Serving on http://%s:%d/predict" % (host, port))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            batcher.stop()
+
+
+def main(args=None):
+    """
+    The main method for parsing command-line arguments and serving predictions.
+
+    :param args: the commandline arguments, uses sys.argv if not supplied
+    :type args: list
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--graph", help="graph/model to be executed", required=True)
+    parser.add_argument("--labels", help="name of file containing labels", required=True)
+    parser.add_argument("--host", help="the host/IP to listen on", default="localhost")
+    parser.add_argument("--port", type=int, help="the port to listen on", default=8000)
+    parser.add_argument("--input_height", type=int, help="input height", default=299)
+    parser.add_argument("--input_width", type=int, help="input width", default=299)
+    parser.add_argument("--input_mean", type=int, help="input mean", default=0)
+    parser.add_argument("--input_std", type=int, help="input std", default=255)
+    parser.add_argument("--input_layer", help="name of input layer", default="Placeholder")
+    parser.add_argument("--output_layer", help="name of output layer", default="final_result")
+    parser.add_argument("--optimize_graph", default=False, help="whether to optimize the graph for inference (strip unused nodes, fold constants/batch normalizations, fuse operations), caching the optimized graph", action="store_true")
+    parser.add_argument("--graph_cache_dir", help="the directory for caching the optimized graph (default: directory of the graph)", default=None)
+    parser.add_argument("--warmup_runs", type=int, help="the number of times to classify a dummy image before serving, so that the first request doesn't pay for the lazy initialization", default=0)
+    parser.add_argument("--top_x", type=int, help="output only the top K labels; use <1 for all (can be overridden per request)", default=5)
+    parser.add_argument("--max_batch_size", type=int, help="the maximum number of concurrently posted images to classify at once", default=8)
+    parser.add_argument("--max_wait", type=float, help="the maximum time in seconds to wait for further images before classifying a batch", default=0.01)
+    parser.add_argument("--verbose", default=False, help="whether to log the requests", action="store_true")
+    args = parser.parse_args(args=args)
+
+    graph = load_graph(args.graph, optimize=args.optimize_graph, outputs=[args.output_layer],
+                       cache_dir=args.graph_cache_dir)
+    labels = load_labels(args.labels)
+
+    with tf.compat.v1.Session(graph=graph) as sess:
+        warmup_graph(sess, graph, args.input_layer, args.output_layer, args.input_height, args.input_width,
+                     runs=args.warmup_runs)
+        serve(sess, graph, args.input_layer, args.output_layer, labels, args.host, args.port,
+              args.input_height, args.input_width, args.input_mean, args.input_std, args.top_x,
+              args.max_batch_size, args.max_wait, verbose=args.verbose)
+
+
+def sys_main() -> int:
+    """
+    Runs the main function using the system cli arguments, and
+    returns a system error code.
+    :return:    0 for success, 1 for failure.
+    """
+    try:
+        main()
+        return 0
+    except Exception:
+        print(traceback.format_exc())
+        return 1
+
+
+if __name__ == '__main__':
+    main()
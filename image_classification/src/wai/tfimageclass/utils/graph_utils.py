@@ -0,0 +1,159 @@
+# Copyright 2019 University of Waikato, Hamilton, NZ.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import hashlib
+import os
+import time
+
+import tensorflow as tf
+from tensorflow.core.protobuf import config_pb2
+from tensorflow.python.grappler import tf_optimizer
+
+OPTIMIZERS = ["pruning", "constfold", "arithmetic", "dependency", "remap", "constfold"]
+""" The grappler optimizers to apply to a frozen graph: stripping the nodes not needed for the outputs,
+folding constants (incl. batch normalizations into the preceding weights), simplifying arithmetic, removing
+redundant control dependencies and fusing operations (eg convolution, bias and activation). """
+
+CACHE_EXTENSION = ".optimized.pb"
+""" The extension of the optimized graphs in the cache directory. """
+
+
+def file_hash(path):
+    """
+    Computes the SHA-256 hash of a file's content.
+
+    :param path: the file to hash
+    :type path: str
+    :return: the hash (hex)
+    :rtype: str
+    """
+
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def optimize_graph_def(graph_def, outputs, optimizers=OPTIMIZERS):
+    """
+    Optimizes a frozen graph with grappler for inference.
+
+    :param graph_def: the graph to optimize
+    :type graph_def: tf.compat.v1.GraphDef
+    :param outputs: the names of the output nodes (ones not present in the graph get ignored)
+    :type outputs: list
+    :param optimizers: the grappler optimizers to apply
+    :type optimizers: list
+    :return: the optimized graph
+    :rtype: tf.compat.v1.GraphDef
+    """
+
+    names = set(node.name for node in graph_def.node)
+    present = [x for x in outputs if x in names]
+    if len(present) == 0:
+        raise Exception("None of the outputs present in the graph: %s" % ", ".join(outputs))
+
+    graph = tf.Graph()
+    with graph.as_default():
+        tf.import_graph_def(graph_def, name="")
+        meta_graph = tf.compat.v1.train.export_meta_graph(graph_def=graph.as_graph_def(), graph=graph)
+    # grappler keeps the nodes in the "train_op" collection (and what they depend on)
+    meta_graph.collection_def["train_op"].node_list.value.extend(present)
+
+    config = config_pb2.ConfigProto()
+    rewrite_options = config.graph_options.rewrite_options
+    rewrite_options.optimizers.extend(optimizers)
+    rewrite_options.meta_optimizer_iterations = 2
+    return tf_optimizer.OptimizeGraph(config, meta_graph)
+
+
+def load_optimized_graph_def(model_file, outputs, cache_dir=None, optimizers=OPTIMIZERS):
+    """
+    Loads the frozen graph and optimizes it (see optimize_graph_def). The optimized graph gets cached on disk,
+    keyed by the hash of the graph file, the outputs, the optimizers and the tensorflow version, so that it
+    only gets optimized once.
+
+    :param model_file: the frozen graph to load
+    :type model_file: str
+    :param outputs: the names of the output nodes (ones not present in the graph get ignored)
+    :type outputs: list
+    :param cache_dir: the directory for the optimized graphs, None for the directory of the graph
+    :type cache_dir: str
+    :param optimizers: the grappler optimizers to apply
+    :type optimizers: list
+    :return: the optimized graph
+    :rtype: tf.compat.v1.GraphDef
+    """
+
+    key = hashlib.sha256("|".join([file_hash(model_file), ",".join(outputs), ",".join(optimizers),
+                                   tf.__version__]).encode("utf-8")).hexdigest()
+    if cache_dir is None:
+        cache_dir = os.path.dirname(os.path.abspath(model_file))
+    cache_file = os.path.join(cache_dir, "%s-%s%s" % (
+        os.path.splitext(os.path.basename(model_file))[0], key[:16], CACHE_EXTENSION))
+
+    graph_def = tf.compat.v1.GraphDef()
+    if os.path.exists(cache_file):
+        with open(cache_file, "rb") as f:
+            graph_def.ParseFromString(f.read())
+        print("Loaded optimized graph from %s" % cache_file)
+        return graph_def
+
+    with open(model_file, "rb") as f:
+        graph_def.ParseFromString(f.read())
+    start = time.time()
+    optimized = optimize_graph_def(graph_def, outputs, optimizers=optimizers)
+    print("Optimized graph in %.1f s: %d -> %d nodes"
+          % (time.time() - start, len(graph_def.node), len(optimized.node)))
+
+    # Write to a temporary file first, so that concurrent processes never read an incomplete graph
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        tmp_file = "%s.%d.tmp" % (cache_file, os.getpid())
+        with open(tmp_file, "wb") as f:
+            f.write(optimized.SerializeToString())
+        os.replace(tmp_file, cache_file)
+        print("Cached optimized graph in %s" % cache_file)
+    except OSError as e:
+        print("Failed to cache optimized graph in %s: %s" % (cache_dir, str(e)))
+
+    return optimized
+
+
+def warmup(sess, fetches, feed_dict, runs=1):
+    """
+    Runs the session a number of times on dummy data, so that the lazy initialization (memory allocation,
+    kernel selection, etc.) happens before the first real request.
+
+    :param sess: the session to warm up
+    :type sess: tf.Session
+    :param fetches: what to compute
+    :param feed_dict: the dummy input
+    :type feed_dict: dict
+    :param runs: the number of runs
+    :type runs: int
+    :return: the time in seconds of each run
+    :rtype: list
+    """
+
+    result = []
+    for _ in range(runs):
+        start = time.time()
+        sess.run(fetches, feed_dict)
+        result.append(time.time() - start)
+    if runs > 0:
+        print("Warmup: %s ms" % ", ".join(str(int(x * 1000)) for x in result))
+    return result
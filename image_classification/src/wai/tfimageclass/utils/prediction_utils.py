@@ -16,23 +16,34 @@
 
 import numpy as np
 import tensorflow as tf
+from wai.tfimageclass.utils.graph_utils import load_optimized_graph_def, warmup
 
 
-def load_graph(model_file):
+def load_graph(model_file, optimize=False, outputs=None, cache_dir=None):
     """
-    Loads the model from disk.
+    Loads the model from disk, optionally optimizing it for inference (see load_optimized_graph_def).
 
     :param model_file: the model to load
     :type model_file: str
+    :param optimize: whether to optimize the graph (the optimized graph gets cached)
+    :type optimize: bool
+    :param outputs: the names of the output layers to keep when optimizing
+    :type outputs: list
+    :param cache_dir: the directory for caching the optimized graph, None for the directory of the model
+    :type cache_dir: str
     :return: the graph
     :rtype: tf.Graph
     """
 
     graph = tf.Graph()
-    graph_def = tf.compat.v1.GraphDef()
-
-    with open(model_file, "rb") as f:
-        graph_def.ParseFromString(f.read())
+    if optimize:
+        if outputs is None:
+            raise Exception("The output layers are required for optimizing the graph")
+        graph_def = load_optimized_graph_def(model_file, outputs, cache_dir=cache_dir)
+    else:
+        graph_def = tf.compat.v1.GraphDef()
+        with open(model_file, "rb") as f:
+            graph_def.ParseFromString(f.read())
     with graph.as_default():
         tf.import_graph_def(graph_def)
 
@@ -84,6 +95,94 @@ def read_tensor_from_image_file(file_name,
     return result
 
 
+def detect_image_format(data):
+    """
+    Determines the format of the encoded image from its first bytes.
+
+    :param data: the encoded image
+    :type data: bytes
+    :return: the format (png/gif/bmp/jpg), jpg if not recognized
+    :rtype: str
+    """
+
+    if data.startswith(b"\x89PNG"):
+        return "png"
+    elif data.startswith(b"GIF8"):
+        return "gif"
+    elif data.startswith(b"BM"):
+        return "bmp"
+    else:
+        return "jpg"
+
+
+def create_image_decoder(input_height, input_width, input_mean=0, input_std=255):
+    """
+    Builds a graph for turning encoded images into tensors (decoding, resizing and normalizing them like
+    read_tensor_from_image_file does). Unlike read_tensor_from_image_file, no operations get added per image,
+    so the graph can be used for any number of images.
+
+    :param input_height: the image height
+    :type input_height: int
+    :param input_width: the image width
+    :type input_width: int
+    :param input_mean: the mean to use
+    :type input_mean: int
+    :param input_std: the standard deviation to use
+    :type input_std: int
+    :return: the graph, the placeholder for the encoded image and the output tensor for each format (see
+             detect_image_format)
+    :rtype: tuple
+    """
+
+    graph = tf.Graph()
+    with graph.as_default():
+        encoded = tf.compat.v1.placeholder(tf.string, name="encoded")
+        readers = {
+            "png": tf.image.decode_png(encoded, channels=3, name="png_reader"),
+            "gif": tf.squeeze(tf.image.decode_gif(encoded, name="gif_reader")),
+            "bmp": tf.image.decode_bmp(encoded, name="bmp_reader"),
+            "jpg": tf.image.decode_jpeg(encoded, channels=3, name="jpeg_reader"),
+        }
+        outputs = dict()
+        for image_format, image_reader in readers.items():
+            float_caster = tf.cast(image_reader, tf.float32)
+            dims_expander = tf.expand_dims(float_caster, 0)
+            resized = tf.compat.v1.image.resize_bilinear(dims_expander, [input_height, input_width])
+            outputs[image_format] = tf.divide(tf.subtract(resized, [input_mean]), [input_std])
+    graph.finalize()
+
+    return graph, encoded, outputs
+
+
+def warmup_graph(sess, graph, input_layer, output_layer, height, width, runs=1):
+    """
+    Classifies a dummy image a number of times, so that the first real image doesn't pay for the lazy
+    initialization of the session.
+
+    :param sess: the tensorflow session to warm up
+    :type sess: tf.Session
+    :param graph: the tensorflow graph to use
+    :type graph: tf.Graph
+    :param input_layer: the name of input layer in the graph to use
+    :type input_layer: str
+    :param output_layer: the name of output layer in the graph to use
+    :type output_layer: str
+    :param height: the expected height of the images
+    :type height: int
+    :param width: the expected width of the images
+    :type width: int
+    :param runs: the number of runs
+    :type runs: int
+    :return: the time in seconds of each run
+    :rtype: list
+    """
+
+    input_tensor = graph.get_operation_by_name("import/" + input_layer).outputs[0]
+    output_tensor = graph.get_operation_by_name("import/" + output_layer).outputs[0]
+    dummy = np.random.RandomState(0).rand(1, height, width, 3).astype(np.float32)
+    return warmup(sess, output_tensor, {input_tensor: dummy}, runs=runs)
+
+
 def load_labels(label_file):
     """
     Loads the labels from the specified text file.
@@ -0,0 +1,206 @@
+# Copyright 2019 University of Waikato, Hamilton, NZ.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import json
+import queue
+import threading
+import time
+import traceback
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from socketserver import ThreadingMixIn
+from urllib.parse import urlparse, parse_qs
+
+
+class MicroBatcher(object):
+    """
+    Merges the items submitted concurrently (eg by the threads of a server) into batches: a batch gets processed
+    once it contains the maximum number of items or the maximum time since its first item arrived has passed.
+    The batches get processed in a single worker thread.
+    """
+
+    def __init__(self, process, max_batch_size=8, max_wait=0.01):
+        """
+        Initializes the batcher.
+
+        :param process: the function processing a batch, receiving the list of items and returning the list
+                        of results (one per item, in the same order)
+        :param max_batch_size: the maximum number of items per batch
+        :type max_batch_size: int
+        :param max_wait: the maximum time in seconds to wait for further items after the first item of a batch
+        :type max_wait: float
+        """
+
+        self.process = process
+        self.max_batch_size = max(1, max_batch_size)
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the worker thread.
+        """
+
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """
+        Stops the worker thread (once the queued items have been processed).
+        """
+
+        if self._thread is not None:
+            self._queue.put(None)
+            self._thread.join()
+            self._thread = None
+
+    def submit(self, item):
+        """
+        Submits the item and waits for its result.
+
+        :param item: the item to process
+        :return: the result for the item
+        :raises Exception: the error that occurred when processing the batch the item was part of
+        """
+
+        request = {'item': item, 'done': threading.Event(), 'result': None, 'error': None}
+        self._queue.put(request)
+        request['done'].wait()
+        if request['error'] is not None:
+            raise request['error']
+        return request['result']
+
+    def _next_batch(self):
+        """
+        Waits for the next batch of requests.
+
+        :return: the requests, None if stopped
+        :rtype: list
+        """
+
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.time()
+            try:
+                request = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if request is None:
+                # process this batch first
+                self._queue.put(None)
+                break
+            batch.append(request)
+        return batch
+
+    def _run(self):
+        """
+        Processes the batches until stopped.
+        """
+
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                break
+            try:
+                results = self.process([request['item'] for request in batch])
+                for request, result in zip(batch, results):
+                    request['result'] = result
+            except Exception as e:
+                for request in batch:
+                    request['error'] = e
+            for request in batch:
+                request['done'].set()
+
+
+class PredictionRequestHandler(BaseHTTPRequestHandler):
+    """
+    Handles the HTTP requests of a PredictionServer: "POST /predict" with the encoded image as body (and
+    optional query parameters) returns the predictions as JSON, "GET /health" whether the server is up.
+    """
+
+    def send_json(self, status, content):
+        """
+        Sends the content as JSON.
+
+        :param status: the HTTP status code
+        :type status: int
+        :param content: the content to send
+        :type content: dict
+        """
+
+        data = json.dumps(content).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if urlparse(self.path).path == "/health":
+            self.send_json(200, {'status': 'ok'})
+        else:
+            self.send_json(404, {'error': "Unknown path: %s" % self.path})
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != "/predict":
+            self.send_json(404, {'error': "Unknown path: %s" % self.path})
+            return
+        length = self.headers.get("Content-Length")
+        if length is None:
+            self.send_json(411, {'error': "Content-Length required"})
+            return
+        body = self.rfile.read(int(length))
+        params = dict((k, v[-1]) for k, v in parse_qs(url.query).items())
+        try:
+            self.send_json(200, self.server.predict(body, params))
+        except ValueError as e:
+            self.send_json(400, {'error': str(e)})
+        except Exception as e:
+            print(traceback.format_exc())
+            self.send_json(500, {'error': str(e)})
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class PredictionServer(ThreadingMixIn, HTTPServer):
+    """
+    Multi-threaded HTTP server handing the posted images to a prediction function (which is expected to submit
+    them to a MicroBatcher).
+    """
+
+    daemon_threads = True
+
+    def __init__(self, address, predict, verbose=False):
+        """
+        Initializes the server.
+
+        :param address: the host and port to listen on
+        :type address: tuple
+        :param predict: the function returning the predictions (dict) for the encoded image and query parameters;
+                        should raise a ValueError for invalid requests (eg images that can't be decoded)
+        :param verbose: whether to log the requests
+        :type verbose: bool
+        """
+
+        HTTPServer.__init__(self, address, PredictionRequestHandler)
+        self.predict = predict
+        self.verbose = verbose
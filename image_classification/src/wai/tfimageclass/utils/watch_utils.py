@@ -0,0 +1,428 @@
+# Copyright 2019 University of Waikato, Hamilton, NZ.
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ==============================================================================
+
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+from collections import OrderedDict
+
+WATCH_AUTO = "auto"
+""" Uses inotify if available, otherwise polling. """
+
+WATCH_INOTIFY = "inotify"
+""" Gets notified about new files by the kernel (Linux only). """
+
+WATCH_POLL = "poll"
+""" Lists the directory at regular intervals. """
+
+WATCH_MODES = [WATCH_AUTO, WATCH_INOTIFY, WATCH_POLL]
+""" The available modes for watching a directory. """
+
+IMAGE_EXTENSIONS = (".png", ".jpg")
+""" The extensions of the files to watch for (lower case). """
+
+# inotify event masks (see inotify(7))
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+INOTIFY_EVENT = struct.Struct("iIII")
+
+PNG_END = b"\x00\x00\x00\x00IEND\xaeB`\x82"
+""" The (empty) IEND chunk concluding a PNG file. """
+
+JPEG_END = b"\xff\xd9"
+""" The end-of-image marker of a JPEG file (can't occur in the compressed data). """
+
+JPEG_TAIL_SIZE = 1024
+""" The number of bytes at the end of a JPEG to look for the end-of-image marker in (allowing for padding). """
+
+RECHECK_INTERVAL = 0.1
+""" The interval (in seconds) for re-checking files that weren't complete yet. """
+
+STABLE_TIME = 5.0
+""" The time (in seconds) after which a file that never passes the completeness check (eg due to trailing bytes)
+gets handed out anyway, provided its size and modification time haven't changed in the meantime. """
+
+
+def is_image_complete(path):
+    """
+    Checks whether the image has been written completely: PNGs have to end with the IEND chunk, JPEGs have to
+    contain the end-of-image marker near their end. Other files have to be non-empty.
+
+    :param path: the image to check
+    :type path: str
+    :return: whether the image is complete
+    :rtype: bool
+    """
+
+    try:
+        with open(path, "rb") as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            lower = path.lower()
+            if lower.endswith(".png"):
+                if size < len(PNG_END):
+                    return False
+                f.seek(size - len(PNG_END))
+                return f.read() == PNG_END
+            elif lower.endswith(".jpg") or lower.endswith(".jpeg"):
+                f.seek(max(0, size - JPEG_TAIL_SIZE))
+                return JPEG_END in f.read()
+            else:
+                return size > 0
+    except OSError:
+        return False
+
+
+class Inotify(object):
+    """
+    Minimal wrapper around the Linux inotify API (via ctypes), watching a single directory.
+    """
+
+    def __init__(self, directory, mask):
+        """
+        Starts watching the directory.
+
+        :param directory: the directory to watch
+        :type directory: str
+        :param mask: the events to watch for
+        :type mask: int
+        """
+
+        libc_name = ctypes.util.find_library("c")
+        if libc_name is None:
+            raise OSError("C library not found")
+        libc = ctypes.CDLL(libc_name, use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise OSError("inotify not available")
+        self.fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch failed for %s" % directory)
+
+    def read(self, timeout):
+        """
+        Waits for events.
+
+        :param timeout: the maximum time to wait in seconds
+        :type timeout: float
+        :return: the events, as (mask, name) tuples
+        :rtype: list
+        """
+
+        readable, _, _ = select.select([self.fd], [], [], max(0.0, timeout))
+        if len(readable) == 0:
+            return []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return []
+        result = []
+        offset = 0
+        while offset + INOTIFY_EVENT.size <= len(data):
+            _, mask, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+            offset += INOTIFY_EVENT.size
+            name = os.fsdecode(data[offset:offset + length].rstrip(b"\0"))
+            offset += length
+            result.append((mask, name))
+        return result
+
+    def close(self):
+        """
+        Stops watching.
+        """
+
+        if self.fd >= 0:
+            os.close(self.fd)
+            self.fd = -1
+
+
+def release_claims(claim_dir, directory):
+    """
+    Moves the images left in a claim directory (eg by a process that got killed) back into the watched directory.
+
+    :param claim_dir: the claim directory
+    :type claim_dir: str
+    :param directory: the watched directory
+    :type directory: str
+    :return: the number of images moved back
+    :rtype: int
+    """
+
+    result = 0
+    for name in os.listdir(claim_dir):
+        path = os.path.join(claim_dir, name)
+        if os.path.isfile(path):
+            os.rename(path, os.path.join(directory, name))
+            result += 1
+    return result
+
+
+class ImageWatcher(object):
+    """
+    Watches a directory for new images, handing out each image once it has been written completely
+    (see is_image_complete), or once its size and modification time haven't changed for the stable time
+    (for images that never pass the check, eg due to trailing bytes). With inotify, images get queued when they get closed after writing or moved into
+    the directory, otherwise the directory gets listed at regular intervals. Images already present get
+    queued as well. An image handed out doesn't get handed out again while it is still in the directory, unless
+    it gets written/moved into the directory again (when polling: unless its modification time changes).
+    With a claim directory, images get moved there (atomically) before being handed out, so that several
+    processes can watch the same directory, with each image going to exactly one of them.
+    """
+
+    def __init__(self, directory, mode=WATCH_AUTO, poll_interval=1.0, extensions=IMAGE_EXTENSIONS, claim_dir=None,
+                 stable_time=STABLE_TIME):
+        """
+        Starts watching the directory.
+
+        :param directory: the directory to watch
+        :type directory: str
+        :param mode: how to watch the directory (auto/inotify/poll)
+        :type mode: str
+        :param poll_interval: the interval in seconds for listing the directory when polling
+        :type poll_interval: float
+        :param extensions: the extensions (lower case) of the images to watch for
+        :type extensions: tuple
+        :param claim_dir: the directory (on the same file system) to move the images to before handing them out,
+                          None to hand out the images in place
+        :type claim_dir: str
+        :param stable_time: the time in seconds after which images that don't pass the completeness check get
+                            handed out anyway if they haven't changed, <=0 to wait for them to pass indefinitely
+        :type stable_time: float
+        """
+
+        if mode not in WATCH_MODES:
+            raise Exception("Unknown watch mode '%s', available: %s" % (mode, ", ".join(WATCH_MODES)))
+
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.extensions = tuple(extensions)
+        self.claim_dir = claim_dir
+        self.stable_time = stable_time
+        # images waiting to be handed out (name -> None), in order of appearance
+        self._pending = OrderedDict()
+        # images handed out, that haven't disappeared from the directory yet (name -> modification time)
+        self._handed_out = dict()
+        # images that didn't pass the completeness check (name -> (size, modification time), unchanged since)
+        self._incomplete = dict()
+        self._last_listing = None
+        self._inotify = None
+        if mode != WATCH_POLL:
+            try:
+                self._inotify = Inotify(directory, IN_CLOSE_WRITE | IN_MOVED_TO | IN_MOVED_FROM | IN_DELETE)
+            except (OSError, AttributeError) as e:
+                if mode == WATCH_INOTIFY:
+                    raise
+                print("Falling back to polling %s: %s" % (directory, str(e)))
+        self._list()
+
+    @property
+    def mode(self):
+        """
+        Returns how the directory is being watched.
+
+        :return: the mode (inotify/poll)
+        :rtype: str
+        """
+
+        return WATCH_POLL if self._inotify is None else WATCH_INOTIFY
+
+    @property
+    def backlog(self):
+        """
+        Returns the number of images waiting to be handed out (including ones not written completely yet).
+
+        :return: the number of images
+        :rtype: int
+        """
+
+        return len(self._pending)
+
+    def _is_image(self, name):
+        """
+        Checks whether the file is an image to watch for.
+
+        :param name: the file name
+        :type name: str
+        :return: whether to watch for it
+        :rtype: bool
+        """
+
+        return name.lower().endswith(self.extensions) and not name.startswith(".")
+
+    def _list(self):
+        """
+        Lists the directory, queueing any images that haven't been handed out yet.
+        """
+
+        names = set()
+        for entry in os.scandir(self.directory):
+            name = entry.name
+            if self._is_image(name):
+                names.add(name)
+                if name in self._handed_out:
+                    try:
+                        if entry.stat().st_mtime_ns == self._handed_out[name]:
+                            continue
+                    except OSError:
+                        continue
+                    del self._handed_out[name]
+                self._pending[name] = None
+        # forget about images that have gone
+        for name in [x for x in self._handed_out if x not in names]:
+            del self._handed_out[name]
+        for name in [x for x in self._pending if x not in names]:
+            del self._pending[name]
+        for name in [x for x in self._incomplete if x not in names]:
+            del self._incomplete[name]
+        self._last_listing = time.time()
+
+    def _process_events(self, timeout):
+        """
+        Waits for inotify events and updates the queue.
+
+        :param timeout: the maximum time to wait in seconds
+        :type timeout: float
+        """
+
+        for mask, name in self._inotify.read(timeout):
+            if mask & (IN_Q_OVERFLOW | IN_IGNORED):
+                # events got lost or the watch got removed, fall back to listing
+                if mask & IN_IGNORED:
+                    print("Watch on %s got removed, falling back to polling" % self.directory)
+                    self._inotify.close()
+                    self._inotify = None
+                self._list()
+            elif not self._is_image(name):
+                continue
+            elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                self._handed_out.pop(name, None)
+                self._pending[name] = None
+            elif mask & (IN_MOVED_FROM | IN_DELETE):
+                self._handed_out.pop(name, None)
+                self._pending.pop(name, None)
+                self._incomplete.pop(name, None)
+
+    def _is_stable(self, name, stat):
+        """
+        Checks whether an image that didn't pass the completeness check has been unchanged (size and modification
+        time) for the stable time, logging when it gets handed out regardless.
+
+        :param name: the file name
+        :type name: str
+        :param stat: the current stats of the image
+        :type stat: os.stat_result
+        :return: whether to consider it complete
+        :rtype: bool
+        """
+
+        if self.stable_time <= 0:
+            return False
+        now = time.time()
+        state = (stat.st_size, stat.st_mtime_ns)
+        if name not in self._incomplete or self._incomplete[name][0] != state:
+            self._incomplete[name] = (state, now)
+            return False
+        if now - self._incomplete[name][1] < self.stable_time:
+            return False
+        print("%s failed the completeness check, but hasn't changed for %.1f s, handing it out anyway"
+              % (os.path.join(self.directory, name), now - self._incomplete[name][1]))
+        return True
+
+    def _take_ready(self, max_files):
+        """
+        Removes the images that are complete from the queue.
+
+        :param max_files: the maximum number of images to take, <1 for all
+        :type max_files: int
+        :return: the paths of the images
+        :rtype: list
+        """
+
+        result = []
+        for name in list(self._pending):
+            if 0 < max_files <= len(result):
+                break
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                del self._pending[name]
+                self._incomplete.pop(name, None)
+                continue
+            if not is_image_complete(path) and not self._is_stable(name, stat):
+                continue
+            del self._pending[name]
+            self._incomplete.pop(name, None)
+            if self.claim_dir is None:
+                self._handed_out[name] = stat.st_mtime_ns
+                result.append(path)
+                continue
+            # another process may have claimed the image in the meantime
+            claimed = os.path.join(self.claim_dir, name)
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            result.append(claimed)
+        return result
+
+    def get(self, max_files=-1, timeout=0.0):
+        """
+        Returns the next complete images, waiting for new images if there are none (yet).
+
+        :param max_files: the maximum number of images to return, <1 for all that are available
+        :type max_files: int
+        :param timeout: the maximum time in seconds to wait for images, 0 to return immediately
+        :type timeout: float
+        :return: the paths of the images, empty if none became available in time
+        :rtype: list
+        """
+
+        end = time.time() + timeout
+        while True:
+            if self._inotify is None and time.time() - self._last_listing >= self.poll_interval:
+                self._list()
+            result = self._take_ready(max_files)
+            remaining = end - time.time()
+            if len(result) > 0 or remaining <= 0:
+                return result
+
+            # wait for something to happen: new events, re-checking incomplete images or the next listing
+            wait = remaining
+            if len(self._pending) > 0:
+                wait = min(wait, RECHECK_INTERVAL)
+            if self._inotify is not None:
+                self._process_events(wait)
+            else:
+                time.sleep(min(wait, max(0.0, self._last_listing + self.poll_interval - time.time())))
+
+    def close(self):
+        """
+        Stops watching the directory.
+        """
+
+        if self._inotify is not None:
+            self._inotify.close()
+            self._inotify = None
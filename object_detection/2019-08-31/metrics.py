@@ -0,0 +1,306 @@
+# Copyright (C) 2019 University of Waikato, Hamilton, NZ
+# Licensed under the Apache License, Version 2.0
+#
+# Rolling metrics for long-running predictions: latency histograms and percentiles per stage, throughput and
+# queue backlogs, periodically written to a Prometheus textfile (eg for node_exporter's textfile collector) or
+# a JSON status file. Memory usage is constant, regardless of how long the predictions run.
+
+from collections import deque
+import json
+import os
+import threading
+import time
+
+import numpy as np
+
+FORMAT_PROMETHEUS = "prometheus"
+""" Prometheus text exposition format. """
+
+FORMAT_JSON = "json"
+""" JSON status file. """
+
+FORMATS = [FORMAT_PROMETHEUS, FORMAT_JSON]
+""" The available formats for the metrics file. """
+
+STAGE_DECODE = "decode"
+""" Loading/decoding the images of a batch. """
+
+STAGE_INFERENCE = "inference"
+""" Running the inference on a batch. """
+
+STAGE_WRITE = "write"
+""" Writing the predictions of a batch and moving/deleting its images. """
+
+BUCKETS = [0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 25.0, 50.0, 100.0]
+""" The upper bounds (seconds) of the latency histogram buckets. """
+
+QUANTILES = [0.5, 0.95, 0.99]
+""" The quantiles output for the recent latencies. """
+
+PREFIX = "objdet_predict_"
+""" The prefix for the Prometheus metric names. """
+
+
+class LatencyStats(object):
+    """
+    Latencies of a stage: a cumulative histogram (constant size) and the most recent values for percentiles.
+    """
+
+    def __init__(self, window):
+        """
+        Initializes the statistics.
+
+        :param window: the number of recent values to compute the percentiles from
+        :type window: int
+        """
+
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.recent = deque(maxlen=window)
+
+    def observe(self, seconds):
+        """
+        Adds a latency.
+
+        :param seconds: the latency in seconds
+        :type seconds: float
+        """
+
+        self.buckets[int(np.searchsorted(BUCKETS, seconds))] += 1
+        self.count += 1
+        self.sum += seconds
+        self.recent.append(seconds)
+
+    def quantiles(self):
+        """
+        Computes the quantiles of the recent latencies.
+
+        :return: the quantiles (None if no latencies yet)
+        :rtype: list
+        """
+
+        if len(self.recent) == 0:
+            return [None] * len(QUANTILES)
+        return np.quantile(np.array(self.recent), QUANTILES).tolist()
+
+
+class InferenceMetrics(object):
+    """
+    Collects the metrics of the predictions (thread-safe) and writes them to a file at regular intervals,
+    replacing the file atomically.
+    """
+
+    def __init__(self, path, output_format=FORMAT_PROMETHEUS, interval=10.0, window=1000):
+        """
+        Initializes the metrics.
+
+        :param path: the file to write the metrics to
+        :type path: str
+        :param output_format: the format of the file (prometheus/json)
+        :type output_format: str
+        :param interval: the interval in seconds for writing the file
+        :type interval: float
+        :param window: the number of recent batches to compute the latency percentiles from
+        :type window: int
+        """
+
+        if output_format not in FORMATS:
+            raise Exception("Unknown metrics format '%s', available: %s" % (output_format, ", ".join(FORMATS)))
+
+        self.path = path
+        self.output_format = output_format
+        self.interval = interval
+        self.window = window
+        self._lock = threading.Lock()
+        self._stages = dict()
+        self._gauges = dict()
+        self._images = 0
+        self._batches = 0
+        self._start = time.time()
+        self._last_flush = self._start
+        self._last_flush_images = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def observe(self, stage, seconds):
+        """
+        Adds the latency of a batch in a stage.
+
+        :param stage: the stage (decode/inference/write)
+        :type stage: str
+        :param seconds: the latency in seconds
+        :type seconds: float
+        """
+
+        with self._lock:
+            if stage not in self._stages:
+                self._stages[stage] = LatencyStats(self.window)
+            self._stages[stage].observe(seconds)
+
+    def add_batch(self, num_images):
+        """
+        Counts a finished batch.
+
+        :param num_images: the number of images in the batch
+        :type num_images: int
+        """
+
+        with self._lock:
+            self._images += num_images
+            self._batches += 1
+
+    def gauge(self, name, func):
+        """
+        Registers a gauge (eg a queue backlog), replacing any gauge with the same name.
+
+        :param name: the name of the gauge
+        :type name: str
+        :param func: the function returning the current value (called when writing the file)
+        """
+
+        with self._lock:
+            self._gauges[name] = func
+
+    def start(self):
+        """
+        Starts writing the file at regular intervals (in a background thread).
+        """
+
+        def run():
+            while not self._stop.wait(self.interval):
+                self.flush()
+
+        self._thread = threading.Thread(target=run, daemon=True)
+        self._thread.start()
+
+    def close(self):
+        """
+        Stops the background thread and writes the file one last time.
+        """
+
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+    def snapshot(self):
+        """
+        Computes the current metrics, with the throughput since the previous snapshot.
+
+        :return: the metrics
+        :rtype: dict
+        """
+
+        with self._lock:
+            now = time.time()
+            elapsed = now - self._last_flush
+            images_per_second = (self._images - self._last_flush_images) / elapsed if elapsed > 0 else 0.0
+            self._last_flush = now
+            self._last_flush_images = self._images
+            stages = dict()
+            for stage, stats in self._stages.items():
+                stages[stage] = {
+                    'count': stats.count,
+                    'sum': stats.sum,
+                    'buckets': list(stats.buckets),
+                    'quantiles': stats.quantiles(),
+                }
+            gauges = dict((name, func()) for name, func in self._gauges.items())
+            return {
+                'timestamp': now,
+                'uptime_seconds': now - self._start,
+                'images_total': self._images,
+                'batches_total': self._batches,
+                'images_per_second': images_per_second,
+                'stages': stages,
+                'gauges': gauges,
+            }
+
+    def flush(self):
+        """
+        Writes the current metrics to the file (via a temporary file, renamed when complete).
+        """
+
+        snapshot = self.snapshot()
+        if self.output_format == FORMAT_JSON:
+            content = to_json(snapshot)
+        else:
+            content = to_prometheus(snapshot)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            f.write(content)
+        os.replace(tmp_path, self.path)
+
+
+def to_json(snapshot):
+    """
+    Turns the metrics into a JSON status document (percentiles in milliseconds).
+
+    :param snapshot: the metrics (see InferenceMetrics.snapshot)
+    :type snapshot: dict
+    :return: the JSON document
+    :rtype: str
+    """
+
+    stages = dict()
+    for stage, stats in snapshot['stages'].items():
+        stages[stage] = {
+            'count': stats['count'],
+            'mean_ms': stats['sum'] / stats['count'] * 1000 if stats['count'] > 0 else None,
+        }
+        for q, value in zip(QUANTILES, stats['quantiles']):
+            stages[stage]['p%d_ms' % int(q * 100)] = value * 1000 if value is not None else None
+    status = {
+        'timestamp': snapshot['timestamp'],
+        'uptime_seconds': snapshot['uptime_seconds'],
+        'images_total': snapshot['images_total'],
+        'batches_total': snapshot['batches_total'],
+        'images_per_second': snapshot['images_per_second'],
+        'stages': stages,
+        'backlog': snapshot['gauges'],
+    }
+    return json.dumps(status, indent=2) + "\n"
+
+
+def to_prometheus(snapshot):
+    """
+    Turns the metrics into the Prometheus text exposition format.
+
+    :param snapshot: the metrics (see InferenceMetrics.snapshot)
+    :type snapshot: dict
+    :return: the text
+    :rtype: str
+    """
+
+    lines = []
+    lines.append("# HELP %sbatch_seconds Time spent per batch in each stage." % PREFIX)
+    lines.append("# TYPE %sbatch_seconds histogram" % PREFIX)
+    for stage, stats in sorted(snapshot['stages'].items()):
+        cumulative = 0
+        for bound, count in zip(BUCKETS + ["+Inf"], stats['buckets']):
+            cumulative += count
+            lines.append('%sbatch_seconds_bucket{stage="%s",le="%s"} %d' % (PREFIX, stage, bound, cumulative))
+        lines.append('%sbatch_seconds_sum{stage="%s"} %r' % (PREFIX, stage, stats['sum']))
+        lines.append('%sbatch_seconds_count{stage="%s"} %d' % (PREFIX, stage, stats['count']))
+    lines.append("# HELP %srecent_batch_seconds Quantiles of the time spent per recent batch in each stage." % PREFIX)
+    lines.append("# TYPE %srecent_batch_seconds gauge" % PREFIX)
+    for stage, stats in sorted(snapshot['stages'].items()):
+        for q, value in zip(QUANTILES, stats['quantiles']):
+            if value is not None:
+                lines.append('%srecent_batch_seconds{stage="%s",quantile="%s"} %r' % (PREFIX, stage, q, value))
+    lines.append("# HELP %simages_total Number of images predicted." % PREFIX)
+    lines.append("# TYPE %simages_total counter" % PREFIX)
+    lines.append("%simages_total %d" % (PREFIX, snapshot['images_total']))
+    lines.append("# HELP %sbatches_total Number of batches predicted." % PREFIX)
+    lines.append("# TYPE %sbatches_total counter" % PREFIX)
+    lines.append("%sbatches_total %d" % (PREFIX, snapshot['batches_total']))
+    lines.append("# HELP %simages_per_second Images predicted per second since the previous update." % PREFIX)
+    lines.append("# TYPE %simages_per_second gauge" % PREFIX)
+    lines.append("%simages_per_second %r" % (PREFIX, snapshot['images_per_second']))
+    lines.append("# HELP %sbacklog Number of images/batches waiting in each queue." % PREFIX)
+    lines.append("# TYPE %sbacklog gauge" % PREFIX)
+    for name, value in sorted(snapshot['gauges'].items()):
+        lines.append('%sbacklog{queue="%s"} %d' % (PREFIX, name, value))
+    return "\n".join(lines) + "\n"
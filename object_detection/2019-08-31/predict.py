@@ -3,29 +3,78 @@
 # Licensed under Apache 2.0 (Most likely, since tensorflow is Apache 2.0)
 # Modifications Copyright (C) 2018 University of Waikato, Hamilton, NZ
 #
-# Performs predictions on combined images from all images present in the folder passed as "prediction_in", then outputs the results as
+# Performs predictions on batches of images present in the folder passed as "prediction_in", then outputs the results as
 # csv files in the folder passed as "prediction_out"
 #
-# The number of images to combine at a time before prediction can be specified (passed as a parameter)
+# The number of images to batch at a time before prediction can be specified (passed as a parameter); images of
+# different sizes either get padded or resized to a common size
 # Score threshold can be specified (passed as a parameter) to ignore all rois with low score
-# Can run in a continuous mode, where it will run indefinitely
+# Can run in a continuous mode, where it will run indefinitely, picking up new images as soon as they have been
+# written completely
+# Can run several worker processes (each with its own session) sharing the input folder
 
+import multiprocessing
 import numpy as np
 import os
+import queue
 import sys
+import threading
+import time
+import traceback
 import tensorflow as tf
 import argparse
 from PIL import Image
 from tensorflow import Graph
 from datetime import datetime
-import time
 
 sys.path.append("..")
-from object_detection.utils import ops as utils_ops
 from object_detection.utils import label_map_util
+from object_detection.utils import np_box_list
+from object_detection.utils import np_box_list_ops
+from wai.tfimageclass.utils.watch_utils import ImageWatcher, release_claims, WATCH_AUTO, WATCH_MODES, IMAGE_EXTENSIONS
+from metrics import InferenceMetrics, FORMAT_PROMETHEUS, FORMATS, STAGE_DECODE, STAGE_INFERENCE, STAGE_WRITE
+from sinks import CsvSink, create_sink, SINK_CSV, SINKS, SINK_EXTENSIONS
+from wai.tfimageclass.utils.graph_utils import load_optimized_graph_def, warmup
+
+BATCH_MODE_PAD = "pad"
+""" Images of a batch get padded (bottom/right) to the largest width/height in the batch. """
+
+BATCH_MODE_RESIZE = "resize"
+""" Images of a batch get resized to the largest width/height in the batch. """
+
+BATCH_MODES = [BATCH_MODE_PAD, BATCH_MODE_RESIZE]
+""" The available modes for combining images of different sizes into a batch. """
+
+OUTPUT_KEYS = ['num_detections', 'detection_boxes', 'detection_scores', 'detection_classes']
+""" The names of the output tensors (masks, if any, are not output). """
+
+INFERENCE_TENSORS = {}
+""" The resolved input/output tensors per graph (see get_inference_tensors). """
+
+IDLE_TIMEOUT = 1.0
+""" The time (in seconds) without new images after which the predictions stop (unless continuous), provided no
+images are waiting to be written completely. """
+
+PIPELINE_POLL_INTERVAL = 0.1
+""" The interval (in seconds) in which the pipeline threads check for being stopped while waiting on a queue. """
 
-OUTPUT_COMBINED = False
-""" Whether to output CSV file with ROIs for combined images as well (only for debugging). """
+TILE_IOU_THRESHOLD = 0.5
+""" The IoU above which detections of overlapping tiles are considered duplicates. """
+
+TILE_STD_STRIDE = 4
+""" The stride (in pixels) for sampling a tile when estimating its standard deviation. """
+
+WORKER_INTER_OP_THREADS = 1
+""" The default number of inter-op threads of each worker process. """
+
+WORKER_CLAIM_DIR = ".claimed-%d"
+""" The directory (in the input directory) a worker moves the images it predicts to. """
+
+WORKER_TIME_DIR = "worker-%d"
+""" The directory (in the output directory) for the inference times of a worker. """
+
+BENCHMARK_TIMEOUT = 600.0
+""" The maximum time in seconds to wait for the workers of a benchmark. """
 
 
 def load_image_into_numpy_array(image):
@@ -45,82 +94,296 @@ def load_image_into_numpy_array(image):
     return im_arr
 
 
-def run_inference_for_single_image(image, sess):
+def get_inference_tensors(graph):
     """
-    Obtain predictions for image.
+    Resolves the input and output tensors of the graph. This only happens on the first call for a graph,
+    subsequent calls return the cached tensors.
 
-    :param image: the image to generate predictions for
-    :type image: str
+    :param graph: the graph to get the tensors from
+    :type graph: tf.Graph
+    :return: the tensors: image_tensor, outputs (dict of output tensors)
+    :rtype: dict
+    """
+
+    if graph in INFERENCE_TENSORS:
+        return INFERENCE_TENSORS[graph]
+
+    with graph.as_default():
+        # Get handles to input and output tensors
+        ops = graph.get_operations()
+        all_tensor_names = {output.name for op in ops for output in op.outputs}
+        outputs = {}
+        for key in OUTPUT_KEYS:
+            tensor_name = key + ':0'
+            if tensor_name in all_tensor_names:
+                outputs[key] = graph.get_tensor_by_name(tensor_name)
+        image_tensor = graph.get_tensor_by_name('image_tensor:0')
+
+    result = {
+        'image_tensor': image_tensor,
+        'outputs': outputs,
+    }
+    INFERENCE_TENSORS[graph] = result
+    return result
+
+
+def create_batch(images, batch_mode):
+    """
+    Combines the images into a single batch tensor. Images of different sizes get padded (at the bottom/right)
+    or resized to the largest width/height of the batch.
+
+    :param images: the images to combine
+    :type images: list
+    :param batch_mode: how to combine images of different sizes (pad/resize)
+    :type batch_mode: str
+    :return: the batch (N x height x width x 3) and, per image, the factors (x, y) to scale normalized coordinates
+             of the batch to normalized coordinates of the image
+    :rtype: tuple
+    """
+
+    if batch_mode not in BATCH_MODES:
+        raise Exception("Unknown batch mode '%s', available: %s" % (batch_mode, ", ".join(BATCH_MODES)))
+
+    width = max(image.width for image in images)
+    height = max(image.height for image in images)
+    batch = np.zeros((len(images), height, width, 3), np.uint8)
+    factors = []
+    for i, image in enumerate(images):
+        if (image.width, image.height) == (width, height):
+            batch[i] = load_image_into_numpy_array(image)
+            factors.append((1.0, 1.0))
+        elif batch_mode == BATCH_MODE_PAD:
+            batch[i, :image.height, :image.width] = load_image_into_numpy_array(image)
+            factors.append((width / image.width, height / image.height))
+        else:
+            batch[i] = load_image_into_numpy_array(image.resize((width, height), Image.BILINEAR))
+            factors.append((1.0, 1.0))
+
+    return batch, factors
+
+
+def run_inference_for_batch(batch, factors, sess):
+    """
+    Obtain predictions for a batch of images.
+
+    :param batch: the batch of images (N x height x width x 3) to generate predictions for
+    :type batch: np.ndarray
+    :param factors: the factors (x, y) for each image to scale normalized coordinates of the batch with
+    :type factors: list
     :param sess: the tensorflow session
     :type sess: tf.Session
-    :return: the predictions
-    :rtype: dict
+    :return: the predictions, one dict per image (boxes in normalized coordinates of the image, ignoring
+             any boxes that lie in the padding)
+    :rtype: list
     """
 
-    # Get handles to input and output tensors
-    ops = tf.compat.v1.get_default_graph().get_operations()
-    all_tensor_names = {output.name for op in ops for output in op.outputs}
-    tensor_dict = {}
-    for key in [
-        'num_detections', 'detection_boxes', 'detection_scores',
-        'detection_classes', 'detection_masks'
-    ]:
-        tensor_name = key + ':0'
-        if tensor_name in all_tensor_names:
-            tensor_dict[key] = tf.compat.v1.get_default_graph().get_tensor_by_name(
-                tensor_name)
-    if 'detection_masks' in tensor_dict:
-        # The following processing is only for single image
-        detection_boxes = tf.squeeze(tensor_dict['detection_boxes'], [0])
-        detection_masks = tf.squeeze(tensor_dict['detection_masks'], [0])
-        # Reframe is required to translate mask from box coordinates to image coordinates and fit the image size.
-        real_num_detection = tf.cast(tensor_dict['num_detections'][0], tf.int32)
-        detection_boxes = tf.slice(detection_boxes, [0, 0], [real_num_detection, -1])
-        detection_masks = tf.slice(detection_masks, [0, 0, 0], [real_num_detection, -1, -1])
-        detection_masks_reframed = utils_ops.reframe_box_masks_to_image_masks(
-            detection_masks, detection_boxes, image.shape[0], image.shape[1])
-        detection_masks_reframed = tf.cast(
-            tf.greater(detection_masks_reframed, 0.5), tf.uint8)
-        # Follow the convention by adding back the batch dimension
-        tensor_dict['detection_masks'] = tf.expand_dims(
-            detection_masks_reframed, 0)
-    image_tensor = tf.compat.v1.get_default_graph().get_tensor_by_name('image_tensor:0')
+    # Get the (cached) handles to input and output tensors
+    tensors = get_inference_tensors(sess.graph)
 
     # Run inference
-    output_dict = sess.run(tensor_dict,
-                           feed_dict={image_tensor: np.expand_dims(image, 0)})
+    output_dict = sess.run(tensors['outputs'],
+                           feed_dict={tensors['image_tensor']: batch})
+
+    # Split the outputs into the images, mapping the boxes back to the images
+    result = []
+    for i, (factor_x, factor_y) in enumerate(factors):
+        num_detections = int(output_dict['num_detections'][i])
+        boxes = output_dict['detection_boxes'][i][:num_detections] * [factor_y, factor_x, factor_y, factor_x]
+        # Ignore boxes within the padding, clip the others to the image
+        inside = (boxes[:, 0] < 1.0) & (boxes[:, 1] < 1.0)
+        result.append({
+            'num_detections': int(np.count_nonzero(inside)),
+            'detection_boxes': np.clip(boxes[inside], 0.0, 1.0),
+            'detection_scores': output_dict['detection_scores'][i][:num_detections][inside],
+            'detection_classes': output_dict['detection_classes'][i][:num_detections][inside].astype(np.uint8),
+        })
+    return result
 
-    # all outputs are float32 numpy arrays, so convert types as appropriate
-    output_dict['num_detections'] = int(output_dict['num_detections'][0])
-    output_dict['detection_classes'] = output_dict[
-        'detection_classes'][0].astype(np.uint8)
-    output_dict['detection_boxes'] = output_dict['detection_boxes'][0]
-    output_dict['detection_scores'] = output_dict['detection_scores'][0]
-    if 'detection_masks' in output_dict:
-        output_dict['detection_masks'] = output_dict['detection_masks'][0]
-    return output_dict
 
+def tile_positions(length, tile_size, tile_overlap):
+    """
+    Determines the offsets of the tiles along one dimension of an image. The tiles overlap by (at least) the
+    specified number of pixels, with the last tile aligned with the end of the image.
 
-def load_frozen_graph(graph_path):
+    :param length: the width/height of the image
+    :type length: int
+    :param tile_size: the width/height of the tiles
+    :type tile_size: int
+    :param tile_overlap: the number of pixels neighbouring tiles overlap
+    :type tile_overlap: int
+    :return: the offsets
+    :rtype: list
     """
-    Loads the provided frozen graph into detection_graph to use with prediction.
+
+    if length <= tile_size:
+        return [0]
+    result = list(range(0, length - tile_size + 1, max(1, tile_size - tile_overlap)))
+    if result[-1] + tile_size < length:
+        result.append(length - tile_size)
+    return result
+
+
+def run_inference_tiled(image, sess, tile_size, tile_overlap, tile_batch_size, score_threshold,
+                        iou_threshold=TILE_IOU_THRESHOLD, tile_min_std=0.0):
+    """
+    Obtain predictions for a (large) image by cutting it into overlapping tiles, which get presented to the graph
+    in batches. The detections of the tiles get mapped back to the image and duplicates across the tile seams
+    removed with (per class) non-maximum suppression.
+
+    :param image: the image to generate predictions for
+    :type image: Image
+    :param sess: the tensorflow session
+    :type sess: tf.Session
+    :param tile_size: the width/height of the tiles (smaller if the image is smaller)
+    :type tile_size: int
+    :param tile_overlap: the number of pixels neighbouring tiles overlap
+    :type tile_overlap: int
+    :param tile_batch_size: the number of tiles to present to the graph as a single batch
+    :type tile_batch_size: int
+    :param score_threshold: the minimum score predictions have to have
+    :type score_threshold: float
+    :param iou_threshold: the IoU above which detections are considered duplicates
+    :type iou_threshold: float
+    :param tile_min_std: the minimum standard deviation of the pixel values (of any channel) for a tile to get predicted
+                         (0 to predict all tiles)
+    :type tile_min_std: float
+    :return: the predictions for the image (like run_inference_for_batch) and the statistics of the tiles
+             (number of tiles, number of skipped tiles, number of tiles and inference seconds per batch,
+             NMS seconds)
+    :rtype: tuple
+    """
+
+    array = load_image_into_numpy_array(image)
+    height, width = array.shape[:2]
+    tile_width = min(tile_size, width)
+    tile_height = min(tile_size, height)
+    tile_batch_size = max(1, tile_batch_size)
+    tiles = [(x, y)
+             for y in tile_positions(height, tile_height, tile_overlap)
+             for x in tile_positions(width, tile_width, tile_overlap)]
+    stats = {'tiles': len(tiles), 'skipped': 0, 'batches': [], 'nms': 0.0}
+
+    # Skip tiles without content (estimating the standard deviation per channel from a subsample)
+    if tile_min_std > 0:
+        tiles = [(x, y) for x, y in tiles
+                 if array[y:y + tile_height:TILE_STD_STRIDE, x:x + tile_width:TILE_STD_STRIDE].std(axis=(0, 1)).max()
+                 >= tile_min_std]
+        stats['skipped'] = stats['tiles'] - len(tiles)
+
+    # Predict the tiles, mapping the boxes to pixel coordinates of the image
+    boxes, scores, classes = [], [], []
+    for start in range(0, len(tiles), tile_batch_size):
+        batch_tiles = tiles[start:start + tile_batch_size]
+        batch = np.stack([array[y:y + tile_height, x:x + tile_width] for x, y in batch_tiles])
+        inference_start = datetime.now()
+        output_dicts = run_inference_for_batch(batch, [(1.0, 1.0)] * len(batch_tiles), sess)
+        stats['batches'].append((len(batch_tiles), (datetime.now() - inference_start).total_seconds()))
+        for (x, y), output_dict in zip(batch_tiles, output_dicts):
+            keep = output_dict['detection_scores'] >= score_threshold
+            boxes.append(output_dict['detection_boxes'][keep] * [tile_height, tile_width, tile_height, tile_width]
+                         + [y, x, y, x])
+            scores.append(output_dict['detection_scores'][keep])
+            classes.append(output_dict['detection_classes'][keep])
+
+    # Remove the duplicates of objects in the overlap of tiles
+    nms_start = datetime.now()
+    num_boxes = sum(len(x) for x in scores)
+    if num_boxes > 0:
+        scores = np.concatenate(scores)
+        classes = np.concatenate(classes).astype(np.int64)
+        # One score column per class, the other columns get removed (< 0) before the suppression
+        class_scores = np.full((num_boxes, int(classes.max()) + 1), -1.0, dtype=np.float32)
+        class_scores[np.arange(num_boxes), classes] = scores
+        boxlist = np_box_list.BoxList(np.concatenate(boxes).astype(np.float32))
+        boxlist.add_field('scores', class_scores)
+        boxlist = np_box_list_ops.multi_class_non_max_suppression(boxlist, -0.5, iou_threshold, num_boxes)
+        boxes = boxlist.get() / np.array([height, width, height, width], dtype=np.float32)
+        scores = boxlist.get_field('scores')
+        classes = boxlist.get_field('classes')
+    else:
+        boxes = np.zeros((0, 4), dtype=np.float32)
+        scores = np.zeros((0,), dtype=np.float32)
+        classes = np.zeros((0,))
+    stats['nms'] = (datetime.now() - nms_start).total_seconds()
+
+    output_dict = {
+        'num_detections': len(scores),
+        'detection_boxes': boxes.astype(np.float32),
+        'detection_scores': scores.astype(np.float32),
+        'detection_classes': classes.astype(np.uint8),
+    }
+    return output_dict, stats
+
+
+def load_frozen_graph(graph_path, optimize=False, cache_dir=None):
+    """
+    Loads the provided frozen graph into detection_graph to use with prediction, optionally optimizing it for
+    inference first (see load_optimized_graph_def).
 
     :param graph_path: the path to the frozen graph
     :type graph_path: str
+    :param optimize: whether to optimize the graph (the optimized graph gets cached)
+    :type optimize: bool
+    :param cache_dir: the directory for caching the optimized graph, None for the directory of the graph
+    :type cache_dir: str
     :return: the graph
     :rtype: tf.Graph
     """
 
     graph = tf.Graph()  # type: Graph
     with graph.as_default():
-        od_graph_def = tf.compat.v1.GraphDef()
-        with tf.io.gfile.GFile(graph_path, 'rb') as fid:
-            serialized_graph = fid.read()
-            od_graph_def.ParseFromString(serialized_graph)
-            tf.import_graph_def(od_graph_def, name='')
+        if optimize:
+            od_graph_def = load_optimized_graph_def(graph_path, OUTPUT_KEYS, cache_dir=cache_dir)
+        else:
+            od_graph_def = tf.compat.v1.GraphDef()
+            with tf.io.gfile.GFile(graph_path, 'rb') as fid:
+                serialized_graph = fid.read()
+                od_graph_def.ParseFromString(serialized_graph)
+        tf.import_graph_def(od_graph_def, name='')
     return graph
 
 
+def parse_size(size):
+    """
+    Parses a size in the format WIDTHxHEIGHT.
+
+    :param size: the size to parse
+    :type size: str
+    :return: the width and height
+    :rtype: tuple
+    """
+
+    try:
+        width, height = size.lower().split("x")
+        return int(width), int(height)
+    except ValueError:
+        raise Exception("Invalid size '%s', expected WIDTHxHEIGHT" % size)
+
+
+def warmup_inference(sess, width, height, num_imgs=1, runs=1):
+    """
+    Runs the inference on a batch of dummy images (random noise) a number of times, so that the first real batch
+    doesn't pay for the lazy initialization of the session.
+
+    :param sess: the tensorflow session to warm up
+    :type sess: tf.Session
+    :param width: the width of the dummy images
+    :type width: int
+    :param height: the height of the dummy images
+    :type height: int
+    :param num_imgs: the number of images per batch
+    :type num_imgs: int
+    :param runs: the number of runs
+    :type runs: int
+    :return: the time in seconds of each run
+    :rtype: list
+    """
+
+    tensors = get_inference_tensors(sess.graph)
+    batch = np.random.RandomState(0).randint(0, 256, (max(1, num_imgs), height, width, 3)).astype(np.uint8)
+    return warmup(sess, tensors['outputs'], {tensors['image_tensor']: batch}, runs=runs)
+
+
 def remove_alpha_channel(image):
     """
     Converts the Image object to RGB.
@@ -136,9 +399,65 @@ def remove_alpha_channel(image):
         return image
 
 
-def predict_on_images(input_dir, sess, output_dir, tmp_dir, score_threshold, categories, num_imgs, inference_times, delete_input):
+def filter_rois(output_dict, image_size, score_threshold):
+    """
+    Determines the ROIs of an image from its predictions, for all detections at once.
+
+    :param output_dict: the predictions for the image
+    :type output_dict: dict
+    :param image_size: the width and height of the image
+    :type image_size: tuple
+    :param score_threshold: the minimum score predictions have to have
+    :type score_threshold: float
+    :return: the boxes (x0, y0, x1, y1) in image and in normalized coordinates, the labels and the scores
+    :rtype: tuple
+    """
+
+    # Loading results, ignoring the rois with a score less than the provided threshold
+    num_detections = output_dict['num_detections']
+    scores = output_dict['detection_scores'][:num_detections]
+    keep = scores >= score_threshold
+    scores = scores[keep]
+    classes = output_dict['detection_classes'][:num_detections][keep]
+    # x0n, y0n, x1n, y1n
+    boxes_n = output_dict['detection_boxes'][:num_detections][keep][:, [1, 0, 3, 2]]
+
+    # Translate roi coordinates into image coordinates
+    width, height = image_size
+    boxes = boxes_n * np.array([width, height, width, height], dtype=boxes_n.dtype)
+
+    return boxes, boxes_n, classes, scores
+
+
+def finish_images(im_list, output_dir, delete_input):
     """
-    Method performing predictions on all images ony by one or combined as specified by the int value of num_imgs.
+    Moves the predicted images to the output directory or deletes them.
+
+    :param im_list: the paths of the images
+    :type im_list: list
+    :param output_dir: the output directory to move the images to
+    :type output_dir: str
+    :param delete_input: whether to delete the images rather than moving them to the output directory
+    :type delete_input: bool
+    """
+
+    for i in range(len(im_list)):
+        if delete_input:
+            os.remove(im_list[i])
+        else:
+            os.rename(im_list[i], os.path.join(output_dir, os.path.basename(im_list[i])))
+
+
+def predict_on_images(input_dir, sess, output_dir, tmp_dir, score_threshold, categories, num_imgs, inference_times,
+                      delete_input, batch_mode=BATCH_MODE_PAD, watch_mode=WATCH_AUTO, metrics=None, tile_size=0,
+                      tile_overlap=0, tile_min_std=0.0, tile_iou=TILE_IOU_THRESHOLD, sink=None, claim_dir=None,
+                      time_dir=None, continuous=False):
+    """
+    Method performing predictions on all images in batches of size num_imgs. Only images that have been written
+    completely get picked up; returns once no new images have appeared for a second and none are waiting to be
+    written completely (unless continuous, which keeps waiting for new images with the same watcher). With a tile
+    size, the images get predicted one at a time, cut into tiles (see run_inference_tiled) which get predicted in
+    batches of size num_imgs.
 
     :param input_dir: the directory with the images
     :type input_dir: str
@@ -151,173 +470,784 @@ def predict_on_images(input_dir, sess, output_dir, tmp_dir, score_threshold, cat
     :param score_threshold: the minimum score predictions have to have
     :type score_threshold: float
     :param categories: the label map
-    :param num_imgs: the number of images to combine into one before presenting to graph
+    :param num_imgs: the number of images to present to the graph as a single batch
     :type num_imgs: int
     :param inference_times: whether to output a CSV file with the inference times
     :type inference_times: bool
     :param delete_input: whether to delete the input images rather than moving them to the output directory
     :type delete_input: bool
+    :param batch_mode: how to combine images of different sizes into a batch (pad/resize)
+    :type batch_mode: str
+    :param watch_mode: how to watch the input directory for new images (auto/inotify/poll)
+    :type watch_mode: str
+    :param metrics: the (optional) metrics to record the stage latencies and backlog in
+    :type metrics: InferenceMetrics
+    :param tile_size: the width/height of the tiles to cut the images into, 0 to predict the images as a whole
+    :type tile_size: int
+    :param tile_overlap: the number of pixels neighbouring tiles overlap
+    :type tile_overlap: int
+    :param tile_min_std: the minimum standard deviation of the pixel values (of any channel) for a tile to get predicted
+                         (0 to predict all tiles)
+    :type tile_min_std: float
+    :param tile_iou: the IoU above which detections of overlapping tiles are considered duplicates
+    :type tile_iou: float
+    :param sink: the sink for the ROIs (flushed whenever no images are waiting), None for a CSV file per image
+                 in output_dir
+    :type sink: OutputSink
+    :param claim_dir: the directory to move the images to before predicting them (when several processes share
+                      the input directory), None to predict them in place
+    :type claim_dir: str
+    :param time_dir: the directory for the files with the inference times, None for output_dir
+    :type time_dir: str
+    :param continuous: whether to keep waiting for new images rather than returning once all images are predicted
+    :type continuous: bool
     """
 
+    if sink is None:
+        sink = CsvSink(categories, output_dir, tmp_dir=tmp_dir)
+    if time_dir is None:
+        time_dir = output_dir
+    watcher = ImageWatcher(input_dir, mode=watch_mode, claim_dir=claim_dir)
+    if metrics is not None:
+        metrics.gauge("pending_images", lambda: watcher.backlog)
+
     # Iterate through all files present in "test_images_directory"
     total_time = 0
-    times = list()
-    times.append("Image(s)_file_name(s),Total_time(ms),Number_of_images,Time_per_image(ms)\n")
+    total_inference_seconds = 0.0
+    total_images = 0
+    flushed = True
+    if inference_times:
+        with open(os.path.join(time_dir, "inference_time.csv"), "w") as time_file:
+            time_file.write("Image(s)_file_name(s),Total_time(ms),Number_of_images,Time_per_image(ms),"
+                            + "Inference_time(ms),Images_per_second\n")
+        if tile_size > 0:
+            with open(os.path.join(time_dir, "tile_time.csv"), "w") as tile_file:
+                tile_file.write("Image_file_name,Number_of_tiles,Skipped_tiles,Tile_batch,Tiles_in_batch,"
+                                + "Inference_time(ms),Time_per_tile(ms),NMS_time(ms)\n")
     while True:
         start_time = datetime.now()
-        im_list = []
-        # Loop to pick up images equal to num_imgs or the remaining images if less
-        for image_path in os.listdir(input_dir):
-            # Load images only, currently supporting only jpg and png
-            # TODO image complete?
-            if image_path.lower().endswith(".jpg") or image_path.lower().endswith(".png"):
-                im_list.append(os.path.join(input_dir, image_path))
-            if len(im_list) == num_imgs:
-                break
+        im_list = watcher.get(1 if tile_size > 0 else num_imgs, timeout=IDLE_TIMEOUT)
 
         if len(im_list) == 0:
-            time.sleep(1)
-            break
+            # Images that never pass the completeness check get handed out after the watcher's stable time
+            if not continuous and watcher.backlog == 0:
+                break
+            # Get the ROIs onto disk while waiting for new images
+            if not flushed:
+                sink.flush()
+                flushed = True
+            continue
         else:
             print("%s - %s" % (str(datetime.now()), ", ".join(os.path.basename(x) for x in im_list)))
 
-        # Combining picked up images
-        i = len(im_list)
-        combined = []
-        comb_img = None
-        if i > 1:
-            while i != 0:
-                if comb_img is None:
-                    img2 = Image.open(im_list[i-1])
-                    img1 = Image.open(im_list[i-2])
-                    i -= 1
-                    combined.append(os.path.join(output_dir, "combined.png"))
-                else:
-                    img2 = comb_img
-                    img1 = Image.open(im_list[i-1])
-                i -= 1
-                # Remove alpha channel if present
-                img1 = remove_alpha_channel(img1)
-                img2 = remove_alpha_channel(img2)
-                w1, h1 = img1.size
-                w2, h2 = img2.size
-                comb_img = np.zeros((h1+h2, max(w1, w2), 3), np.uint8)
-                comb_img[:h1, :w1, :3] = img1
-                comb_img[h1:h1+h2, :w2, :3] = img2
-                comb_img = Image.fromarray(comb_img)
-
-        if comb_img is None:
-            im_name = im_list[0]
-            image = Image.open(im_name)
-            image = remove_alpha_channel(image)
+        if tile_size > 0:
+            # Predicting the tiles of the image (removing alpha channel if present)
+            image = remove_alpha_channel(Image.open(im_list[0]))
+            sizes = [image.size]
+            inference_start = datetime.now()
+            output_dict, tile_stats = run_inference_tiled(image, sess, tile_size, tile_overlap, num_imgs,
+                                                          score_threshold, iou_threshold=tile_iou,
+                                                          tile_min_std=tile_min_std)
+            output_dicts = [output_dict]
+            del image
+            report_tile_times(im_list[0], tile_stats, time_dir if inference_times else None)
         else:
-            im_name = combined[0]
-            image = remove_alpha_channel(comb_img)
-
-        image_np = load_image_into_numpy_array(image)
-        output_dict = run_inference_for_single_image(image_np, sess)
-
-        # Loading results
-        boxes = output_dict['detection_boxes']
-        scores = output_dict['detection_scores']
-        classes = output_dict['detection_classes']
-
-        if OUTPUT_COMBINED:
-            roi_path = "{}/{}-rois-combined.csv".format(output_dir, os.path.splitext(os.path.basename(im_name))[0])
-            with open(roi_path, "w") as roi_file:
-                # File header
-                roi_file.write("file,x0,y0,x1,y1,x0n,y0n,x1n,y1n,label,label_str,score\n")
-                for index in range(output_dict['num_detections']):
-                    y0n, x0n, y1n, x1n = boxes[index]
-                    label = classes[index]
-                    label_str = categories[label - 1]['name']
-                    score = scores[index]
-
-                    # Ignore this roi if the score is less than the provided threshold
-                    if score < score_threshold:
-                        continue
-
-                    # Translate roi coordinates into image coordinates
-                    x0 = x0n * image.width
-                    y0 = y0n * image.height
-                    x1 = x1n * image.width
-                    y1 = y1n * image.height
-
-                    roi_file.write(
-                        "{},{},{},{},{},{},{},{},{},{},{},{}\n".format(os.path.basename(im_name), x0, y0, x1, y1,
-                                                                       x0n, y0n, x1n, y1n, label, label_str, score))
-
-        # Code for splitting rois to multiple csv's, one csv per image before combining
-        max_height = 0
-        prev_min = 0
-        for i in range(len(im_list)):
-            img = Image.open(im_list[i])
-            img_height = img.height
-            min_height = prev_min
-            max_height += img_height
-            prev_min = max_height
-            roi_path = "{}/{}-rois.csv".format(output_dir, os.path.splitext(os.path.basename(im_list[i]))[0])
-            if tmp_dir is not None:
-                roi_path_tmp = "{}/{}-rois.tmp".format(tmp_dir, os.path.splitext(os.path.basename(im_list[i]))[0])
-            else:
-                roi_path_tmp = "{}/{}-rois.tmp".format(output_dir, os.path.splitext(os.path.basename(im_list[i]))[0])
-            with open(roi_path_tmp, "w") as roi_file:
-                # File header
-                roi_file.write("file,x0,y0,x1,y1,x0n,y0n,x1n,y1n,label,label_str,score\n")
-                # rois
-                for index in range(output_dict['num_detections']):
-                    y0n, x0n, y1n, x1n = boxes[index]
-                    label = classes[index]
-                    label_str = categories[label - 1]['name']
-                    score = scores[index]
-
-                    # Ignore this roi if the score is less than the provided threshold
-                    if score < score_threshold:
-                        continue
-
-                    # Translate roi coordinates into combined image coordinates
-                    x0 = x0n * image.width
-                    y0 = y0n * image.height
-                    x1 = x1n * image.width
-                    y1 = y1n * image.height
-
-                    if y0 > max_height or y1 > max_height:
-                        continue
-                    elif y0 < min_height or y1 < min_height:
-                        continue
-
-                    # output
-                    roi_file.write("{},{},{},{},{},{},{},{},{},{},{},{}\n".format(os.path.basename(im_name),
-                                                                                  x0, y0, x1, y1, x0n, y0n, x1n, y1n,
-                                                                                  label, label_str, score))
-            os.rename(roi_path_tmp, roi_path)
+            # Loading the images (removing alpha channel if present) and combining them into a batch
+            images = [remove_alpha_channel(Image.open(im_name)) for im_name in im_list]
+            batch, factors = create_batch(images, batch_mode)
+            # Only the dimensions are needed from here on
+            sizes = [image.size for image in images]
+            del images
+            inference_start = datetime.now()
+            output_dicts = run_inference_for_batch(batch, factors, sess)
+
+        write_start = datetime.now()
+        inference_seconds = (write_start - inference_start).total_seconds()
+        batch_inference_time = int(inference_seconds * 1000)
+
+        # Output the ROIs of each image
+        for im_name, image_size, output_dict in zip(im_list, sizes, output_dicts):
+            sink.write(im_name, image_size, *filter_rois(output_dict, image_size, score_threshold))
+
+        flushed = False
 
         # Move finished images to output_path or delete it
-        for i in range(len(im_list)):
-            if delete_input:
-                os.remove(im_list[i])
-            else:
-                os.rename(im_list[i], os.path.join(output_dir, os.path.basename(im_list[i])))
+        finish_images(im_list, output_dir, delete_input)
 
         end_time = datetime.now()
+        if metrics is not None:
+            metrics.observe(STAGE_DECODE, (inference_start - start_time).total_seconds())
+            metrics.observe(STAGE_INFERENCE, inference_seconds)
+            metrics.observe(STAGE_WRITE, (end_time - write_start).total_seconds())
+            metrics.add_batch(len(im_list))
         inference_time = end_time - start_time
         inference_time = int(inference_time.total_seconds() * 1000)
         time_per_image = int(inference_time / len(im_list))
-        if inference_times:
-            l = ""
-            for i in range(len(im_list)):
-                l += ("{}|".format(os.path.basename(im_list[i])))
-            l += ",{},{},{}\n".format(inference_time, len(im_list), time_per_image)
-            times.append(l)
+        images_per_second = len(im_list) / inference_seconds if inference_seconds > 0 else 0.0
+        print("  Inference time: {} ms (batch size: {}, {:.1f} images/s)".format(batch_inference_time, len(im_list),
+                                                                                  images_per_second))
         print("  Inference + I/O time: {} ms\n".format(inference_time))
         total_time += inference_time
+        total_inference_seconds += inference_seconds
+        total_images += len(im_list)
+
+        # Append the timings as they come in (in continuous mode, this loop may never finish)
+        if inference_times:
+            with open(os.path.join(time_dir, "inference_time.csv"), "a") as time_file:
+                time_file.write("{}|,{},{},{},{},{:.1f}\n".format(
+                    "|".join(os.path.basename(x) for x in im_list), inference_time, len(im_list), time_per_image,
+                    batch_inference_time, images_per_second))
+            with open(os.path.join(time_dir, "total_time.txt"), "w") as total_time_file:
+                total_time_file.write("Total inference and I/O time: {} ms\n".format(total_time))
+                total_time_file.write("Total inference time: {} ms\n".format(int(total_inference_seconds * 1000)))
+                total_time_file.write("Number of images: {}\n".format(total_images))
+                total_time_file.write("Inference throughput: {:.1f} images/s\n".format(
+                    total_images / total_inference_seconds if total_inference_seconds > 0 else 0.0))
+
+    sink.flush()
+    watcher.close()
+
+
+def report_tile_times(im_name, tile_stats, output_dir=None):
+    """
+    Outputs the timings of the tiles of an image (see run_inference_tiled).
+
+    :param im_name: the path of the image
+    :type im_name: str
+    :param tile_stats: the statistics of the tiles
+    :type tile_stats: dict
+    :param output_dir: the directory with the tile_time.csv file to append the timings to, None to only print them
+    :type output_dir: str
+    """
+
+    num_predicted = tile_stats['tiles'] - tile_stats['skipped']
+    tiles_seconds = sum(seconds for _, seconds in tile_stats['batches'])
+    print("  Tiles: {} (skipped: {}), inference time: {} ms ({:.1f} ms/tile), NMS time: {} ms".format(
+        tile_stats['tiles'], tile_stats['skipped'], int(tiles_seconds * 1000),
+        tiles_seconds * 1000 / num_predicted if num_predicted > 0 else 0.0, int(tile_stats['nms'] * 1000)))
+    for i, (num_tiles, seconds) in enumerate(tile_stats['batches']):
+        print("    Tile batch {}: {} tiles, {} ms ({:.1f} ms/tile)".format(
+            i + 1, num_tiles, int(seconds * 1000), seconds * 1000 / num_tiles))
+
+    if output_dir is not None:
+        with open(os.path.join(output_dir, "tile_time.csv"), "a") as tile_file:
+            for i, (num_tiles, seconds) in enumerate(tile_stats['batches']):
+                tile_file.write("{},{},{},{},{},{},{:.1f},{}\n".format(
+                    os.path.basename(im_name), tile_stats['tiles'], tile_stats['skipped'], i + 1, num_tiles,
+                    int(seconds * 1000), seconds * 1000 / num_tiles, int(tile_stats['nms'] * 1000)))
+
+
+def put_until_stopped(q, item, stop):
+    """
+    Puts the item in the queue, waiting for a free slot unless the pipeline gets stopped.
+
+    :param q: the queue
+    :type q: queue.Queue
+    :param item: the item to put
+    :param stop: the event signalling that the pipeline is stopping
+    :type stop: threading.Event
+    :return: whether the item was put in the queue
+    :rtype: bool
+    """
+
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=PIPELINE_POLL_INTERVAL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def get_until_stopped(q, stop):
+    """
+    Gets the next item from the queue, waiting for one unless the pipeline gets stopped.
+
+    :param q: the queue
+    :type q: queue.Queue
+    :param stop: the event signalling that the pipeline is stopping
+    :type stop: threading.Event
+    :return: the item, None if stopped
+    """
+
+    while not stop.is_set():
+        try:
+            return q.get(timeout=PIPELINE_POLL_INTERVAL)
+        except queue.Empty:
+            pass
+    return None
+
+
+def predict_on_images_pipelined(input_dir, sess, output_dir, tmp_dir, score_threshold, categories, num_imgs,
+                                inference_times, delete_input, batch_mode=BATCH_MODE_PAD, continuous=False,
+                                num_loaders=2, queue_size=4, watch_mode=WATCH_AUTO, metrics=None, sink=None,
+                                claim_dir=None, time_dir=None):
+    """
+    Method performing predictions on all images in batches of size num_imgs, with the stages in separate threads:
+    a pool of loader threads decodes the upcoming batches into a bounded queue, the calling thread only runs the
+    inference and a writer thread outputs the ROI CSV files and moves/deletes the images. The time spent in each
+    stage and the depths of the queues get output per batch (and with inference_times, written to
+    inference_time.csv/total_time.txt after each batch). Like predict_on_images, returns once no new images have
+    appeared for a second and none are waiting to be written completely (unless continuous).
+
+    :param input_dir: the directory with the images
+    :type input_dir: str
+    :param sess: the tensorflow session
+    :type sess: tf.Session
+    :param output_dir: the output directory to move the images to and store the predictions
+    :type output_dir: str
+    :param tmp_dir: the temporary directory to store the predictions until finished
+    :type tmp_dir: str
+    :param score_threshold: the minimum score predictions have to have
+    :type score_threshold: float
+    :param categories: the label map
+    :param num_imgs: the number of images to present to the graph as a single batch
+    :type num_imgs: int
+    :param inference_times: whether to output a CSV file with the inference times
+    :type inference_times: bool
+    :param delete_input: whether to delete the input images rather than moving them to the output directory
+    :type delete_input: bool
+    :param batch_mode: how to combine images of different sizes into a batch (pad/resize)
+    :type batch_mode: str
+    :param continuous: whether to keep waiting for new images rather than returning once all images are predicted
+    :type continuous: bool
+    :param num_loaders: the number of threads loading the images
+    :type num_loaders: int
+    :param queue_size: the maximum number of batches waiting for inference (and for writing)
+    :type queue_size: int
+    :param watch_mode: how to watch the input directory for new images (auto/inotify/poll)
+    :type watch_mode: str
+    :param metrics: the (optional) metrics to record the stage latencies and queue backlogs in
+    :type metrics: InferenceMetrics
+    :param sink: the sink for the ROIs (flushed whenever the pipeline runs empty), None for a CSV file per image
+                 in output_dir
+    :type sink: OutputSink
+    :param claim_dir: the directory to move the images to before predicting them (when several processes share
+                      the input directory), None to predict them in place
+    :type claim_dir: str
+    :param time_dir: the directory for the files with the inference times, None for output_dir
+    :type time_dir: str
+    """
+
+    if sink is None:
+        sink = CsvSink(categories, output_dir, tmp_dir=tmp_dir)
+    if time_dir is None:
+        time_dir = output_dir
+    stop = threading.Event()
+    errors = []
+    # Hands out each (completely written) image only once, while it is being processed
+    watcher = ImageWatcher(input_dir, mode=watch_mode, claim_dir=claim_dir)
+    # The queues between the stages (None marks the end of a producer's batches)
+    to_load = queue.Queue(num_loaders)
+    loaded = queue.Queue(queue_size)
+    predicted = queue.Queue(queue_size)
+    totals = {'images': 0, 'batches': 0, 'load': 0.0, 'inference': 0.0, 'write': 0.0}
+    pipeline_start = datetime.now()
+    if metrics is not None:
+        metrics.gauge("pending_images", lambda: watcher.backlog)
+        metrics.gauge("decode_queue", to_load.qsize)
+        metrics.gauge("inference_queue", loaded.qsize)
+        metrics.gauge("write_queue", predicted.qsize)
 
     if inference_times:
-        with open(os.path.join(output_dir, "inference_time.csv"), "w") as time_file:
-            for l in times:
-                time_file.write(l)
-        with open(os.path.join(output_dir, "total_time.txt"), "w") as total_time_file:
-            total_time_file.write("Total inference and I/O time: {} ms\n".format(total_time))
+        with open(os.path.join(time_dir, "inference_time.csv"), "w") as time_file:
+            time_file.write("Image(s)_file_name(s),Total_time(ms),Number_of_images,Time_per_image(ms),"
+                            + "Inference_time(ms),Images_per_second,Load_time(ms),Write_time(ms),"
+                            + "Load_queue_depth,Write_queue_depth\n")
+
+    def start_stage(target):
+        def run():
+            try:
+                target()
+            except Exception as e:
+                errors.append(e)
+                stop.set()
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        return thread
+
+    def dispatch():
+        idle_start = time.time()
+        while not stop.is_set():
+            im_list = watcher.get(num_imgs, timeout=PIPELINE_POLL_INTERVAL)
+            if len(im_list) == 0:
+                # Same as predict_on_images: stop once idle, but not while images are waiting to be completed
+                if not continuous and watcher.backlog == 0 and time.time() - idle_start >= IDLE_TIMEOUT:
+                    break
+                continue
+            if not put_until_stopped(to_load, (im_list, datetime.now()), stop):
+                return
+            idle_start = time.time()
+        for _ in range(num_loaders):
+            put_until_stopped(to_load, None, stop)
+
+    def load():
+        while True:
+            item = get_until_stopped(to_load, stop)
+            if item is None:
+                break
+            im_list, start_time = item
+            load_start = datetime.now()
+            # Loading the images (removing alpha channel if present) and combining them into a batch
+            images = [remove_alpha_channel(Image.open(im_name)) for im_name in im_list]
+            for image in images:
+                image.load()
+            batch, factors = create_batch(images, batch_mode)
+            job = {
+                'im_list': im_list,
+                'sizes': [image.size for image in images],
+                'batch': batch,
+                'factors': factors,
+                'start_time': start_time,
+                'load_seconds': (datetime.now() - load_start).total_seconds(),
+            }
+            if not put_until_stopped(loaded, job, stop):
+                return
+        put_until_stopped(loaded, None, stop)
+
+    def write():
+        while True:
+            job = get_until_stopped(predicted, stop)
+            if job is None:
+                break
+            write_queue_depth = predicted.qsize()
+            write_start = datetime.now()
+            im_list = job['im_list']
+            # Output the ROIs of each image
+            for im_name, image_size, output_dict in zip(im_list, job['sizes'], job['output_dicts']):
+                sink.write(im_name, image_size, *filter_rois(output_dict, image_size, score_threshold))
+            # Move finished images to output_path or delete it
+            finish_images(im_list, output_dir, delete_input)
+            # Nothing else in the pipeline (eg while waiting for new images)
+            if predicted.empty() and loaded.empty() and watcher.backlog == 0:
+                sink.flush()
+            end_time = datetime.now()
+            write_seconds = (end_time - write_start).total_seconds()
+
+            # Timings
+            total_time = int((end_time - job['start_time']).total_seconds() * 1000)
+            inference_seconds = job['inference_seconds']
+            images_per_second = len(im_list) / inference_seconds if inference_seconds > 0 else 0.0
+            totals['images'] += len(im_list)
+            totals['batches'] += 1
+            totals['load'] += job['load_seconds']
+            totals['inference'] += inference_seconds
+            totals['write'] += write_seconds
+            if metrics is not None:
+                metrics.observe(STAGE_DECODE, job['load_seconds'])
+                metrics.observe(STAGE_INFERENCE, inference_seconds)
+                metrics.observe(STAGE_WRITE, write_seconds)
+                metrics.add_batch(len(im_list))
+            print("%s - %s" % (str(end_time), ", ".join(os.path.basename(x) for x in im_list)))
+            print("  Inference time: {} ms (batch size: {}, {:.1f} images/s)".format(
+                int(inference_seconds * 1000), len(im_list), images_per_second))
+            print("  Load time: {} ms, write time: {} ms, queued for inference: {}/{}, queued for writing: {}/{}".format(
+                int(job['load_seconds'] * 1000), int(write_seconds * 1000), job['load_queue_depth'], queue_size,
+                write_queue_depth, queue_size))
+            print("  Inference + I/O time (incl. waiting): {} ms\n".format(total_time))
+
+            if inference_times:
+                with open(os.path.join(time_dir, "inference_time.csv"), "a") as time_file:
+                    time_file.write("{}|,{},{},{},{},{:.1f},{},{},{},{}\n".format(
+                        "|".join(os.path.basename(x) for x in im_list), total_time, len(im_list),
+                        int(total_time / len(im_list)), int(inference_seconds * 1000), images_per_second,
+                        int(job['load_seconds'] * 1000), int(write_seconds * 1000), job['load_queue_depth'],
+                        write_queue_depth))
+                write_pipeline_totals(time_dir, totals, (end_time - pipeline_start).total_seconds())
+
+    threads = [start_stage(dispatch)] + [start_stage(load) for _ in range(num_loaders)] + [start_stage(write)]
+
+    # Inference in this thread (the one owning the session)
+    try:
+        remaining = num_loaders
+        while remaining > 0:
+            job = get_until_stopped(loaded, stop)
+            if job is None:
+                if stop.is_set():
+                    break
+                remaining -= 1
+                continue
+            job['load_queue_depth'] = loaded.qsize()
+            inference_start = datetime.now()
+            job['output_dicts'] = run_inference_for_batch(job['batch'], job['factors'], sess)
+            job['inference_seconds'] = (datetime.now() - inference_start).total_seconds()
+            del job['batch']
+            if not put_until_stopped(predicted, job, stop):
+                break
+        put_until_stopped(predicted, None, stop)
+    except Exception as e:
+        errors.append(e)
+        stop.set()
+
+    for thread in threads:
+        thread.join()
+    watcher.close()
+
+    if len(errors) > 0:
+        raise errors[0]
+
+
+def write_pipeline_totals(output_dir, totals, wall_seconds):
+    """
+    Writes the totals of the pipelined prediction to total_time.txt.
+
+    :param output_dir: the directory to write the file to
+    :type output_dir: str
+    :param totals: the number of images/batches and the total time (seconds) spent in each stage
+    :type totals: dict
+    :param wall_seconds: the time since the start of the pipeline
+    :type wall_seconds: float
+    """
+
+    with open(os.path.join(output_dir, "total_time.txt"), "w") as total_time_file:
+        total_time_file.write("Number of images: {}\n".format(totals['images']))
+        total_time_file.write("Number of batches: {}\n".format(totals['batches']))
+        total_time_file.write("Total load time: {} ms\n".format(int(totals['load'] * 1000)))
+        total_time_file.write("Total inference time: {} ms\n".format(int(totals['inference'] * 1000)))
+        total_time_file.write("Total write time: {} ms\n".format(int(totals['write'] * 1000)))
+        total_time_file.write("Elapsed time: {} ms\n".format(int(wall_seconds * 1000)))
+        total_time_file.write("Inference throughput: {:.1f} images/s\n".format(
+            totals['images'] / totals['inference'] if totals['inference'] > 0 else 0.0))
+        total_time_file.write("Overall throughput: {:.1f} images/s\n".format(
+            totals['images'] / wall_seconds if wall_seconds > 0 else 0.0))
+
+
+def create_session_config(intra_op_threads=0, inter_op_threads=0):
+    """
+    Creates the configuration for a session with explicit thread pool sizes.
+
+    :param intra_op_threads: the number of threads for parallelizing a single operation (eg a convolution),
+                             0 for the tensorflow default (number of cores)
+    :type intra_op_threads: int
+    :param inter_op_threads: the number of threads for running independent operations concurrently,
+                             0 for the tensorflow default (number of cores)
+    :type inter_op_threads: int
+    :return: the configuration
+    :rtype: tf.compat.v1.ConfigProto
+    """
+
+    return tf.compat.v1.ConfigProto(intra_op_parallelism_threads=intra_op_threads,
+                                    inter_op_parallelism_threads=inter_op_threads)
+
+
+def worker_threads(workers, intra_op_threads=0, inter_op_threads=0):
+    """
+    Determines the thread pool sizes of each worker: unless specified, the cores get divided evenly among the
+    workers (intra-op) and operations get run one at a time (inter-op), to avoid the workers' thread pools
+    competing for the cores.
+
+    :param workers: the number of worker processes
+    :type workers: int
+    :param intra_op_threads: the intra-op threads per worker, 0 for the cores divided by the workers
+    :type intra_op_threads: int
+    :param inter_op_threads: the inter-op threads per worker, 0 for WORKER_INTER_OP_THREADS
+    :type inter_op_threads: int
+    :return: the intra-op and inter-op threads
+    :rtype: tuple
+    """
+
+    if intra_op_threads <= 0:
+        intra_op_threads = max(1, multiprocessing.cpu_count() // workers)
+    if inter_op_threads <= 0:
+        inter_op_threads = WORKER_INTER_OP_THREADS
+    return intra_op_threads, inter_op_threads
+
+
+def worker_path(path, worker):
+    """
+    Turns the path of an output file into the one of a worker, by appending the worker index to the name.
+
+    :param path: the path of the file
+    :type path: str
+    :param worker: the index of the worker, None if not a worker
+    :type worker: int
+    :return: the path for the worker
+    :rtype: str
+    """
+
+    if worker is None:
+        return path
+    base, ext = os.path.splitext(path)
+    return "%s-%d%s" % (base, worker, ext)
+
+
+def predict_with_args(parsed, worker=None):
+    """
+    Performs the predictions specified by the parsed command-line arguments, either as the only process or as one
+    of several worker processes. A worker has its own session and claims the images it predicts by moving them to
+    its claim directory in the input directory (any images left there from a previous run get released first).
+    Its timings, output file and metrics file get the worker index appended.
+
+    :param parsed: the parsed command-line arguments
+    :type parsed: argparse.Namespace
+    :param worker: the index of the worker, None if the only process
+    :type worker: int
+    """
+
+    claim_dir = None
+    time_dir = None
+    intra_op_threads = parsed.intra_op_threads
+    inter_op_threads = parsed.inter_op_threads
+    output_file = parsed.output_file
+    if worker is not None:
+        claim_dir = os.path.join(parsed.prediction_in, WORKER_CLAIM_DIR % worker)
+        os.makedirs(claim_dir, exist_ok=True)
+        released = release_claims(claim_dir, parsed.prediction_in)
+        if released > 0:
+            print("Worker %d: released %d image(s) claimed previously" % (worker, released))
+        time_dir = os.path.join(parsed.prediction_out, WORKER_TIME_DIR % worker)
+        os.makedirs(time_dir, exist_ok=True)
+        intra_op_threads, inter_op_threads = worker_threads(parsed.workers, intra_op_threads, inter_op_threads)
+        if parsed.output_sink != SINK_CSV:
+            if output_file is None:
+                output_file = os.path.join(parsed.prediction_out, "predictions" + SINK_EXTENSIONS[parsed.output_sink])
+            output_file = worker_path(output_file, worker)
+        print("Worker %d: %d intra-op thread(s), %d inter-op thread(s)" % (worker, intra_op_threads, inter_op_threads))
+
+    metrics = None
+    if parsed.metrics_file is not None:
+        metrics = InferenceMetrics(worker_path(parsed.metrics_file, worker), output_format=parsed.metrics_format,
+                                   interval=parsed.metrics_interval)
+        metrics.start()
+    sink = None
+
+    try:
+        # Path to frozen detection graph. This is the actual model that is used for the object detection
+        detection_graph = load_frozen_graph(parsed.graph, optimize=parsed.optimize_graph,
+                                            cache_dir=parsed.graph_cache_dir)
+        # Resolve the tensors once, then make sure nothing gets added to the graph
+        get_inference_tensors(detection_graph)
+        detection_graph.finalize()
+
+        # Getting classes strings from the label map
+        label_map = label_map_util.load_labelmap(parsed.labels)
+        categories = label_map_util.convert_label_map_to_categories(label_map, max_num_classes=parsed.num_classes,
+                                                                    use_display_name=True)
+
+        sink = create_sink(parsed.output_sink, categories, parsed.prediction_out, tmp_dir=parsed.prediction_tmp,
+                           output_file=output_file, sync_interval=parsed.sync_interval,
+                           chunk_size=parsed.chunk_size)
+
+        with detection_graph.as_default():
+            with tf.compat.v1.Session(config=create_session_config(intra_op_threads, inter_op_threads)) as sess:
+                if parsed.pipeline and parsed.tile_size > 0:
+                    raise Exception("--tile_size is not supported with --pipeline")
+                if parsed.warmup_runs > 0:
+                    if parsed.tile_size > 0:
+                        width, height = parsed.tile_size, parsed.tile_size
+                    else:
+                        width, height = parse_size(parsed.warmup_size)
+                    warmup_inference(sess, width, height, num_imgs=parsed.num_imgs, runs=parsed.warmup_runs)
+                if parsed.pipeline:
+                    # Performing the prediction and producing the csv files, in separate threads
+                    predict_on_images_pipelined(parsed.prediction_in, sess, parsed.prediction_out,
+                                                parsed.prediction_tmp, parsed.score, categories, parsed.num_imgs,
+                                                parsed.output_inference_time, parsed.delete_input,
+                                                batch_mode=parsed.batch_mode, continuous=parsed.continuous,
+                                                num_loaders=parsed.num_loaders, queue_size=parsed.queue_size,
+                                                watch_mode=parsed.watch_mode, metrics=metrics, sink=sink,
+                                                claim_dir=claim_dir, time_dir=time_dir)
+                else:
+                    # Performing the prediction and producing the csv files
+                    predict_on_images(parsed.prediction_in, sess, parsed.prediction_out, parsed.prediction_tmp,
+                                      parsed.score, categories, parsed.num_imgs, parsed.output_inference_time,
+                                      parsed.delete_input, batch_mode=parsed.batch_mode,
+                                      watch_mode=parsed.watch_mode, metrics=metrics,
+                                      tile_size=parsed.tile_size, tile_overlap=parsed.tile_overlap,
+                                      tile_min_std=parsed.tile_min_std, tile_iou=parsed.tile_iou, sink=sink,
+                                      claim_dir=claim_dir, time_dir=time_dir, continuous=parsed.continuous)
+
+    finally:
+        if sink is not None:
+            sink.close()
+        if metrics is not None:
+            metrics.close()
+
+
+def run_worker(parsed, worker):
+    """
+    The entry point of a worker process (see predict_with_args), exits with 1 if the predictions fail.
+
+    :param parsed: the parsed command-line arguments
+    :type parsed: argparse.Namespace
+    :param worker: the index of the worker
+    :type worker: int
+    """
+
+    try:
+        predict_with_args(parsed, worker=worker)
+    except KeyboardInterrupt:
+        pass
+    except Exception:
+        print("Worker %d failed:\n%s" % (worker, traceback.format_exc()))
+        sys.exit(1)
+
+
+def run_workers(parsed):
+    """
+    Performs the predictions in parsed.workers processes, which share the input directory.
+
+    :param parsed: the parsed command-line arguments
+    :type parsed: argparse.Namespace
+    :return: the indices of the workers that failed
+    :rtype: list
+    """
+
+    # Fresh interpreters rather than forks of a process that has already initialized tensorflow
+    context = multiprocessing.get_context("spawn")
+    processes = [context.Process(target=run_worker, args=(parsed, i)) for i in range(parsed.workers)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join()
+    return [i for i, process in enumerate(processes) if process.exitcode != 0]
+
+
+def benchmark_worker(graph_path, image_paths, num_imgs, batch_mode, intra_op_threads, inter_op_threads,
+                     num_batches, barrier, results, optimize=False, cache_dir=None):
+    """
+    A worker process of the benchmark: runs the inference on the same batch repeatedly, starting at the same time
+    as the other workers, and puts its start/end time and number of images in the results queue.
+
+    :param graph_path: the frozen graph
+    :type graph_path: str
+    :param image_paths: the images to build the batch from
+    :type image_paths: list
+    :param num_imgs: the number of images per batch
+    :type num_imgs: int
+    :param batch_mode: how to combine images of different sizes into a batch (pad/resize)
+    :type batch_mode: str
+    :param intra_op_threads: the intra-op threads of the session
+    :type intra_op_threads: int
+    :param inter_op_threads: the inter-op threads of the session
+    :type inter_op_threads: int
+    :param num_batches: the number of batches to time
+    :type num_batches: int
+    :param barrier: the barrier to wait at once ready
+    :type barrier: multiprocessing.Barrier
+    :param results: the queue for the results
+    :type results: multiprocessing.Queue
+    :param optimize: whether to use the optimized graph
+    :type optimize: bool
+    :param cache_dir: the directory with the cached optimized graph
+    :type cache_dir: str
+    """
+
+    detection_graph = load_frozen_graph(graph_path, optimize=optimize, cache_dir=cache_dir)
+    get_inference_tensors(detection_graph)
+    detection_graph.finalize()
+    images = [remove_alpha_channel(Image.open(image_paths[i % len(image_paths)])) for i in range(num_imgs)]
+    batch, factors = create_batch(images, batch_mode)
+    with detection_graph.as_default():
+        with tf.compat.v1.Session(config=create_session_config(intra_op_threads, inter_op_threads)) as sess:
+            # The first run initializes everything lazily
+            run_inference_for_batch(batch, factors, sess)
+            barrier.wait(BENCHMARK_TIMEOUT)
+            start = time.time()
+            for _ in range(num_batches):
+                run_inference_for_batch(batch, factors, sess)
+            results.put((start, time.time(), num_batches * len(images)))
+
+
+def default_splits(cores):
+    """
+    Generates the worker/thread splits to benchmark: powers of two as number of workers, dividing the cores among
+    them.
+
+    :param cores: the number of cores
+    :type cores: int
+    :return: the number of workers and intra-op threads per worker
+    :rtype: list
+    """
+
+    result = []
+    workers = 1
+    while workers <= cores:
+        result.append((workers, cores // workers))
+        workers *= 2
+    return result
+
+
+def parse_splits(splits):
+    """
+    Parses the worker/thread splits to benchmark.
+
+    :param splits: comma-separated list of WORKERSxTHREADS (eg "1x32,4x8"), "auto" for default_splits
+    :type splits: str
+    :return: the number of workers and intra-op threads per worker
+    :rtype: list
+    """
+
+    if splits == "auto":
+        return default_splits(multiprocessing.cpu_count())
+    result = []
+    for split in splits.split(","):
+        try:
+            workers, threads = split.lower().split("x")
+            result.append((int(workers), int(threads)))
+        except ValueError:
+            raise Exception("Invalid worker/thread split '%s', expected WORKERSxTHREADS" % split)
+    return result
+
+
+def benchmark_workers(graph_path, image_paths, num_imgs, batch_mode, splits, inter_op_threads=0, num_batches=20,
+                      optimize=False, cache_dir=None):
+    """
+    Measures the overall throughput of each worker/thread split, with all workers running the inference at the
+    same time.
+
+    :param graph_path: the frozen graph
+    :type graph_path: str
+    :param image_paths: the (sample) images to build the batches from
+    :type image_paths: list
+    :param num_imgs: the number of images per batch
+    :type num_imgs: int
+    :param batch_mode: how to combine images of different sizes into a batch (pad/resize)
+    :type batch_mode: str
+    :param splits: the number of workers and intra-op threads per worker to try
+    :type splits: list
+    :param inter_op_threads: the inter-op threads per worker, 0 for WORKER_INTER_OP_THREADS
+    :type inter_op_threads: int
+    :param num_batches: the number of batches each worker times
+    :type num_batches: int
+    :param optimize: whether to use the optimized graph
+    :type optimize: bool
+    :param cache_dir: the directory for caching the optimized graph, None for the directory of the graph
+    :type cache_dir: str
+    :return: the number of workers, intra-op threads and images/s of each split, the best split first
+    :rtype: list
+    """
+
+    if len(image_paths) == 0:
+        raise Exception("No images to benchmark with")
+    if optimize:
+        # Optimize once, the workers load the cached graph
+        load_frozen_graph(graph_path, optimize=True, cache_dir=cache_dir)
+
+    context = multiprocessing.get_context("spawn")
+    result = []
+    for workers, intra_op_threads in splits:
+        intra_op_threads, inter_op_threads_used = worker_threads(workers, intra_op_threads, inter_op_threads)
+        barrier = context.Barrier(workers)
+        results = context.Queue()
+        processes = [context.Process(target=benchmark_worker,
+                                     args=(graph_path, image_paths, num_imgs, batch_mode, intra_op_threads,
+                                           inter_op_threads_used, num_batches, barrier, results, optimize,
+                                           cache_dir))
+                     for _ in range(workers)]
+        for process in processes:
+            process.start()
+        timings = [results.get(timeout=BENCHMARK_TIMEOUT) for _ in range(workers)]
+        for process in processes:
+            process.join()
+        start = min(t[0] for t in timings)
+        end = max(t[1] for t in timings)
+        images_per_second = sum(t[2] for t in timings) / (end - start) if end > start else 0.0
+        print("%d worker(s) x %d intra-op thread(s) (%d inter-op): %.1f images/s"
+              % (workers, intra_op_threads, inter_op_threads_used, images_per_second))
+        result.append((workers, intra_op_threads, images_per_second))
+
+    return sorted(result, key=lambda x: -x[2])
 
 
 if __name__ == '__main__':
@@ -329,39 +1259,64 @@ if __name__ == '__main__':
     parser.add_argument('--prediction_tmp', help='Path to the temporary csv files folder', required=False, default=None)
     parser.add_argument('--score', type=float, help='Score threshold to include in csv file', required=False, default=0.0)
     parser.add_argument('--num_classes', type=int, help='Number of classes', required=True, default=2)
-    parser.add_argument('--num_imgs', type=int, help='Number of images to combine', required=False, default=1)
+    parser.add_argument('--num_imgs', type=int, help='Number of images to present to the graph as a single batch', required=False, default=1)
+    parser.add_argument('--batch_mode', choices=BATCH_MODES, help='How to combine images of different sizes into a batch: pad (to the largest width/height, at the bottom/right) or resize (to the largest width/height)', required=False, default=BATCH_MODE_PAD)
     parser.add_argument('--status', help='file path for predict exit status file', required=False, default=None)
     parser.add_argument('--continuous', action='store_true', help='Whether to continuously load test images and perform prediction', required=False, default=False)
     parser.add_argument('--output_inference_time', action='store_true', help='Whether to output a CSV file with inference times in the --prediction_output directory', required=False, default=False)
+    parser.add_argument('--tile_size', type=int, help='Cut the images into tiles of this width/height (presented to the graph in batches of --num_imgs tiles) and merge the detections, for images much larger than the input of the model; 0 to predict the images as a whole', required=False, default=0)
+    parser.add_argument('--tile_overlap', type=int, help='The number of pixels neighbouring tiles overlap when using --tile_size', required=False, default=128)
+    parser.add_argument('--tile_min_std', type=float, help='Skip tiles whose pixel values have a lower standard deviation (e.g., empty background) when using --tile_size; 0 to predict all tiles', required=False, default=0.0)
+    parser.add_argument('--tile_iou', type=float, help='The IoU above which detections of overlapping tiles are considered duplicates (non-maximum suppression) when using --tile_size', required=False, default=TILE_IOU_THRESHOLD)
+    parser.add_argument('--watch_mode', choices=WATCH_MODES, help='How to watch --prediction_in for new images: inotify (Linux) or polling; auto uses inotify if available', required=False, default=WATCH_AUTO)
     parser.add_argument('--delete_input', action='store_true', help='Whether to delete the input images rather than move them to --prediction_out directory', required=False, default=False)
+    parser.add_argument('--pipeline', action='store_true', help='Whether to load the images, run the inference and write the results in separate threads, overlapping I/O and inference', required=False, default=False)
+    parser.add_argument('--num_loaders', type=int, help='The number of threads loading images when using --pipeline', required=False, default=2)
+    parser.add_argument('--queue_size', type=int, help='The maximum number of batches waiting for inference (and for writing) when using --pipeline', required=False, default=4)
+    parser.add_argument('--optimize_graph', action='store_true', help='Whether to optimize the graph for inference (strip unused nodes, fold constants/batch normalizations, fuse operations), caching the optimized graph', required=False, default=False)
+    parser.add_argument('--graph_cache_dir', help='The directory for caching the optimized graph (default: directory of --graph)', required=False, default=None)
+    parser.add_argument('--warmup_runs', type=int, help='The number of times to run the inference on a batch of dummy images before predicting, so that the first batch does not pay for the lazy initialization', required=False, default=0)
+    parser.add_argument('--warmup_size', metavar='WIDTHxHEIGHT', help='The size of the dummy images for --warmup_runs (--tile_size overrides it)', required=False, default='640x480')
+    parser.add_argument('--workers', type=int, help='The number of worker processes, each with its own session, sharing --prediction_in (images get claimed atomically)', required=False, default=1)
+    parser.add_argument('--intra_op_threads', type=int, help='The number of threads (per process) for parallelizing a single operation; 0 for the tensorflow default, or the cores divided by --workers', required=False, default=0)
+    parser.add_argument('--inter_op_threads', type=int, help='The number of threads (per process) for running independent operations concurrently; 0 for the tensorflow default, or %d with --workers' % WORKER_INTER_OP_THREADS, required=False, default=0)
+    parser.add_argument('--benchmark_workers', metavar='SPLITS', help='Instead of predicting, measure the throughput of worker/thread splits (comma-separated WORKERSxTHREADS, eg "1x32,4x8", or "auto" for powers of two) using the images in --prediction_in (which stay in place) and output the best one', required=False, default=None)
+    parser.add_argument('--benchmark_batches', type=int, help='The number of batches each worker runs when using --benchmark_workers', required=False, default=20)
+    parser.add_argument('--output_sink', choices=SINKS, help='Where to output the ROIs: csv (one file per image in --prediction_out), jsonl (a single JSON Lines file, one line per image) or columnar (a single file with chunks of numpy arrays)', required=False, default=SINK_CSV)
+    parser.add_argument('--output_file', help='The file to append the ROIs to when using --output_sink jsonl/columnar (default: predictions.jsonl/predictions.npzc in --prediction_out)', required=False, default=None)
+    parser.add_argument('--sync_interval', type=float, help='The minimum interval in seconds between fsyncs of the --output_file (and between chunks for --output_sink columnar)', required=False, default=10.0)
+    parser.add_argument('--chunk_size', type=int, help='The maximum number of images per chunk when using --output_sink columnar', required=False, default=1000)
+    parser.add_argument('--metrics_file', help='The file to periodically write the rolling metrics (stage latency histograms and percentiles, throughput, backlog) to', required=False, default=None)
+    parser.add_argument('--metrics_format', choices=FORMATS, help='The format of the --metrics_file: prometheus (text exposition format, eg for the node_exporter textfile collector) or json', required=False, default=FORMAT_PROMETHEUS)
+    parser.add_argument('--metrics_interval', type=float, help='The interval in seconds for writing the --metrics_file', required=False, default=10.0)
     parsed = parser.parse_args()
 
     try:
-        # Path to frozen detection graph. This is the actual model that is used for the object detection
-        detection_graph = load_frozen_graph(parsed.graph)
-
-        # Getting classes strings from the label map
-        label_map = label_map_util.load_labelmap(parsed.labels)
-        categories = label_map_util.convert_label_map_to_categories(label_map, max_num_classes=parsed.num_classes,
-                                                                    use_display_name=True)
-
-        with detection_graph.as_default():
-            with tf.compat.v1.Session() as sess:
-                while True:
-                    # Performing the prediction and producing the csv files
-                    predict_on_images(parsed.prediction_in, sess, parsed.prediction_out, parsed.prediction_tmp,
-                                      parsed.score, categories, parsed.num_imgs, parsed.output_inference_time,
-                                      parsed.delete_input)
-
-                    # Exit if not continuous
-                    if not parsed.continuous:
-                        break
-                if parsed.status is not None:
-                    with open(parsed.status, 'w') as f:
-                        f.write("Success")
+        if parsed.benchmark_workers is not None:
+            # Measuring the throughput of the worker/thread splits with the images in the input directory
+            image_paths = sorted(os.path.join(parsed.prediction_in, x) for x in os.listdir(parsed.prediction_in)
+                                 if x.lower().endswith(IMAGE_EXTENSIONS) and not x.startswith("."))
+            ranking = benchmark_workers(parsed.graph, image_paths[:parsed.num_imgs], parsed.num_imgs,
+                                        parsed.batch_mode, parse_splits(parsed.benchmark_workers),
+                                        inter_op_threads=parsed.inter_op_threads,
+                                        num_batches=parsed.benchmark_batches, optimize=parsed.optimize_graph,
+                                        cache_dir=parsed.graph_cache_dir)
+            print("Best: --workers %d --intra_op_threads %d (%.1f images/s)" % ranking[0])
+        elif parsed.workers > 1:
+            if parsed.optimize_graph:
+                # Optimize once, the workers load the cached graph
+                load_frozen_graph(parsed.graph, optimize=True, cache_dir=parsed.graph_cache_dir)
+            failed = run_workers(parsed)
+            if len(failed) > 0:
+                raise Exception("Worker(s) failed: %s" % ", ".join(str(x) for x in failed))
+        else:
+            predict_with_args(parsed)
+        if parsed.status is not None:
+            with open(parsed.status, 'w') as f:
+                f.write("Success")
 
     except Exception as e:
         print(e)
         if parsed.status is not None:
             with open(parsed.status, 'w') as f:
-                f.write(str(e))
\ No newline at end of file
+                f.write(str(e))
@@ -0,0 +1,147 @@
+# Copyright (C) 2019 University of Waikato, Hamilton, NZ
+# Licensed under the Apache License, Version 2.0
+#
+# Serves predictions over HTTP, keeping the frozen graph loaded: images posted to /predict get decoded in the
+# request threads, merged with concurrent requests into batches (see --max_batch_size/--max_wait) for the
+# inference and their ROIs returned as JSON, with the same fields as the CSV files output by predict.py
+
+import argparse
+import io
+import traceback
+
+import tensorflow as tf
+from PIL import Image
+
+from object_detection.utils import label_map_util
+from predict import load_frozen_graph, get_inference_tensors, remove_alpha_channel, create_batch, \
+    run_inference_for_batch, filter_rois, parse_size, warmup_inference, BATCH_MODE_PAD, BATCH_MODES
+from wai.tfimageclass.utils.serving_utils import MicroBatcher, PredictionServer
+
+
+def create_predictor(sess, categories, score_threshold, batch_mode, max_batch_size, max_wait):
+    """
+    Creates the function that turns an encoded image into ROIs. The images get decoded in the calling threads,
+    but the inference is run on batches (of concurrent requests).
+
+    :param sess: the tensorflow session
+    :type sess: tf.Session
+    :param categories: the label map
+    :param score_threshold: the default minimum score predictions have to have
+    :type score_threshold: float
+    :param batch_mode: how to combine images of different sizes into a batch (pad/resize)
+    :type batch_mode: str
+    :param max_batch_size: the maximum number of images to present to the graph as a single batch
+    :type max_batch_size: int
+    :param max_wait: the maximum time in seconds to wait for further images after the first image of a batch
+    :type max_wait: float
+    :return: the function, taking the encoded image and the query parameters (file, score) and returning the
+             ROIs, and the batcher (needs starting)
+    :rtype: tuple
+    """
+
+    def infer(images):
+        batch, factors = create_batch(images, batch_mode)
+        return run_inference_for_batch(batch, factors, sess)
+
+    batcher = MicroBatcher(infer, max_batch_size=max_batch_size, max_wait=max_wait)
+
+    def predict(data, params):
+        name = params.get("file", "")
+        try:
+            threshold = float(params.get("score", score_threshold))
+        except ValueError:
+            raise ValueError("Invalid score: %s" % params["score"])
+        try:
+            image = remove_alpha_channel(Image.open(io.BytesIO(data)))
+            image.load()
+        except Exception:
+            raise ValueError("Failed to decode image")
+        output_dict = batcher.submit(image)
+        boxes, boxes_n, classes, scores = filter_rois(output_dict, image.size, threshold)
+        rois = []
+        for (x0, y0, x1, y1), (x0n, y0n, x1n, y1n), label, score \
+                in zip(boxes.tolist(), boxes_n.tolist(), classes.tolist(), scores.tolist()):
+            rois.append({'file': name, 'x0': x0, 'y0': y0, 'x1': x1, 'y1': y1,
+                         'x0n': x0n, 'y0n': y0n, 'x1n': x1n, 'y1n': y1n,
+                         'label': label, 'label_str': categories[label - 1]['name'], 'score': score})
+        return {'width': image.width, 'height': image.height, 'rois': rois}
+
+    return predict, batcher
+
+
+def serve(sess, categories, host, port, score_threshold, batch_mode, max_batch_size, max_wait, verbose=False):
+    """
+    Serves predictions over HTTP until interrupted.
+
+    :param sess: the tensorflow session
+    :type sess: tf.Session
+    :param categories: the label map
+    :param host: the host/IP to listen on
+    :type host: str
+    :param port: the port to listen on
+    :type port: int
+    :param score_threshold: the default minimum score predictions have to have
+    :type score_threshold: float
+    :param batch_mode: how to combine images of different sizes into a batch (pad/resize)
+    :type batch_mode: str
+    :param max_batch_size: the maximum number of images to present to the graph as a single batch
+    :type max_batch_size: int
+    :param max_wait: the maximum time in seconds to wait for further images after the first image of a batch
+    :type max_wait: float
+    :param verbose: whether to log the requests
+    :type verbose: bool
+    """
+
+    predict, batcher = create_predictor(sess, categories, score_threshold, batch_mode, max_batch_size, max_wait)
+    batcher.start()
+    server = PredictionServer((host, port), predict, verbose=verbose)
+    print("Serving on http://%s:%d/predict" % (host, port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        batcher.stop()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--graph', help='Path to the frozen detection graph', required=True, default=None)
+    parser.add_argument('--labels', help='Path to the labels map', required=True, default=None)
+    parser.add_argument('--num_classes', type=int, help='Number of classes', required=True, default=2)
+    parser.add_argument('--host', help='The host/IP to listen on', required=False, default='localhost')
+    parser.add_argument('--port', type=int, help='The port to listen on', required=False, default=8000)
+    parser.add_argument('--score', type=float, help='Score threshold to include in the response (can be overridden per request)', required=False, default=0.0)
+    parser.add_argument('--max_batch_size', type=int, help='The maximum number of concurrently posted images to present to the graph as a single batch', required=False, default=8)
+    parser.add_argument('--max_wait', type=float, help='The maximum time in seconds to wait for further images before running the inference on a batch', required=False, default=0.01)
+    parser.add_argument('--batch_mode', choices=BATCH_MODES, help='How to combine images of different sizes into a batch: pad (to the largest width/height, at the bottom/right) or resize (to the largest width/height)', required=False, default=BATCH_MODE_PAD)
+    parser.add_argument('--optimize_graph', action='store_true', help='Whether to optimize the graph for inference (strip unused nodes, fold constants/batch normalizations, fuse operations), caching the optimized graph', required=False, default=False)
+    parser.add_argument('--graph_cache_dir', help='The directory for caching the optimized graph (default: directory of --graph)', required=False, default=None)
+    parser.add_argument('--warmup_runs', type=int, help='The number of times to run the inference on a batch of dummy images before serving, so that the first request does not pay for the lazy initialization', required=False, default=0)
+    parser.add_argument('--warmup_size', metavar='WIDTHxHEIGHT', help='The size of the dummy images for --warmup_runs', required=False, default='640x480')
+    parser.add_argument('--verbose', action='store_true', help='Whether to log the requests', required=False, default=False)
+    parsed = parser.parse_args()
+
+    try:
+        detection_graph = load_frozen_graph(parsed.graph, optimize=parsed.optimize_graph,
+                                            cache_dir=parsed.graph_cache_dir)
+        # Resolve the tensors once, then make sure nothing gets added to the graph
+        get_inference_tensors(detection_graph)
+        detection_graph.finalize()
+
+        # Getting classes strings from the label map
+        label_map = label_map_util.load_labelmap(parsed.labels)
+        categories = label_map_util.convert_label_map_to_categories(label_map, max_num_classes=parsed.num_classes,
+                                                                    use_display_name=True)
+
+        with detection_graph.as_default():
+            with tf.compat.v1.Session() as sess:
+                if parsed.warmup_runs > 0:
+                    width, height = parse_size(parsed.warmup_size)
+                    warmup_inference(sess, width, height, num_imgs=parsed.max_batch_size, runs=parsed.warmup_runs)
+                serve(sess, categories, parsed.host, parsed.port, parsed.score, parsed.batch_mode,
+                      parsed.max_batch_size, parsed.max_wait, verbose=parsed.verbose)
+
+    except Exception:
+        print(traceback.format_exc())
@@ -0,0 +1,338 @@
+# Copyright (C) 2019 University of Waikato, Hamilton, NZ
+# Licensed under the Apache License, Version 2.0
+#
+# Output sinks for the predicted ROIs: one CSV file per image, a single append-only JSON Lines file or a single
+# chunked columnar file. The columnar file consists of chunks, each made up of a magic number, the length of the
+# data (unsigned 64-bit, little endian) and the data itself, an uncompressed numpy .npz archive with the columns
+# (see ColumnarSink); read_columnar reads them back.
+
+import io
+import json
+import os
+import struct
+import time
+
+import numpy as np
+
+SINK_CSV = "csv"
+""" One CSV file per image. """
+
+SINK_JSONL = "jsonl"
+""" A single JSON Lines file, one line per image. """
+
+SINK_COLUMNAR = "columnar"
+""" A single file with chunks of numpy arrays. """
+
+SINKS = [SINK_CSV, SINK_JSONL, SINK_COLUMNAR]
+""" The available output sinks. """
+
+SINK_EXTENSIONS = {SINK_JSONL: ".jsonl", SINK_COLUMNAR: ".npzc"}
+""" The default file extensions of the single-file sinks. """
+
+CSV_HEADER = "file,x0,y0,x1,y1,x0n,y0n,x1n,y1n,label,label_str,score\n"
+""" The header of the CSV files. """
+
+COLUMNAR_MAGIC = b"ODC1"
+""" The magic number at the start of each chunk of a columnar file. """
+
+
+class OutputSink(object):
+    """
+    Ancestor for sinks receiving the ROIs of the predicted images.
+    """
+
+    def __init__(self, categories):
+        """
+        Initializes the sink.
+
+        :param categories: the label map
+        """
+
+        self.categories = categories
+
+    def write(self, im_name, image_size, boxes, boxes_n, classes, scores):
+        """
+        Writes the ROIs of an image.
+
+        :param im_name: the path of the image
+        :type im_name: str
+        :param image_size: the width and height of the image
+        :type image_size: tuple
+        :param boxes: the boxes (x0, y0, x1, y1) in image coordinates
+        :type boxes: np.ndarray
+        :param boxes_n: the boxes (x0n, y0n, x1n, y1n) in normalized coordinates
+        :type boxes_n: np.ndarray
+        :param classes: the labels
+        :type classes: np.ndarray
+        :param scores: the scores
+        :type scores: np.ndarray
+        """
+
+        raise NotImplementedError()
+
+    def flush(self):
+        """
+        Makes sure all ROIs written so far end up on disk (eg once no more images are waiting).
+        """
+
+        pass
+
+    def close(self):
+        """
+        Flushes and closes the sink.
+        """
+
+        self.flush()
+
+
+class CsvSink(OutputSink):
+    """
+    Writes the ROIs of each image to its own CSV file (via a temporary file, renamed when complete).
+    """
+
+    def __init__(self, categories, output_dir, tmp_dir=None):
+        """
+        Initializes the sink.
+
+        :param categories: the label map
+        :param output_dir: the output directory to store the CSV files in
+        :type output_dir: str
+        :param tmp_dir: the temporary directory to store the CSV files in until finished, None for output_dir
+        :type tmp_dir: str
+        """
+
+        OutputSink.__init__(self, categories)
+        self.output_dir = output_dir
+        self.tmp_dir = tmp_dir
+
+    def write(self, im_name, image_size, boxes, boxes_n, classes, scores):
+        # Format all rows (as plain Python values, which format much faster than numpy scalars)
+        name = os.path.basename(im_name)
+        rows = "".join(
+            "{},{},{},{},{},{},{},{},{},{},{},{}\n".format(name, x0, y0, x1, y1, x0n, y0n, x1n, y1n,
+                                                         label, self.categories[label - 1]['name'], score)
+            for (x0, y0, x1, y1), (x0n, y0n, x1n, y1n), label, score
+            in zip(boxes.tolist(), boxes_n.tolist(), classes.tolist(), scores.tolist()))
+
+        base = os.path.splitext(name)[0]
+        roi_path = "{}/{}-rois.csv".format(self.output_dir, base)
+        roi_path_tmp = "{}/{}-rois.tmp".format(self.tmp_dir if self.tmp_dir is not None else self.output_dir, base)
+        with open(roi_path_tmp, "w") as roi_file:
+            roi_file.write(CSV_HEADER + rows)
+        os.rename(roi_path_tmp, roi_path)
+
+
+class SyncingSink(OutputSink):
+    """
+    Ancestor for sinks appending to a single file, which gets fsync'ed at regular intervals.
+    """
+
+    def __init__(self, categories, path, mode, sync_interval=10.0):
+        """
+        Initializes the sink.
+
+        :param categories: the label map
+        :param path: the file to append to
+        :type path: str
+        :param mode: the mode to open the file with
+        :type mode: str
+        :param sync_interval: the minimum interval in seconds between fsyncs, <=0 for after every write
+        :type sync_interval: float
+        """
+
+        OutputSink.__init__(self, categories)
+        self.path = path
+        self.sync_interval = sync_interval
+        self._file = open(path, mode)
+        self._last_sync = time.time()
+
+    def _written(self):
+        """
+        Flushes the file after a write, fsync'ing it if the sync interval has passed.
+        """
+
+        self._file.flush()
+        if time.time() - self._last_sync >= self.sync_interval:
+            self._sync()
+
+    def _sync(self):
+        """
+        Flushes and fsyncs the file.
+        """
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._last_sync = time.time()
+
+    def flush(self):
+        self._sync()
+
+    def close(self):
+        if not self._file.closed:
+            self.flush()
+            self._file.close()
+
+
+class JsonLinesSink(SyncingSink):
+    """
+    Appends the ROIs of each image as a single line to a JSON Lines file: an object with the file name,
+    width, height and the ROIs (same fields as the CSV files).
+    """
+
+    def __init__(self, categories, path, sync_interval=10.0):
+        """
+        Initializes the sink.
+
+        :param categories: the label map
+        :param path: the file to append to
+        :type path: str
+        :param sync_interval: the minimum interval in seconds between fsyncs, <=0 for after every image
+        :type sync_interval: float
+        """
+
+        SyncingSink.__init__(self, categories, path, "a", sync_interval=sync_interval)
+
+    def write(self, im_name, image_size, boxes, boxes_n, classes, scores):
+        name = os.path.basename(im_name)
+        rois = []
+        for (x0, y0, x1, y1), (x0n, y0n, x1n, y1n), label, score \
+                in zip(boxes.tolist(), boxes_n.tolist(), classes.tolist(), scores.tolist()):
+            rois.append({'x0': x0, 'y0': y0, 'x1': x1, 'y1': y1, 'x0n': x0n, 'y0n': y0n, 'x1n': x1n, 'y1n': y1n,
+                         'label': label, 'label_str': self.categories[label - 1]['name'], 'score': score})
+        line = json.dumps({'file': name, 'width': image_size[0], 'height': image_size[1], 'rois': rois})
+        self._file.write(line + "\n")
+        self._written()
+
+
+class ColumnarSink(SyncingSink):
+    """
+    Collects the ROIs of the images and appends them in chunks of columns to a single file (a chunk gets written
+    once it is full or the sync interval has passed). The columns of a chunk: image (the file name), width, height
+    (one value per image), offset (the index of the first ROI of each image, plus the total number of ROIs), boxes
+    (x0, y0, x1, y1), boxes_n (x0n, y0n, x1n, y1n), label, score (one value/row per ROI) and label_str (the label
+    names, indexed by label - 1).
+    """
+
+    def __init__(self, categories, path, chunk_size=1000, sync_interval=10.0):
+        """
+        Initializes the sink.
+
+        :param categories: the label map
+        :param path: the file to append to
+        :type path: str
+        :param chunk_size: the number of images per chunk
+        :type chunk_size: int
+        :param sync_interval: the minimum interval in seconds between fsyncs, <=0 for after every chunk
+        :type sync_interval: float
+        """
+
+        SyncingSink.__init__(self, categories, path, "ab", sync_interval=sync_interval)
+        self.chunk_size = max(1, chunk_size)
+        self._label_str = np.array([category['name'] for category in categories])
+        self._reset()
+
+    def _reset(self):
+        """
+        Starts a new chunk.
+        """
+
+        self._files = []
+        self._sizes = []
+        self._boxes = []
+        self._boxes_n = []
+        self._classes = []
+        self._scores = []
+
+    def write(self, im_name, image_size, boxes, boxes_n, classes, scores):
+        self._files.append(os.path.basename(im_name))
+        self._sizes.append(image_size)
+        self._boxes.append(boxes.astype(np.float32).reshape((-1, 4)))
+        self._boxes_n.append(boxes_n.astype(np.float32).reshape((-1, 4)))
+        self._classes.append(classes.astype(np.int32))
+        self._scores.append(scores.astype(np.float32))
+        # Chunks get written once full, but at least every sync interval
+        if len(self._files) >= self.chunk_size or time.time() - self._last_sync >= self.sync_interval:
+            self._write_chunk()
+            self._written()
+
+    def _write_chunk(self):
+        """
+        Appends the collected images as a chunk, with a single write.
+        """
+
+        if len(self._files) == 0:
+            return
+        sizes = np.array(self._sizes, dtype=np.int32).reshape((-1, 2))
+        offset = np.zeros(len(self._files) + 1, dtype=np.int64)
+        offset[1:] = np.cumsum([len(x) for x in self._scores])
+        buf = io.BytesIO()
+        np.savez(buf, image=np.array(self._files), width=sizes[:, 0], height=sizes[:, 1], offset=offset,
+                 boxes=np.concatenate(self._boxes), boxes_n=np.concatenate(self._boxes_n),
+                 label=np.concatenate(self._classes), score=np.concatenate(self._scores),
+                 label_str=self._label_str)
+        data = buf.getvalue()
+        self._file.write(COLUMNAR_MAGIC + struct.pack("<Q", len(data)) + data)
+        self._reset()
+
+    def flush(self):
+        self._write_chunk()
+        SyncingSink.flush(self)
+
+
+def read_columnar(path):
+    """
+    Reads the chunks of a file written by ColumnarSink. An incomplete chunk at the end of the file (eg when the
+    prediction was killed while writing it) gets ignored.
+
+    :param path: the file to read
+    :type path: str
+    :return: generator of the chunks, dictionaries with the columns (see ColumnarSink)
+    """
+
+    header_size = len(COLUMNAR_MAGIC) + 8
+    with open(path, "rb") as f:
+        while True:
+            header = f.read(header_size)
+            if len(header) < header_size:
+                break
+            if header[:len(COLUMNAR_MAGIC)] != COLUMNAR_MAGIC:
+                raise Exception("Not a chunk at position %d of %s" % (f.tell() - header_size, path))
+            length = struct.unpack("<Q", header[len(COLUMNAR_MAGIC):])[0]
+            data = f.read(length)
+            if len(data) < length:
+                break
+            with np.load(io.BytesIO(data)) as chunk:
+                yield dict((k, chunk[k]) for k in chunk.files)
+
+
+def create_sink(sink, categories, output_dir, tmp_dir=None, output_file=None, sync_interval=10.0,
+                chunk_size=1000):
+    """
+    Creates an output sink.
+
+    :param sink: the type of sink (csv/jsonl/columnar)
+    :type sink: str
+    :param categories: the label map
+    :param output_dir: the output directory (for the CSV files or the default output file)
+    :type output_dir: str
+    :param tmp_dir: the temporary directory for the CSV files
+    :type tmp_dir: str
+    :param output_file: the file for the jsonl/columnar sinks, None for "predictions" plus extension in output_dir
+    :type output_file: str
+    :param sync_interval: the minimum interval in seconds between fsyncs of the output file
+    :type sync_interval: float
+    :param chunk_size: the number of images per chunk of the columnar sink
+    :type chunk_size: int
+    :return: the sink
+    :rtype: OutputSink
+    """
+
+    if sink == SINK_CSV:
+        return CsvSink(categories, output_dir, tmp_dir=tmp_dir)
+    if sink not in SINKS:
+        raise Exception("Unknown output sink '%s', available: %s" % (sink, ", ".join(SINKS)))
+    if output_file is None:
+        output_file = os.path.join(output_dir, "predictions" + SINK_EXTENSIONS[sink])
+    if sink == SINK_JSONL:
+        return JsonLinesSink(categories, output_file, sync_interval=sync_interval)
+    return ColumnarSink(categories, output_file, chunk_size=chunk_size, sync_interval=sync_interval)
@@ -0,0 +1,135 @@
+"""
+Benchmark for tfrecords-convert: generates a synthetic ADAMS dataset (images
+and .report files) of configurable size, converts it with profiling enabled
+and outputs the throughput, for measuring regressions offline.
+
+Any options after "--" get passed on to tfrecords-convert, eg:
+
+  python convert_benchmark.py -n 5000 -d /tmp/bench -- -w 4 --single_pass
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from typing import List, Optional
+
+from PIL import Image
+from wai.common.adams.imaging.locateobjects import LocatedObjects, LocatedObject
+from wai.common.file.report import save
+
+from wai.tfrecords.adams import main
+
+LABELS: List[str] = ["cat", "dog", "bird", "fish", "horse"]
+""" The labels to assign to the synthetic objects. """
+
+
+def generate_dataset(directory: str,
+                     num_images: int,
+                     width: int,
+                     height: int,
+                     max_objects: int,
+                     png_ratio: float,
+                     images_per_dir: int,
+                     seed: int):
+    """
+    Generates images of random noise along with .report files of randomly
+    placed objects. Existing files are kept, so a dataset only needs to be
+    generated once.
+
+    :param directory:       The directory to generate the dataset in.
+    :param num_images:      The number of images to generate.
+    :param width:           The width of the images.
+    :param height:          The height of the images.
+    :param max_objects:     The maximum number of objects per image.
+    :param png_ratio:       The fraction of images to store as PNG (the rest are JPG).
+    :param images_per_dir:  The number of images per sub-directory, <= 0 for a flat dataset.
+    :param seed:            The seed for the random number generator.
+    """
+    rnd = random.Random(seed)
+    for i in range(num_images):
+        # Determine the filenames
+        subdir = directory if images_per_dir <= 0 else os.path.join(directory, f"{i // images_per_dir:05d}")
+        os.makedirs(subdir, exist_ok=True)
+        stem = os.path.join(subdir, f"image-{i:07d}")
+        extension = ".png" if rnd.random() < png_ratio else ".jpg"
+        if os.path.exists(stem + ".report"):
+            continue
+
+        # Noise compresses poorly, giving realistic file sizes
+        Image.frombytes("RGB", (width, height), os.urandom(width * height * 3)).save(stem + extension)
+
+        objects = LocatedObjects()
+        for _ in range(rnd.randint(1, max(1, max_objects))):
+            w = rnd.randint(1, max(1, width // 4))
+            h = rnd.randint(1, max(1, height // 4))
+            objects.append(LocatedObject(rnd.randint(0, width - w), rnd.randint(0, height - h), w, h,
+                                         type=rnd.choice(LABELS)))
+        save(objects.to_report("Object"), stem + ".report")
+
+
+def benchmark(args: Optional[List[str]] = None):
+    """
+    Runs the benchmark.
+
+    :param args:    The command-line arguments, uses sys.argv if None.
+    """
+    if args is None:
+        args = sys.argv[1:]
+
+    # Split off the options for tfrecords-convert
+    convert_args: List[str] = []
+    if "--" in args:
+        index = args.index("--")
+        args, convert_args = args[:index], args[index + 1:]
+
+    parser = argparse.ArgumentParser(description="Benchmarks the conversion of a synthetic ADAMS dataset "
+                                                 + "into TFRecords. Options after -- get passed to tfrecords-convert.")
+    parser.add_argument("-n", "--num_images", metavar="num", type=int, default=1000,
+                        help="the number of images to generate")
+    parser.add_argument("--width", metavar="px", type=int, default=640, help="the width of the images")
+    parser.add_argument("--height", metavar="px", type=int, default=480, help="the height of the images")
+    parser.add_argument("--max_objects", metavar="num", type=int, default=5,
+                        help="the maximum number of objects per image")
+    parser.add_argument("--png_ratio", metavar="fraction", type=float, default=0.5,
+                        help="the fraction of images to store as PNG")
+    parser.add_argument("--images_per_dir", metavar="num", type=int, default=-1,
+                        help="the number of images per sub-directory (<= 0 for a flat dataset)")
+    parser.add_argument("--seed", metavar="seed", type=int, default=1, help="the seed for the dataset")
+    parser.add_argument("-d", "--dataset_dir", metavar="dir", default=None,
+                        help="the directory for the dataset, which is reused if it already exists "
+                             + "(default: a temporary directory)")
+    parser.add_argument("-r", "--repeat", metavar="num", type=int, default=1,
+                        help="the number of times to run the conversion")
+    parsed = parser.parse_args(args)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        dataset_dir = parsed.dataset_dir if parsed.dataset_dir is not None else os.path.join(tmp, "dataset")
+
+        start = time.perf_counter()
+        generate_dataset(dataset_dir, parsed.num_images, parsed.width, parsed.height, parsed.max_objects,
+                         parsed.png_ratio, parsed.images_per_dir, parsed.seed)
+        print(f"dataset: {dataset_dir} ({time.perf_counter() - start:.1f}s)")
+
+        for run in range(parsed.repeat):
+            output = os.path.join(tmp, f"run-{run}", "output.tfrecord")
+            os.makedirs(os.path.dirname(output))
+            profile = os.path.join(tmp, f"run-{run}", "profile.json")
+
+            start = time.perf_counter()
+            main(["-i", dataset_dir, "-o", output, "--profile", profile] + convert_args)
+            elapsed = time.perf_counter() - start
+
+            with open(profile) as file:
+                stats = json.load(file)
+            # The dataset may have been reused (with a different size), and reports may have been skipped
+            found = stats["stages"].get("discovery", {}).get("count", 0)
+            written = stats["stages"].get("write", {}).get("count", 0)
+            print(f"run {run + 1}: {written / elapsed:.1f} images/s, {found} reports, {written} records, "
+                  f"{elapsed:.2f}s")
+
+
+if __name__ == "__main__":
+    benchmark()
@@ -0,0 +1,108 @@
+"""
+Benchmark comparing the direct wire-format encoding of detection examples
+(DetectionExample.encode, as used by tfrecords-convert) with building the
+tf.train.Example proto and serializing it. Also checks that both produce
+identical bytes.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from typing import Callable, List, Optional
+
+from wai.tfrecords.adams import DetectionExample
+
+
+def create_examples(num_examples: int, image_size: int, max_objects: int, seed: int) -> List[DetectionExample]:
+    """
+    Creates random detection examples.
+
+    :param num_examples:    The number of examples.
+    :param image_size:      The size of the (random) encoded image in bytes.
+    :param max_objects:     The maximum number of objects per example.
+    :param seed:            The seed for the random number generator.
+    :return:                The examples.
+    """
+    rnd = random.Random(seed)
+    labels = [b"cat", b"dog", b"bird", b"fish", b"horse"]
+    result = []
+    for i in range(num_examples):
+        num_objects = rnd.randint(1, max(1, max_objects))
+        xmins = [rnd.random() * 0.5 for _ in range(num_objects)]
+        ymins = [rnd.random() * 0.5 for _ in range(num_objects)]
+        classes = [rnd.randrange(len(labels)) for _ in range(num_objects)]
+        filename = f"image-{i:07d}.jpg".encode("utf-8")
+        result.append(DetectionExample(height=480,
+                                       width=640,
+                                       filename=filename,
+                                       source_id=filename,
+                                       sha256=f"{rnd.getrandbits(256):064x}",
+                                       encoded=os.urandom(image_size),
+                                       format=b"jpg",
+                                       xmins=xmins,
+                                       xmaxs=[x + rnd.random() * 0.5 for x in xmins],
+                                       ymins=ymins,
+                                       ymaxs=[y + rnd.random() * 0.5 for y in ymins],
+                                       classes_text=[labels[c] for c in classes],
+                                       classes=[c + 1 for c in classes]))
+    return result
+
+
+def time_encoder(name: str, encoder: Callable[[DetectionExample], bytes], examples: List[DetectionExample],
+                 repeat: int) -> float:
+    """
+    Times the encoding of the examples, outputting the best of several runs.
+
+    :param name:        The name of the encoder.
+    :param encoder:     The encoder.
+    :param examples:    The examples to encode.
+    :param repeat:      The number of runs.
+    :return:            The time taken by the best run, in seconds.
+    """
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for example in examples:
+            encoder(example)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print(f"{name:<20}{best:>10.3f}s{len(examples) / best:>12.0f} examples/s")
+    return best
+
+
+def benchmark(args: Optional[List[str]] = None):
+    """
+    Runs the benchmark.
+
+    :param args:    The command-line arguments, uses sys.argv if None.
+    """
+    parser = argparse.ArgumentParser(description="Compares the direct encoding of detection examples "
+                                                 + "with serializing the tf.train.Example proto.")
+    parser.add_argument("-n", "--num_examples", metavar="num", type=int, default=10000,
+                        help="the number of examples to encode")
+    parser.add_argument("--image_size", metavar="bytes", type=int, default=50000,
+                        help="the size of the encoded images")
+    parser.add_argument("--max_objects", metavar="num", type=int, default=10,
+                        help="the maximum number of objects per example")
+    parser.add_argument("--seed", metavar="seed", type=int, default=1, help="the seed for the examples")
+    parser.add_argument("-r", "--repeat", metavar="num", type=int, default=3,
+                        help="the number of runs (the best one is reported)")
+    parsed = parser.parse_args(sys.argv[1:] if args is None else args)
+
+    examples = create_examples(parsed.num_examples, parsed.image_size, parsed.max_objects, parsed.seed)
+
+    # Make sure the encoders agree
+    for example in examples:
+        if example.encode() != example.to_tf_example().SerializeToString(deterministic=True):
+            raise ValueError(f"Encodings differ for {example.filename}")
+
+    proto = time_encoder("tf.train.Example", lambda example: example.to_tf_example().SerializeToString(),
+                         examples, parsed.repeat)
+    direct = time_encoder("direct", DetectionExample.encode, examples, parsed.repeat)
+    print(f"speed-up: {proto / direct:.1f}x")
+
+
+if __name__ == "__main__":
+    benchmark()
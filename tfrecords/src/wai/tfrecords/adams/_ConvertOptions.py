@@ -0,0 +1,78 @@
+from typing import NamedTuple, Optional, Dict, List
+
+from ._deduplicate import DEDUPLICATION_NONE
+from ._ShardWriter import COMPRESSION_NONE
+
+SHARDING_ROUND_ROBIN: str = "round_robin"
+""" Sharding strategy that assigns the records to the shards in turn. """
+
+SHARDING_BALANCED: str = "balanced"
+""" Sharding strategy that assigns each record to the shard with the fewest bytes so far. """
+
+SHARDING_STRATEGIES: List[str] = [SHARDING_ROUND_ROBIN, SHARDING_BALANCED]
+""" The available sharding strategies. """
+
+
+class ConvertOptions(NamedTuple):
+    """
+    The options of a conversion of images and annotations (.report) files
+    into TFRecords (see convert). Use _replace to derive modified options.
+    """
+    # The label mappings for replacing labels (key: old label, value: new label)
+    mappings: Optional[Dict[str, str]] = None
+    # The regular expression to use for limiting the labels stored
+    regexp: Optional[str] = None
+    # The predefined list of labels to use
+    labels: Optional[List[str]] = None
+    # The (optional) file to store the label mapping in (in protobuf format)
+    protobuf_label_map: Optional[str] = None
+    # The number of shards to generate, <= 1 for just a single file
+    shards: int = -1
+    # Whether to have a more verbose record generation
+    verbose: bool = False
+    # The number of processes to use for building the examples, <= 1 for in-process
+    workers: int = 1
+    # Whether to parse each report only once when determining the labels, caching
+    # the parsed reports for the conversion
+    single_pass: bool = False
+    # The maximum number of parsed reports to keep in memory in single-pass mode
+    # before spilling them to a temporary file, < 0 for unlimited
+    max_cached_reports: int = -1
+    # Whether to keep track of the converted reports in a manifest next to the output
+    # file, only converting new/changed reports into new shards if the manifest
+    # already exists
+    manifest: bool = False
+    # The maximum number of records per shard when using a manifest (shards are
+    # committed to the manifest one at a time, allowing crashed runs to resume)
+    records_per_shard: int = 1000
+    # The strategy for assigning records to shards (round_robin/balanced)
+    sharding: str = SHARDING_ROUND_ROBIN
+    # The target size of the shards in MB, determining the number of shards automatically
+    # (using balanced sharding) instead of using a fixed number, <= 0 for off; also limits
+    # the size of the shards when using a manifest
+    shard_size_mb: float = -1
+    # The (optional) JSON file to write the time spent in each stage of the conversion
+    # to (the timings also get logged)
+    profile: Optional[str] = None
+    # The maximum width/height of the stored images, larger images get downscaled
+    # (keeping the aspect ratio), <= 0 for no limit
+    max_dim: int = -1
+    # The JPEG quality (1-95) to re-encode all stored images with (PNGs get converted
+    # to JPEGs), <= 0 to store the images as-is (unless downscaled)
+    jpeg_quality: int = -1
+    # The compression of the TFRecords (none/gzip/zlib), which gets recorded in the
+    # manifest and the protobuf label map
+    compression: str = COMPRESSION_NONE
+    # How to treat reports whose image is byte-identical to that of an earlier report:
+    # none (convert anyway), skip (only the first report gets converted) or merge (the
+    # annotations of all the reports go into a single record, requires parsing all
+    # reports up front)
+    deduplication: str = DEDUPLICATION_NONE
+    # The (optional) CSV file to list the deduplicated reports in
+    dedup_report: Optional[str] = None
+    # Whether to write an index next to each output file, for random access to the
+    # records (see wai.tfrecords.reader)
+    index: bool = False
+    # Whether to write the records with Tensorflow's TFRecordWriter rather than the
+    # built-in writer (which doesn't require importing Tensorflow)
+    tf_writer: bool = False
@@ -0,0 +1,80 @@
+from typing import NamedTuple, List, TYPE_CHECKING
+
+from ._wire_format import encode_example, encode_bytes_feature, encode_float_feature, encode_int64_feature
+
+if TYPE_CHECKING:
+    import tensorflow as tf
+
+
+class DetectionExample(NamedTuple):
+    """
+    The content of an object-detection example, as read by the object detection
+    framework's TfExampleDecoder. Can be encoded directly into the serialized
+    tf.train.Example, or converted into the message object.
+    """
+    height: int
+    width: int
+    filename: bytes
+    source_id: bytes
+    sha256: str
+    encoded: bytes
+    format: bytes
+    xmins: List[float]
+    xmaxs: List[float]
+    ymins: List[float]
+    ymaxs: List[float]
+    classes_text: List[bytes]
+    classes: List[int]
+
+    def encode(self) -> bytes:
+        """
+        Encodes the example directly into the wire format, identical to
+        to_tf_example().SerializeToString(deterministic=True).
+
+        :return:    The serialized example.
+        """
+        return encode_example({
+            'image/height': encode_int64_feature([self.height]),
+            'image/width': encode_int64_feature([self.width]),
+            'image/filename': encode_bytes_feature([self.filename]),
+            'image/source_id': encode_bytes_feature([self.source_id]),
+            'image/key/sha256': encode_bytes_feature([self.sha256.encode('utf8')]),
+            'image/encoded': encode_bytes_feature([self.encoded]),
+            'image/format': encode_bytes_feature([self.format]),
+            'image/object/bbox/xmin': encode_float_feature(self.xmins),
+            'image/object/bbox/xmax': encode_float_feature(self.xmaxs),
+            'image/object/bbox/ymin': encode_float_feature(self.ymins),
+            'image/object/bbox/ymax': encode_float_feature(self.ymaxs),
+            'image/object/class/text': encode_bytes_feature(self.classes_text),
+            'image/object/class/label': encode_int64_feature(self.classes),
+        })
+
+    def to_tf_example(self) -> "tf.train.Example":
+        """
+        Creates the tf.train.Example message of the example. Imports
+        Tensorflow, unlike encode.
+
+        :return:    The message.
+        """
+        import tensorflow as tf
+        from ..object_detection.utils import dataset_util
+
+        return tf.train.Example(
+            features=tf.train.Features(
+                feature={
+                    'image/height': dataset_util.int64_feature(self.height),
+                    'image/width': dataset_util.int64_feature(self.width),
+                    'image/filename': dataset_util.bytes_feature(self.filename),
+                    'image/source_id': dataset_util.bytes_feature(self.source_id),
+                    'image/key/sha256': dataset_util.bytes_feature(self.sha256.encode('utf8')),
+                    'image/encoded': dataset_util.bytes_feature(self.encoded),
+                    'image/format': dataset_util.bytes_feature(self.format),
+                    'image/object/bbox/xmin': dataset_util.float_list_feature(self.xmins),
+                    'image/object/bbox/xmax': dataset_util.float_list_feature(self.xmaxs),
+                    'image/object/bbox/ymin': dataset_util.float_list_feature(self.ymins),
+                    'image/object/bbox/ymax': dataset_util.float_list_feature(self.ymaxs),
+                    'image/object/class/text': dataset_util.bytes_list_feature(self.classes_text),
+                    'image/object/class/label': dataset_util.int64_list_feature(self.classes),
+                }
+            )
+        )
@@ -0,0 +1,116 @@
+import os
+from collections import OrderedDict
+from typing import Dict, Tuple, Optional, Iterable, Iterator, List
+
+from ._ImageFormat import ImageFormat
+from ._profiling import profiler, STAGE_IMAGE_LOOKUP
+
+# The image format for each of the supported extensions
+EXTENSION_FORMATS: Dict[str, ImageFormat] = {extension: image_format
+                                             for image_format in ImageFormat
+                                             for extension in image_format.value}
+
+# The precedence of the image formats, when several images share a name
+FORMAT_PRECEDENCE: Dict[ImageFormat, int] = {image_format: index for index, image_format in enumerate(ImageFormat)}
+
+# The result of looking up an image: its filename and format, or None, None if not found
+ImageLookup = Tuple[Optional[str], Optional[ImageFormat]]
+
+
+class ImageIndex:
+    """
+    Index of the images in a set of directories, for finding the image associated
+    with a report with a single directory listing, rather than checking for the
+    existence of each possible image filename. Directories are indexed on first
+    use, unless their listing is added beforehand (eg while searching for reports).
+    The number of indexed directories can be limited, in which case the least
+    recently used directories are dropped (and re-indexed if used again).
+    """
+    def __init__(self, max_directories: int = -1):
+        """
+        :param max_directories:     The maximum number of directories to keep
+                                    indexed, < 0 for unlimited.
+        """
+        self._max_directories: int = max_directories
+        self._images: Dict[str, Tuple[str, ImageFormat]] = {}
+        # The stems of the images in each indexed directory, in order of use
+        self._directories: Dict[str, List[str]] = OrderedDict()
+
+    def add_directory(self, directory: str, entries: Optional[Iterable[os.DirEntry]] = None):
+        """
+        Adds the images in the given directory to the index.
+
+        :param directory:   The directory.
+        :param entries:     The directory listing, if already available. If None,
+                            the directory is scanned.
+        """
+        directory = os.path.normpath(directory or ".")
+        if directory in self._directories:
+            self._directories.move_to_end(directory)
+            return
+        stems: List[str] = []
+        self._directories[directory] = stems
+
+        # Drop the least recently used directories
+        while 0 <= self._max_directories < len(self._directories):
+            _, dropped = self._directories.popitem(last=False)
+            for key in dropped:
+                del self._images[key]
+
+        # Scan the directory if required
+        if entries is None:
+            try:
+                with os.scandir(directory) as iterator:
+                    entries = list(iterator)
+            except OSError:
+                entries = []
+
+        for entry in entries:
+            # Only consider files with an image extension
+            stem, extension = os.path.splitext(entry.name)
+            image_format = EXTENSION_FORMATS.get(extension[1:], None)
+            if image_format is None or not entry.is_file():
+                continue
+
+            # Keep the image with the highest-precedence format (JPG before PNG)
+            key = os.path.normpath(os.path.join(directory, stem))
+            current = self._images.get(key, None)
+            if current is None:
+                stems.append(key)
+            if current is None \
+                    or (FORMAT_PRECEDENCE[image_format], entry.path) < (FORMAT_PRECEDENCE[current[1]], current[0]):
+                self._images[key] = (entry.path, image_format)
+
+    def get_associated_image(self, filename: str) -> ImageLookup:
+        """
+        Gets the image associated with the given filename, ie the image with the
+        same name but one of the valid image extensions.
+
+        :param filename:    The filename to find an image for.
+        :return:            The filename of the image and the image format,
+                            or None, None if not found.
+        """
+        with profiler.time(STAGE_IMAGE_LOOKUP):
+            stem = os.path.normpath(os.path.splitext(filename)[0])
+
+            # Index the directory on first use
+            self.add_directory(os.path.dirname(stem))
+
+            return self._images.get(stem, (None, None))
+
+    def __len__(self) -> int:
+        return len(self._images)
+
+
+def get_associated_images(report_files: Iterable[str],
+                          image_index: Optional[ImageIndex]) -> Iterator[Tuple[str, Optional[ImageLookup]]]:
+    """
+    Pairs each report file with its image from the index (or None if no index is
+    given, leaving the lookup to ImageFormat.get_associated_image).
+
+    :param report_files:    The report files.
+    :param image_index:     The image index to use, if any.
+    :return:                The report files paired with their image lookups.
+    """
+    for report_file in report_files:
+        yield report_file, image_index.get_associated_image(report_file) if image_index is not None else None
@@ -0,0 +1,213 @@
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List, Optional, Any
+
+from ..reader import ShardIndex
+from ._logging import logger
+
+MANIFEST_SUFFIX: str = ".manifest.json"
+""" The suffix appended to the output file to obtain the manifest file. """
+
+MANIFEST_VERSION: int = 1
+""" The version of the manifest format. """
+
+HASH_BUFFER_SIZE: int = 1024 * 1024
+""" The number of bytes to read at a time when hashing files. """
+
+# The fingerprint of a file: path, size, mtime (in ns) and sha256 content hash
+Fingerprint = Dict[str, Any]
+
+# The manifest entry of a report/image pair: the fingerprints of both files, plus
+# the shard (filename relative to the manifest), record number and byte offset
+# (in the uncompressed shard) of the record generated from them (all None if
+# no record was generated)
+Entry = Dict[str, Any]
+
+
+class Manifest:
+    """
+    Keeps track of which report/image pairs have been converted, and where
+    their records ended up, so that subsequent conversions only need to
+    process new or changed pairs. Records that are superseded by a later
+    conversion, or whose report has been removed, are listed as stale so
+    that readers can skip them.
+    """
+    def __init__(self, filename: str):
+        """
+        :param filename:    The file the manifest is stored in.
+        """
+        self.filename: str = filename
+        self.labels: Optional[List[str]] = None
+        # The options that affect the content of the records (eg image resizing)
+        self.options: Dict[str, Any] = {}
+        self.shards: List[Dict[str, Any]] = []
+        self.entries: Dict[str, Entry] = {}
+        self.stale: List[Dict[str, Any]] = []
+
+    @classmethod
+    def filename_for(cls, output_file: str) -> str:
+        """
+        Gets the filename of the manifest for the given output file.
+
+        :param output_file:     The output file of the conversion.
+        :return:                The manifest filename.
+        """
+        return output_file + MANIFEST_SUFFIX
+
+    @classmethod
+    def load(cls, filename: str) -> "Manifest":
+        """
+        Loads the manifest from disk, or creates an empty one if the
+        file doesn't exist yet.
+
+        :param filename:    The manifest file.
+        :return:            The manifest.
+        """
+        manifest = cls(filename)
+
+        if not os.path.exists(filename):
+            return manifest
+
+        with open(filename, "r") as file:
+            data = json.load(file)
+
+        if data.get("version", None) != MANIFEST_VERSION:
+            raise ValueError(f"Unsupported manifest version in {filename}: {data.get('version', None)}")
+
+        manifest.labels = data["labels"]
+        manifest.options = data.get("options", {})
+        manifest.shards = data["shards"]
+        manifest.entries = data["entries"]
+        manifest.stale = data["stale"]
+
+        return manifest
+
+    def save(self):
+        """
+        Writes the manifest to disk. The file is replaced atomically, so a
+        crash never leaves a partially-written manifest behind.
+        """
+        data = {
+            "version": MANIFEST_VERSION,
+            "labels": self.labels,
+            "options": self.options,
+            "shards": self.shards,
+            "entries": self.entries,
+            "stale": self.stale
+        }
+
+        # The output directory doesn't exist yet on a first run
+        os.makedirs(os.path.dirname(self.filename) or ".", exist_ok=True)
+
+        tmp_filename = self.filename + ".tmp"
+        with open(tmp_filename, "w") as file:
+            json.dump(data, file, indent=1)
+        os.replace(tmp_filename, self.filename)
+
+    @property
+    def next_run(self) -> int:
+        """
+        The number of the next conversion run (ie one more than the last
+        run that committed a shard).
+        """
+        return max((shard["run"] for shard in self.shards), default=-1) + 1
+
+    def shard_files(self) -> List[str]:
+        """
+        Gets the filenames of all committed shards.
+
+        :return:    The shard filenames.
+        """
+        directory = os.path.dirname(self.filename)
+        return [os.path.join(directory, shard["file"]) for shard in self.shards]
+
+    def mark_stale(self, key: str):
+        """
+        Marks the record generated for the given report (if any) as stale,
+        and removes the report's entry from the manifest.
+
+        :param key:     The key of the report.
+        """
+        entry = self.entries.pop(key, None)
+        if entry is not None and entry["shard"] is not None:
+            self.stale.append({"report": key, "shard": entry["shard"], "record": entry["record"],
+                               "offset": entry["offset"]})
+
+    def commit(self, shard: Optional[Dict[str, Any]], entries: Dict[str, Entry]):
+        """
+        Records a completed shard and the entries of the reports processed
+        while writing it, then saves the manifest.
+
+        :param shard:       The shard details (file, run, records), or None if no shard was written.
+        :param entries:     The entries for the processed reports.
+        """
+        if shard is not None:
+            self.shards.append(shard)
+
+        for key, entry in entries.items():
+            self.mark_stale(key)
+            self.entries[key] = entry
+
+        self.save()
+
+    def stale_records(self) -> Dict[str, List[int]]:
+        """
+        Gets the stale record numbers for each shard, which readers should skip.
+
+        :return:    The mapping from shard file (relative to the manifest) to record numbers.
+        """
+        result: Dict[str, List[int]] = {}
+        for stale in self.stale:
+            result.setdefault(stale["shard"], []).append(stale["record"])
+        return result
+
+
+def fingerprint_file(path: str, previous: Optional[Fingerprint] = None) -> Fingerprint:
+    """
+    Creates the fingerprint of a file. If the size and modification time match
+    the previous fingerprint, its hash is reused rather than re-reading the file.
+
+    :param path:        The file to fingerprint.
+    :param previous:    The previous fingerprint of the file, if any.
+    :return:            The fingerprint.
+    """
+    stat = os.stat(path)
+
+    if previous is not None and previous["size"] == stat.st_size and previous["mtime"] == stat.st_mtime_ns:
+        return dict(previous, path=path)
+
+    sha256 = hashlib.sha256()
+    with open(path, "rb") as file:
+        for block in iter(lambda: file.read(HASH_BUFFER_SIZE), b""):
+            sha256.update(block)
+
+    return {"path": path, "size": stat.st_size, "mtime": stat.st_mtime_ns, "sha256": sha256.hexdigest()}
+
+
+def remove_uncommitted_shards(manifest: Manifest, output_file: str, pattern: str):
+    """
+    Removes any shard files left behind by a crashed run, ie files matching
+    the shard naming pattern that aren't recorded in the manifest (or aren't
+    the index of a recorded shard).
+
+    :param manifest:        The manifest.
+    :param output_file:     The output file the shards are named after.
+    :param pattern:         The regular expression matching shard filename suffixes.
+    """
+    directory = os.path.dirname(output_file) or "."
+
+    # Nothing to clean up on a first run into a new directory
+    if not os.path.isdir(directory):
+        return
+
+    prefix = os.path.basename(output_file)
+    committed = {shard["file"] for shard in manifest.shards}
+    committed.update([ShardIndex.filename_for(file) for file in committed])
+    regexpc = re.compile(re.escape(prefix) + pattern + "$")
+
+    for file in os.listdir(directory):
+        if regexpc.match(file) and file not in committed:
+            logger.info(f"removing uncommitted shard: {file}")
+            os.remove(os.path.join(directory, file))
@@ -0,0 +1,97 @@
+from typing import NamedTuple, Optional, Tuple, Dict
+
+from wai.common.file.report import Report, loadf
+from wai.common.adams.imaging.locateobjects import LocatedObjects, LocatedObject
+
+from ._fix_labels import fix_labels
+from ._ImageFormat import ImageFormat
+from ._ImageIndex import ImageLookup
+from ._profiling import profiler, STAGE_IMAGE_LOOKUP, STAGE_REPORT_PARSING
+from .constants import PREFIX_OBJECT, SUFFIX_TYPE, DEFAULT_LABEL
+
+# An annotation as (label, x, y, width, height), the label is None if the object has no type
+Annotation = Tuple[Optional[str], int, int, int, int]
+
+
+class ParsedReport(NamedTuple):
+    """
+    Compact representation of a report that has been loaded and parsed, along
+    with its associated image. Only keeps the parts of the report that are
+    required for the conversion, so that large numbers of them can be kept in
+    memory (or pickled to disk) between label discovery and conversion.
+    """
+    report_file: str
+    image_file: Optional[str]
+    image_format: Optional[ImageFormat]
+    annotations: Tuple[Annotation, ...]
+
+    @classmethod
+    def from_report_file(cls,
+                         report_file: str,
+                         image: Optional[ImageLookup] = None,
+                         mappings: Optional[Dict[str, str]] = None) -> "ParsedReport":
+        """
+        Loads and parses the given report file, and locates its associated image.
+
+        :param report_file:     The report file to parse.
+        :param image:           The associated image if already looked up (eg from an image index).
+        :param mappings:        The label mappings to apply (key: old label, value: new label).
+        :return:                The parsed report.
+        """
+        # Get the image associated to this report
+        if image is None:
+            with profiler.time(STAGE_IMAGE_LOOKUP):
+                image = ImageFormat.get_associated_image(report_file)
+        image_file, image_format = image
+
+        with profiler.time(STAGE_REPORT_PARSING):
+            # Load the report
+            report: Report = loadf(report_file)
+
+            # Get the annotated objects from the report
+            objects: LocatedObjects = LocatedObjects.from_report(report, PREFIX_OBJECT)
+
+        # Apply any label mappings
+        if mappings is not None:
+            fix_labels(objects, mappings)
+
+        # Reduce the objects to their bare annotations
+        annotations = tuple((obj.metadata.get(SUFFIX_TYPE, None), obj.x, obj.y, obj.width, obj.height)
+                            for obj in objects)
+
+        return cls(report_file, image_file, image_format, annotations)
+
+    def merge(self, other: "ParsedReport") -> "ParsedReport":
+        """
+        Adds the annotations of another report (for an identical image) that
+        aren't already present in this one.
+
+        :param other:   The other report.
+        :return:        The report with the merged annotations.
+        """
+        known = set(self.annotations)
+        annotations = list(self.annotations)
+        for annotation in other.annotations:
+            if annotation not in known:
+                known.add(annotation)
+                annotations.append(annotation)
+
+        return self._replace(annotations=tuple(annotations))
+
+    def labels(self) -> Tuple[str, ...]:
+        """
+        Gets the labels of the annotations in this report, using the default
+        label for objects without a type.
+
+        :return:    The labels.
+        """
+        return tuple(label if label is not None else DEFAULT_LABEL for label, _, _, _, _ in self.annotations)
+
+    def to_located_objects(self) -> LocatedObjects:
+        """
+        Recreates the located objects from the annotations.
+
+        :return:    The located objects.
+        """
+        return LocatedObjects(LocatedObject(x, y, width, height, **({} if label is None else {SUFFIX_TYPE: label}))
+                              for label, x, y, width, height in self.annotations)
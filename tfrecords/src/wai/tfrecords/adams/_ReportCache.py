@@ -0,0 +1,70 @@
+import pickle
+import tempfile
+from typing import List, Optional, IO, Iterator
+
+from ._logging import logger
+from ._ParsedReport import ParsedReport
+
+
+class ReportCache:
+    """
+    Holds parsed reports between label discovery and conversion. Reports are
+    kept in memory until a given number is reached, after which any further
+    reports are pickled to a temporary file instead.
+    """
+    def __init__(self, max_in_memory: int = -1):
+        """
+        :param max_in_memory:   The maximum number of reports to keep in memory
+                                before spilling to disk, < 0 for unlimited.
+        """
+        self._max_in_memory: int = max_in_memory
+        self._memory: List[ParsedReport] = []
+        self._spill: Optional[IO[bytes]] = None
+        self._num_spilled: int = 0
+
+    def add(self, report: ParsedReport):
+        """
+        Adds a parsed report to the cache.
+
+        :param report:  The report to add.
+        """
+        # Start spilling to disk once the in-memory limit is reached
+        if self._spill is None and 0 <= self._max_in_memory <= len(self._memory):
+            logger.info(f"more than {self._max_in_memory} parsed reports, spilling to temporary file")
+            self._spill = tempfile.TemporaryFile()
+
+        if self._spill is None:
+            self._memory.append(report)
+        else:
+            pickle.dump(report, self._spill, pickle.HIGHEST_PROTOCOL)
+            self._num_spilled += 1
+
+    def close(self):
+        """
+        Discards the cached reports, removing the temporary file if one was created.
+        """
+        self._memory = []
+        if self._spill is not None:
+            self._spill.close()
+            self._spill = None
+            self._num_spilled = 0
+
+    def __len__(self) -> int:
+        return len(self._memory) + self._num_spilled
+
+    def __iter__(self) -> Iterator[ParsedReport]:
+        # Reports kept in memory come first, as they were added first
+        yield from self._memory
+
+        # Read back any spilled reports
+        if self._spill is not None:
+            self._spill.flush()
+            self._spill.seek(0)
+            for _ in range(self._num_spilled):
+                yield pickle.load(self._spill)
+
+    def __enter__(self) -> "ReportCache":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
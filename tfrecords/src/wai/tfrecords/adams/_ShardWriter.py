@@ -0,0 +1,147 @@
+import queue
+import threading
+from typing import Dict, List, Optional
+
+from ..reader import ShardIndexWriter
+from ._profiling import profiler, STAGE_WRITE
+from ._TFRecordWriter import TFRecordWriter
+from ._wire_format import decode_bytes_features
+
+COMPRESSION_NONE: str = "none"
+""" No compression of the TFRecords. """
+
+COMPRESSION_GZIP: str = "gzip"
+""" GZIP compression of the TFRecords. """
+
+COMPRESSION_ZLIB: str = "zlib"
+""" ZLIB compression of the TFRecords. """
+
+COMPRESSION_TYPES: Dict[str, str] = {COMPRESSION_NONE: "", COMPRESSION_GZIP: "GZIP", COMPRESSION_ZLIB: "ZLIB"}
+""" The Tensorflow compression type (as used by TFRecordOptions/TFRecordDataset) for each compression. """
+
+COMPRESSIONS: List[str] = list(COMPRESSION_TYPES.keys())
+""" The available compressions. """
+
+MAX_QUEUED_RECORDS: int = 64
+""" The maximum number of records waiting to be written per shard, bounding memory use. """
+
+
+def compression_type(compression: str) -> str:
+    """
+    Gets the Tensorflow compression type for the given compression.
+
+    :param compression:     The compression (none/gzip/zlib).
+    :return:                The compression type for TFRecordOptions/TFRecordDataset.
+    """
+    if compression not in COMPRESSION_TYPES:
+        raise ValueError(f"Unknown compression '{compression}', available: {COMPRESSIONS}")
+
+    return COMPRESSION_TYPES[compression]
+
+
+class ShardWriter:
+    """
+    Writes records to a (possibly compressed) TFRecord file on a background
+    thread, so the writing and compression of the records overlaps with
+    building the next ones. Records are written in the order they are given.
+    Any error raised while writing gets re-raised by the next call to write
+    or close. Optionally, a sidecar index of the records (see wai.tfrecords.reader)
+    is written as well. Unless requested otherwise, the records are written
+    without Tensorflow (see TFRecordWriter).
+    """
+    def __init__(self, filename: str, compression: str = COMPRESSION_NONE, index: bool = False,
+                 tf_writer: bool = False):
+        """
+        :param filename:        The file to write the records to.
+        :param compression:     The compression to use (none/gzip/zlib).
+        :param index:           Whether to write an index of the records next to the file.
+        :param tf_writer:       Whether to write the records with Tensorflow's TFRecordWriter.
+        """
+        self.filename: str = filename
+        if tf_writer:
+            # Only import Tensorflow when explicitly asked for
+            import tensorflow as tf
+            self._writer = tf.io.TFRecordWriter(
+                filename, tf.io.TFRecordOptions(compression_type=compression_type(compression)))
+        else:
+            self._writer = TFRecordWriter(filename, compression_type(compression))
+        self._index: Optional[ShardIndexWriter] = \
+            ShardIndexWriter(filename, compression_type(compression)) if index else None
+        self._queue: queue.Queue = queue.Queue(MAX_QUEUED_RECORDS)
+        self._error: Optional[BaseException] = None
+        self._closed: bool = False
+        self._thread: threading.Thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        """
+        Writes the queued records until the end-of-records marker (None).
+        """
+        while True:
+            record = self._queue.get()
+            if record is None:
+                break
+
+            # Keep consuming after an error, so the producer never blocks
+            if self._error is None:
+                try:
+                    with profiler.time(STAGE_WRITE):
+                        self._writer.write(record)
+                        if self._index is not None:
+                            self._add_to_index(record)
+                except BaseException as e:
+                    self._error = e
+
+        try:
+            self._writer.close()
+            if self._index is not None:
+                self._index.close()
+        except BaseException as e:
+            if self._error is None:
+                self._error = e
+
+    def _add_to_index(self, record: bytes):
+        """
+        Adds the record to the index, with the source ID and labels of the example.
+
+        :param record:  The (serialized) record.
+        """
+        feature = decode_bytes_features(record, ("image/source_id", "image/object/class/text"))
+        source_id = feature["image/source_id"]
+        labels = feature["image/object/class/text"]
+        self._index.add(len(record),
+                        source_id[0].decode("utf-8") if len(source_id) > 0 else "",
+                        (label.decode("utf-8") for label in labels))
+
+    def _raise_error(self):
+        """
+        Re-raises the error that occurred on the writer thread, if any.
+        """
+        if self._error is not None:
+            raise IOError(f"Failed to write to {self.filename}") from self._error
+
+    def write(self, record: bytes):
+        """
+        Queues the record for writing.
+
+        :param record:  The (serialized) record.
+        """
+        self._raise_error()
+        self._queue.put(record)
+
+    def close(self):
+        """
+        Writes any outstanding records and closes the file.
+        """
+        if not self._closed:
+            self._closed = True
+            self._queue.put(None)
+            self._thread.join()
+
+        self._raise_error()
+
+    def __enter__(self) -> "ShardWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
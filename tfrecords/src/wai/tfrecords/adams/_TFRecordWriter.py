@@ -0,0 +1,82 @@
+import struct
+import zlib
+from typing import IO, Dict, Optional
+
+from ._crc32c import masked_crc32c
+
+COMPRESSION_WINDOW_BITS: Dict[str, int] = {"GZIP": zlib.MAX_WBITS + 16, "ZLIB": zlib.MAX_WBITS}
+""" The window bits of the zlib compressor for each Tensorflow compression type (selects the header). """
+
+
+class TFRecordWriter:
+    """
+    Writes records to a (possibly compressed) TFRecord file, without requiring
+    Tensorflow. Each record is framed as its length (uint64) and the masked
+    CRC32C of the length, followed by the data and its masked CRC32C. Compressed
+    files are written as a single gzip/zlib stream, like tf.io.TFRecordWriter does.
+    """
+    def __init__(self, filename: str, compression_type: str = ""):
+        """
+        :param filename:            The file to write the records to.
+        :param compression_type:    The Tensorflow compression type ("", GZIP or ZLIB).
+        """
+        if compression_type and compression_type not in COMPRESSION_WINDOW_BITS:
+            raise ValueError(f"Unknown compression type '{compression_type}'")
+
+        self.filename: str = filename
+        self._file: Optional[IO[bytes]] = open(filename, "wb")
+        self._compressor = zlib.compressobj(zlib.Z_DEFAULT_COMPRESSION, zlib.DEFLATED,
+                                            COMPRESSION_WINDOW_BITS[compression_type]) \
+            if compression_type else None
+
+    def _write(self, data: bytes):
+        """
+        Writes (and compresses) the data to the file.
+
+        :param data:    The data.
+        """
+        if self._compressor is not None:
+            data = self._compressor.compress(data)
+        self._file.write(data)
+
+    def write(self, record: bytes):
+        """
+        Writes the record.
+
+        :param record:  The (serialized) record.
+        """
+        if self._file is None:
+            raise ValueError(f"{self.filename} is already closed")
+
+        length = struct.pack("<Q", len(record))
+        self._write(length + struct.pack("<I", masked_crc32c(length)))
+        self._write(record)
+        self._write(struct.pack("<I", masked_crc32c(record)))
+
+    def flush(self):
+        """
+        Flushes the written records to the file (the file remains a valid stream).
+        """
+        if self._compressor is not None:
+            self._file.write(self._compressor.flush(zlib.Z_SYNC_FLUSH))
+        self._file.flush()
+
+    def close(self):
+        """
+        Finishes the file.
+        """
+        if self._file is None:
+            return
+
+        try:
+            if self._compressor is not None:
+                self._file.write(self._compressor.flush())
+        finally:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "TFRecordWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
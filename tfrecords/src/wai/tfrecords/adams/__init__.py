@@ -3,11 +3,30 @@ Package for converting images and their associated annotations (in ADAMS .report
 to Tensorflow TFRecords format.
 """
 from ._convert import convert
-from ._determine_labels import determine_labels
+from ._ConvertOptions import ConvertOptions, SHARDING_ROUND_ROBIN, SHARDING_BALANCED, SHARDING_STRATEGIES
+from ._convert_incremental import ManifestWriter, select_changed_reports
+from ._convert_report import convert_report
+from ._crc32c import crc32c, masked_crc32c
+from ._create_detection_example import create_detection_example
+from ._DetectionExample import DetectionExample
+from ._deduplicate import DuplicateLog, DEDUPLICATION_NONE, DEDUPLICATION_SKIP, DEDUPLICATION_MERGE, \
+    DEDUPLICATIONS
+from ._determine_labels import determine_labels, select_labels
 from ._fix_labels import fix_labels
 from ._get_files_from_directory import get_files_from_directory
 from ._ImageFormat import ImageFormat
+from ._ImageIndex import ImageIndex, get_associated_images
 from ._logging import logger, LOGGING_NAME
 from ._main import main, sys_main
+from ._Manifest import Manifest, fingerprint_file
+from ._parallel_map import parallel_map
+from ._ParsedReport import ParsedReport
+from ._profiling import Profiler, profiler, STAGES
+from ._probe_image_size import probe_image_size
+from ._ReportCache import ReportCache
+from ._ShardWriter import ShardWriter, COMPRESSION_NONE, COMPRESSION_GZIP, COMPRESSION_ZLIB, COMPRESSIONS, \
+    compression_type
+from ._resize_image import resize_image
+from ._TFRecordWriter import TFRecordWriter
 from ._to_tf_example import to_tf_example
 from ._write_protobuf_label_map import write_protobuf_label_map
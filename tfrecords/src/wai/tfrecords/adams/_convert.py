@@ -1,189 +1,479 @@
+import heapq
+import math
 import os
-from typing import Dict, Optional, List, Callable
+from functools import partial
+from typing import Dict, Optional, List, Callable, Iterable, Union
 
-import tensorflow as tf
 import contextlib2
-from wai.common.file.report import Report, loadf
 from wai.common.file.report.constants import EXTENSION as REPORT_EXT
-from wai.common.adams.imaging.locateobjects import LocatedObjects
 
-from ..object_detection.dataset_tools import tf_record_creation_util
 from ._logging import logger
-from ._determine_labels import determine_labels
+from ._convert_incremental import ManifestWriter, prepare_manifest, select_changed_reports
+from ._convert_report import convert_report
+from ._ConvertOptions import ConvertOptions, SHARDING_BALANCED, SHARDING_STRATEGIES
+from ._deduplicate import DuplicateLog, DEDUPLICATION_NONE, DEDUPLICATION_MERGE, parse_and_hash_report, \
+    log_duplicates
+from ._determine_labels import determine_labels, select_labels
 from ._get_files_from_directory import get_files_from_directory
-from ._write_protobuf_label_map import write_protobuf_label_map
 from ._ImageFormat import ImageFormat
-from .constants import PREFIX_OBJECT
-from ._fix_labels import fix_labels
-from ._to_tf_example import to_tf_example
+from ._ImageIndex import ImageIndex, get_associated_images
+from ._Manifest import Manifest, Entry
+from ._parallel_map import parallel_map
+from ._ParsedReport import ParsedReport
+from ._profiling import profiler, STAGE_DISCOVERY, STAGE_WRITE_QUEUE
+from ._ReportCache import ReportCache
+from ._ShardWriter import ShardWriter, compression_type
+from ._write_protobuf_label_map import write_protobuf_label_map
+
+# The reports to convert, either as report filenames or already parsed
+Reports = Iterable[Union[str, ParsedReport]]
+
+BYTES_PER_MB: int = 1024 * 1024
+""" The number of bytes in a megabyte. """
+
+SHARDED_NAME_FORMAT: str = "{}-{:05d}-of-{:05d}"
+""" The format of the shard filenames when sharding (output file, shard, number of shards). """
+
+STREAMING_INDEXED_DIRECTORIES: int = 64
+""" The number of directories to keep in the image index while streaming the reports. """
 
 
 def convert(input_dir: Optional[str],
-            input_files: Optional[List[str]],
+            input_files: Optional[Iterable[str]],
             output_file: str,
-            mappings: Optional[Dict[str, str]] = None,
-            regexp: str = None,
-            labels: Optional[List[str]] = None,
-            protobuf_label_map: Optional[str] = None,
-            shards: int = -1,
-            verbose: bool = False):
+            options: ConvertOptions = ConvertOptions()):
     """
     Converts the images and annotations (.report) files into TFRecords.
 
     :param input_dir: the input directory (PNG/JPG, .report)
-    :param input_files: the file containing the report files to use
+    :param input_files: the report files to use (can be streamed, eg from a generator)
     :param output_file: the output file for TFRecords
-    :param mappings: the label mappings for replacing labels (key: old label, value: new label)
-    :param regexp: the regular expression to use for limiting the labels stored
-    :param labels: the predefined list of labels to use
-    :param protobuf_label_map: the (optional) file to store the label mapping (in protobuf format)
-    :param shards: the number of shards to generate, <= 1 for just single file
-    :param verbose: whether to have a more verbose record generation
-    """
-    # Determine the list of files to convert
+    :param options: the options of the conversion (labels, sharding, image processing, etc)
+    """
+    # Fail early on an unknown compression
+    compression_type(options.compression)
+
+    # Keep track of duplicate images if requested
+    duplicate_log: Optional[DuplicateLog] = None
+    if options.deduplication != DEDUPLICATION_NONE:
+        duplicate_log = DuplicateLog(options.deduplication)
+        if options.deduplication == DEDUPLICATION_MERGE and options.manifest:
+            raise ValueError("Merging duplicates is not supported when using a manifest")
+
+    # Time the stages of the conversion if requested
+    if options.profile is not None:
+        profiler.start()
+
+    # The labels to use, determined from the reports if not given
+    labels: Optional[List[str]] = options.labels
+
+    # The reports are streamed from discovery into the conversion, unless
+    # a full pass over all of them is required beforehand
+    streaming: bool = (labels is not None or options.single_pass) and not options.manifest \
+                      and options.shard_size_mb <= 0 and options.deduplication != DEDUPLICATION_MERGE
+
+    # The index of the images, filled while searching for the reports
+    image_index: ImageIndex = ImageIndex(STREAMING_INDEXED_DIRECTORIES if streaming else -1)
+
+    # Determine the files to convert
     if input_dir is not None:
-        report_files = get_files_from_directory(input_dir)
+        report_files = get_files_from_directory(input_dir, image_index)
     else:
-        report_files = [os.path.splitext(input_file)[0] + REPORT_EXT for input_file in input_files]
+        report_files = (os.path.splitext(input_file)[0] + REPORT_EXT for input_file in input_files)
+    report_files = profiler.iterate(STAGE_DISCOVERY, report_files)
+
+    if not streaming:
+        report_files = list(report_files)
+
+        # Log the report files
+        if options.verbose:
+            logger.info(f"# report files: {len(report_files)}")
+
+    # Only convert new/changed reports if a manifest is kept
+    manifest_obj: Optional[Manifest] = None
+    fingerprints: Optional[Dict[str, Entry]] = None
+    check_labels: bool = False
+    if options.manifest:
+        if options.shards > 1:
+            raise ValueError("Sharding is not supported when using a manifest, use the records per shard instead")
+        manifest_obj = Manifest.load(Manifest.filename_for(output_file))
+        # Labels determined by a previous run have to cover the labels of the new/changed reports
+        check_labels = labels is None and manifest_obj.labels is not None
+        labels = prepare_manifest(manifest_obj, output_file, labels,
+                                  {"max_dim": options.max_dim, "jpeg_quality": options.jpeg_quality,
+                                   "compression_type": compression_type(options.compression),
+                                   "mappings": options.mappings, "regexp": options.regexp})
+        report_files, fingerprints = select_changed_reports(report_files, manifest_obj, options.workers,
+                                                            image_index)
+
+    with ReportCache(options.max_cached_reports) as report_cache:
+        # Merge duplicates up front (also determining the labels if they are not given)
+        if options.deduplication == DEDUPLICATION_MERGE:
+            parsed_labels = parse_reports(report_files, options.mappings, options.regexp, report_cache,
+                                          options.workers, image_index, duplicate_log)
+            labels = labels if labels is not None else parsed_labels
+            report_files = report_cache
+
+        # Determine the labels if they are not given
+        elif labels is None or check_labels:
+            if options.single_pass:
+                found_labels = parse_reports(report_files, options.mappings, options.regexp, report_cache,
+                                             options.workers, image_index)
+                report_files = report_cache
+            else:
+                found_labels = determine_labels(report_files, options.mappings, options.regexp)
+
+            if check_labels:
+                missing = sorted(set(found_labels).difference(labels))
+                if len(missing) > 0:
+                    raise ValueError(f"Labels {missing} are not present in manifest {manifest_obj.filename}: "
+                                     f"{labels}")
+            else:
+                labels = found_labels
+
+        if manifest_obj is not None:
+            # Store the labels before the first shard gets committed
+            manifest_obj.labels = labels
+            manifest_obj.save()
+        elif options.shard_size_mb > 0:
+            # Determine the number of shards from the target shard size
+            shards = estimate_shards(report_files, max_shard_bytes(options), image_index)
+            options = options._replace(shards=shards, sharding=SHARDING_BALANCED)
+            logger.info(f"# shards for {options.shard_size_mb}MB/shard: {shards}")
+
+        convert_with_labels(report_files, output_file, labels, options, image_index, manifest_obj, fingerprints,
+                            duplicate_log)
+
+    # Output the duplicates
+    if duplicate_log is not None:
+        log_duplicates(duplicate_log, options.dedup_report)
+
+    # Output the timings
+    if options.profile is not None:
+        logger.info("profile:\n" + profiler.summary())
+        profiler.write(options.profile)
+
+
+def max_shard_bytes(options: ConvertOptions) -> int:
+    """
+    Gets the target size of the shards in bytes.
+
+    :param options:     The options of the conversion.
+    :return:            The size in bytes, -1 for no limit.
+    """
+    return int(options.shard_size_mb * BYTES_PER_MB) if options.shard_size_mb > 0 else -1
 
-    # Log the report files
-    if verbose:
-        logger.info(f"# report files: {len(report_files)}")
 
-    # Determine the labels if they are not given
-    if labels is None:
-        labels = determine_labels(report_files, mappings, regexp)
+def estimate_shards(report_files: Reports,
+                    max_shard_bytes: int,
+                    image_index: Optional[ImageIndex] = None) -> int:
+    """
+    Estimates the number of shards required to keep each shard below the given
+    size, using the sizes of the images as estimates for the sizes of the records.
+
+    :param report_files:        The reports to convert.
+    :param max_shard_bytes:     The target size of each shard in bytes.
+    :param image_index:         The (optional) index to look up the images in.
+    :return:                    The number of shards.
+    """
+    total: int = 0
+    for report in report_files:
+        if isinstance(report, ParsedReport):
+            image_file = report.image_file
+        elif image_index is not None:
+            image_file, _ = image_index.get_associated_image(report)
+        else:
+            image_file, _ = ImageFormat.get_associated_image(report)
+
+        if image_file is not None:
+            total += os.path.getsize(image_file)
+
+    return max(1, math.ceil(total / max_shard_bytes))
+
+
+def parse_reports(report_files: Iterable[str],
+                  mappings: Optional[Dict[str, str]],
+                  regexp: Optional[str],
+                  report_cache: ReportCache,
+                  workers: int = 1,
+                  image_index: Optional[ImageIndex] = None,
+                  duplicate_log: Optional[DuplicateLog] = None) -> List[str]:
+    """
+    Parses each of the report files once, determining the labels present
+    and storing the parsed reports in the cache for the later conversion.
+    If a duplicate log is given, the annotations of reports with identical
+    images are merged (which keeps all parsed reports in memory until all
+    have been parsed).
+
+    :param report_files:        The report files to parse.
+    :param mappings:            Label mappings.
+    :param regexp:              The regular expression to use for limiting the labels stored.
+    :param report_cache:        The cache to add the parsed reports to.
+    :param workers:             The number of worker processes.
+    :param image_index:         The (optional) index to look up the images in.
+    :param duplicate_log:       The (optional) log to record the merged duplicates in.
+    :return:                    The list of labels.
+    """
+    # Hash the images as well if merging duplicates
+    if duplicate_log is None:
+        function = partial(ParsedReport.from_report_file, mappings=mappings)
+    else:
+        function = partial(parse_and_hash_report, mappings=mappings)
+
+    labels = set()
+    merged: List[ParsedReport] = []
+    merged_index: Dict[str, int] = {}
+    for result in parallel_map(function, get_associated_images(report_files, image_index), workers, star=True):
+        report, sha256 = result if duplicate_log is not None else (result, None)
+
+        # All labels are considered, even if the report is not converted
+        labels.update(report.labels())
+
+        # Log a warning if the image wasn't found
+        if report.image_file is None:
+            logger.warning(f"Failed to determine image for report: {report.report_file}")
+            continue
+
+        # Merge the annotations of duplicates into the first report of the image
+        if duplicate_log is not None:
+            if duplicate_log.check(sha256, report.report_file) is None:
+                merged_index[sha256] = len(merged)
+                merged.append(report)
+            else:
+                index = merged_index[sha256]
+                merged[index] = merged[index].merge(report)
+            continue
 
+        # Only keep reports that have annotated objects
+        if len(report.annotations) > 0:
+            report_cache.add(report)
+
+    for report in merged:
+        if len(report.annotations) > 0:
+            report_cache.add(report)
+
+    return select_labels(labels, regexp)
+
+
+def convert_with_labels(report_files: Reports,
+                        output_file: str,
+                        labels: List[str],
+                        options: ConvertOptions,
+                        image_index: Optional[ImageIndex] = None,
+                        manifest: Optional[Manifest] = None,
+                        fingerprints: Optional[Dict[str, Entry]] = None,
+                        duplicate_log: Optional[DuplicateLog] = None):
+    """
+    Converts the reports into TFRecords, once the labels are known.
+
+    :param report_files:        The reports to convert.
+    :param output_file:         The file to write the conversion results to.
+    :param labels:              The labels to use.
+    :param options:             The options of the conversion.
+    :param image_index:         The (optional) index to look up the images in.
+    :param manifest:            The manifest to record the conversion in, if any.
+    :param fingerprints:        The fingerprints of the reports to convert (required with a manifest).
+    :param duplicate_log:       The (optional) log for skipping reports with duplicate images.
+    """
     # Create a map from label to its index
     label_index_map: Dict[str, int] = {label: index + 1 for index, label in enumerate(labels)}
 
     # Output the label index map if requested
-    if protobuf_label_map is not None:
-        write_protobuf_label_map(label_index_map, protobuf_label_map)
+    if options.protobuf_label_map is not None:
+        write_protobuf_label_map(label_index_map, options.protobuf_label_map, compression_type(options.compression))
 
     # Log the labels
-    if verbose:
+    if options.verbose:
         logger.info(f"labels considered: {labels}")
 
-    if shards > 1:
+    if manifest is not None:
+        # Output committed shard-by-shard to the manifest
+        convert_with_manifest(report_files, output_file, label_index_map, options, manifest, fingerprints,
+                              image_index, duplicate_log)
+    elif options.shards > 1:
         # Sharded output
-        convert_sharded(report_files, output_file, mappings, label_index_map, verbose, shards)
+        convert_sharded(report_files, output_file, label_index_map, options, image_index, duplicate_log)
     else:
         # Unsharded output
-        convert_unsharded(report_files, output_file, mappings, label_index_map, verbose)
+        convert_unsharded(report_files, output_file, label_index_map, options, image_index, duplicate_log)
 
 
-def convert_sharded(report_files: List[str],
+def convert_sharded(report_files: Reports,
                     output_file: str,
-                    mappings: Optional[Dict[str, str]],
                     label_index_map: Dict[str, int],
-                    verbose: bool,
-                    shards: int):
+                    options: ConvertOptions,
+                    image_index: Optional[ImageIndex] = None,
+                    duplicate_log: Optional[DuplicateLog] = None):
     """
-    Performs the conversion in a sharded manner.
+    Performs the conversion in a sharded manner. Each shard is written
+    (and compressed) on its own thread.
 
-    :param report_files:        The list of report files to convert.
+    :param report_files:        The reports to convert.
     :param output_file:         The file to write the conversion results to.
-    :param mappings:            Label mappings.
     :param label_index_map:     The label index lookup.
-    :param verbose:             Whether to log verbose messages.
-    :param shards:              The number of shards.
+    :param options:             The options of the conversion (number of shards, sharding strategy, etc).
+    :param image_index:         The (optional) index to look up the images in.
+    :param duplicate_log:       The (optional) log for skipping reports with duplicate images.
     """
+    if options.sharding not in SHARDING_STRATEGIES:
+        raise ValueError(f"Unknown sharding strategy '{options.sharding}', available: {SHARDING_STRATEGIES}")
+
     with contextlib2.ExitStack() as tf_record_close_stack:
-        # Open the output file for sharded writing
-        output_tfrecords = tf_record_creation_util.open_sharded_output_tfrecords(tf_record_close_stack,
-                                                                                 output_file,
-                                                                                 shards)
+        # Open the output files for sharded writing
+        output_tfrecords = [tf_record_close_stack.enter_context(
+                                ShardWriter(SHARDED_NAME_FORMAT.format(output_file, shard, options.shards),
+                                            options.compression, options.index, options.tf_writer))
+                            for shard in range(options.shards)]
 
         # Functor for sharded writing
         class Writer:
             def __init__(self):
                 self.index = 0
 
-            def __call__(self, example: tf.train.Example):
-                output_tfrecords[self.index % shards].write(example.SerializeToString())
+            def __call__(self, report_file: str, example: bytes):
+                output_tfrecords[self.index % options.shards].write(example)
                 self.index += 1
 
+        # Functor for size-balanced sharded writing
+        class BalancedWriter:
+            def __init__(self):
+                # Heap of (bytes written, shard index)
+                self.sizes = [(0, index) for index in range(options.shards)]
+
+            def __call__(self, report_file: str, example: bytes):
+                size, index = heapq.heappop(self.sizes)
+                output_tfrecords[index].write(example)
+                heapq.heappush(self.sizes, (size + len(example), index))
+
+        writer = BalancedWriter() if options.sharding == SHARDING_BALANCED else Writer()
+
         # Perform the conversion
-        do_convert(report_files, mappings, label_index_map, verbose, Writer())
+        do_convert(report_files, label_index_map, options, writer, image_index=image_index,
+                   duplicate_log=duplicate_log)
 
 
-def convert_unsharded(report_files: List[str],
+def convert_unsharded(report_files: Reports,
                       output_file: str,
-                      mappings: Optional[Dict[str, str]],
                       label_index_map: Dict[str, int],
-                      verbose: bool):
+                      options: ConvertOptions,
+                      image_index: Optional[ImageIndex] = None,
+                      duplicate_log: Optional[DuplicateLog] = None):
     """
-    Performs the conversion in an unsharded manner.
+    Performs the conversion in an unsharded manner. The file is written
+    (and compressed) on a separate thread.
 
-    :param report_files:        The list of report files to convert.
+    :param report_files:        The reports to convert.
     :param output_file:         The file to write the conversion results to.
-    :param mappings:            Label mappings.
     :param label_index_map:     The label index lookup.
-    :param verbose:             Whether to log verbose messages.
+    :param options:             The options of the conversion.
+    :param image_index:         The (optional) index to look up the images in.
+    :param duplicate_log:       The (optional) log for skipping reports with duplicate images.
     """
     # Create an unsharded writer
-    writer = tf.io.TFRecordWriter(output_file)
+    writer = ShardWriter(output_file, options.compression, options.index, options.tf_writer)
 
     # Create a function to perform writing for do_convert
-    def write(example: tf.train.Example):
-        writer.write(example.SerializeToString())
+    def write(report_file: str, example: bytes):
+        writer.write(example)
 
     # Perform the conversion
-    do_convert(report_files, mappings, label_index_map, verbose, write)
+    do_convert(report_files, label_index_map, options, write, image_index=image_index, duplicate_log=duplicate_log)
 
     # Close the writer
     writer.close()
 
 
-def do_convert(report_files: List[str],
-               mappings: Optional[Dict[str, str]],
-               label_index_map: Dict[str, int],
-               verbose: bool,
-               write: Callable[[tf.train.Example], None]):
+def convert_with_manifest(report_files: Reports,
+                          output_file: str,
+                          label_index_map: Dict[str, int],
+                          options: ConvertOptions,
+                          manifest: Manifest,
+                          fingerprints: Dict[str, Entry],
+                          image_index: Optional[ImageIndex] = None,
+                          duplicate_log: Optional[DuplicateLog] = None):
     """
-    Performs the actual conversion of the report files, using the given
-    write function to output the results.
+    Performs the conversion into sequentially-written shards, which are
+    committed to the manifest as soon as they are complete.
 
-    :param report_files:        The list of report files to convert.
-    :param mappings:            Label mappings.
+    :param report_files:        The reports to convert.
+    :param output_file:         The file the shards are named after.
     :param label_index_map:     The label index lookup.
-    :param verbose:             Whether to log verbose messages.
-    :param write:               The function to call to output an example.
+    :param options:             The options of the conversion (records per shard, shard size, etc).
+    :param manifest:            The manifest to commit the shards to.
+    :param fingerprints:        The fingerprints of the reports to convert.
+    :param image_index:         The (optional) index to look up the images in.
+    :param duplicate_log:       The (optional) log for skipping reports with duplicate images.
     """
-    # Process each file
-    for report_file in report_files:
-        # Get the image associated to this report
-        image_file, image_format = ImageFormat.get_associated_image(report_file)
-
-        # Log a warning if the image wasn't found
-        if image_file is None:
-            logger.warning(f"Failed to determine image for report: {report_file}")
-            continue
+    writer = ManifestWriter(output_file, manifest, fingerprints, options.records_per_shard, max_shard_bytes(options),
+                            options.compression, options.index, options.tf_writer)
 
-        # Load the report
-        report: Report = loadf(report_file)
+    # Perform the conversion
+    do_convert(report_files, label_index_map, options, writer, writer.skipped, image_index, duplicate_log)
 
-        # Get the annotated objects from the report
-        objects: LocatedObjects = LocatedObjects.from_report(report, PREFIX_OBJECT)
+    # Commit the last (partial) shard
+    writer.commit()
 
-        # Skip reports with no annotated objects
-        if len(objects) == 0:
-            continue
 
-        # Apply any label mappings
-        if mappings is not None:
-            fix_labels(objects, mappings)
-
-        # Create a Tensorflow example from the image and annotations
-        example: tf.train.Example = to_tf_example(image_file, image_format, objects, label_index_map, verbose)
+def do_convert(report_files: Reports,
+               label_index_map: Dict[str, int],
+               options: ConvertOptions,
+               write: Callable[[str, bytes], None],
+               skipped: Optional[Callable[[str], None]] = None,
+               image_index: Optional[ImageIndex] = None,
+               duplicate_log: Optional[DuplicateLog] = None):
+    """
+    Performs the actual conversion of the report files, using the given
+    write function to output the results. If more than one worker is
+    requested, the reports are parsed and the examples built in a pool of
+    processes, while the serialized examples are still written by the
+    calling process, in the same order as the report files.
 
-        # Continue if example-creation failed
+    :param report_files:        The reports to convert.
+    :param label_index_map:     The label index lookup.
+    :param options:             The options of the conversion (label mappings, workers, image processing, etc).
+    :param write:               The function to call to output a serialized example (gets
+                                passed the report file as well).
+    :param skipped:             The (optional) function to call with any report file that
+                                didn't result in an example.
+    :param image_index:         The (optional) index to look up the images in (in the calling
+                                process), rather than checking for image files in the workers.
+    :param duplicate_log:       The (optional) log for skipping reports whose image is identical to
+                                that of an earlier report (using the hash of the image read by the
+                                conversion itself).
+    """
+    # Create the function that converts a single report
+    convert_function = partial(convert_report,
+                               mappings=options.mappings,
+                               label_index_map=label_index_map,
+                               verbose=options.verbose,
+                               max_dim=options.max_dim,
+                               jpeg_quality=options.jpeg_quality)
+
+    # Process each result, in the order of the report files
+    # Pair the reports with their images (parsed reports already know their image)
+    items = ((report, None if image_index is None or isinstance(report, ParsedReport)
+              else image_index.get_associated_image(report))
+             for report in report_files)
+
+    for report_file, image_file, example, sha256 in parallel_map(convert_function, items, options.workers, star=True):
+        # Continue if conversion failed
         if example is None:
+            if skipped is not None:
+                skipped(report_file)
             continue
 
+        # Skip duplicate images
+        if duplicate_log is not None:
+            original = duplicate_log.check(sha256, report_file)
+            if original is not None:
+                logger.info(f"skipping duplicate: {image_file} (of {original})")
+                if skipped is not None:
+                    skipped(report_file)
+                continue
+
         # Logging
         logger.info(f"storing: {image_file}")
 
         # Output the example
-        write(example)
+        with profiler.time(STAGE_WRITE_QUEUE):
+            write(report_file, example)
@@ -0,0 +1,223 @@
+import os
+import re
+from typing import Any, Dict, Optional, List, Tuple
+
+from ..reader import INDEX_SUFFIX
+from ._logging import logger
+from ._ImageFormat import ImageFormat
+from ._ImageIndex import ImageIndex, ImageLookup
+from ._Manifest import Manifest, Entry, fingerprint_file, remove_uncommitted_shards
+from ._parallel_map import parallel_map
+from ._ShardWriter import ShardWriter, COMPRESSION_NONE
+
+SHARD_NAME_FORMAT: str = "{}-{:05d}-{:05d}"
+""" The format of shard filenames (output file, run, shard). """
+
+SHARD_NAME_PATTERN: str = r"-\d{5}-\d{5}"
+""" The regular expression matching the suffix of shard filenames. """
+
+SHARD_FILE_PATTERN: str = SHARD_NAME_PATTERN + "(" + re.escape(INDEX_SUFFIX) + ")?"
+""" The regular expression matching the suffix of the files of a shard (the shard and its index). """
+
+RECORD_FRAMING_SIZE: int = 16
+""" The number of bytes TFRecord framing adds to each record (length, length CRC, data CRC). """
+
+
+def fingerprint_report(report_file: str,
+                       image: Optional[ImageLookup],
+                       previous: Optional[Entry]) -> Tuple[str, Optional[Entry], bool]:
+    """
+    Fingerprints a report and its associated image, and checks whether
+    either has changed since the previous conversion.
+
+    :param report_file:     The report file.
+    :param image:           The associated image if already looked up (eg from an image index).
+    :param previous:        The report's entry from the manifest (None if new).
+    :return:                The report file, its fingerprints (None if it has no image)
+                            and whether it needs to be converted.
+    """
+    # Reports without an image are always passed on, so the conversion warns about them
+    image_file, _ = image if image is not None else ImageFormat.get_associated_image(report_file)
+    if image_file is None:
+        return report_file, None, True
+
+    # Images are only comparable if the report still resolves to the same file
+    if previous is not None and previous["image"]["path"] != image_file:
+        previous = None
+
+    report_fingerprint = fingerprint_file(report_file, previous["report"] if previous is not None else None)
+    image_fingerprint = fingerprint_file(image_file, previous["image"] if previous is not None else None)
+
+    changed = (previous is None
+               or previous["report"]["sha256"] != report_fingerprint["sha256"]
+               or previous["image"]["sha256"] != image_fingerprint["sha256"])
+
+    return report_file, {"report": report_fingerprint, "image": image_fingerprint}, changed
+
+
+def select_changed_reports(report_files: List[str],
+                           manifest: Manifest,
+                           workers: int = 1,
+                           image_index: Optional[ImageIndex] = None) -> Tuple[List[str], Dict[str, Entry]]:
+    """
+    Determines which reports are new or have changed (or whose image has
+    changed) since the last conversion recorded in the manifest. Records of
+    reports that no longer exist (or no longer have an image) are marked as
+    stale.
+
+    :param report_files:    The report files to check.
+    :param manifest:        The manifest of the previous conversions.
+    :param workers:         The number of worker processes.
+    :param image_index:     The (optional) index to look up the images in.
+    :return:                The reports to convert, and their fingerprints (keyed by absolute report path).
+    """
+    keys = [os.path.abspath(report_file) for report_file in report_files]
+
+    # Records of removed reports are stale
+    removed = set(manifest.entries.keys()).difference(keys)
+    for key in removed:
+        manifest.mark_stale(key)
+
+    selected: List[str] = []
+    fingerprints: Dict[str, Entry] = {}
+    items = ((report_file, image_index.get_associated_image(report_file) if image_index is not None else None,
+              manifest.entries.get(key, None))
+             for report_file, key in zip(report_files, keys))
+    for report_file, fingerprint, changed in parallel_map(fingerprint_report, items, workers, star=True):
+        key = os.path.abspath(report_file)
+        if changed:
+            selected.append(report_file)
+            if fingerprint is not None:
+                fingerprints[key] = fingerprint
+            else:
+                # The image is gone, so the record of any previous conversion is stale
+                manifest.mark_stale(key)
+        else:
+            # Keep the stats up-to-date for touched but unchanged files
+            manifest.entries[key].update(fingerprint)
+
+    logger.info(f"# new/changed reports: {len(selected)}, # unchanged: {len(report_files) - len(selected)}, "
+                f"# removed: {len(removed)}")
+
+    return selected, fingerprints
+
+
+class ManifestWriter:
+    """
+    Writer for do_convert which writes the records into sequentially-numbered
+    shards of a limited size, committing each completed shard (along with the
+    reports processed while writing it) to the manifest.
+    """
+    def __init__(self,
+                 output_file: str,
+                 manifest: Manifest,
+                 fingerprints: Dict[str, Entry],
+                 records_per_shard: int,
+                 max_shard_bytes: int = -1,
+                 compression: str = COMPRESSION_NONE,
+                 index: bool = False,
+                 tf_writer: bool = False):
+        """
+        :param output_file:         The output file the shards are named after.
+        :param manifest:            The manifest to commit the shards to.
+        :param fingerprints:        The fingerprints of the reports being converted.
+        :param records_per_shard:   The maximum number of records per shard.
+        :param max_shard_bytes:     The maximum size of a shard in bytes (uncompressed), <= 0 for no limit.
+        :param compression:         The compression of the shards (none/gzip/zlib).
+        :param index:               Whether to write an index next to each shard.
+        :param tf_writer:           Whether to write the shards with Tensorflow's TFRecordWriter.
+        """
+        self.output_file: str = output_file
+        self.manifest: Manifest = manifest
+        self.fingerprints: Dict[str, Entry] = fingerprints
+        self.records_per_shard: int = records_per_shard
+        self.max_shard_bytes: int = max_shard_bytes
+        self.compression: str = compression
+        self.index: bool = index
+        self.tf_writer: bool = tf_writer
+        self.run: int = manifest.next_run
+        self.shard: int = 0
+        self.writer: Optional[ShardWriter] = None
+        self.shard_file: Optional[str] = None
+        self.records: int = 0
+        self.offset: int = 0
+        self.pending: Dict[str, Entry] = {}
+
+    def __call__(self, report_file: str, example: bytes):
+        # Start a new shard if necessary
+        if self.writer is None:
+            self.shard_file = SHARD_NAME_FORMAT.format(self.output_file, self.run, self.shard)
+            self.writer = ShardWriter(self.shard_file, self.compression, self.index, self.tf_writer)
+
+        key = os.path.abspath(report_file)
+        self.pending[key] = dict(self.fingerprints[key],
+                                 shard=os.path.basename(self.shard_file),
+                                 record=self.records,
+                                 offset=self.offset)
+
+        self.writer.write(example)
+        self.records += 1
+        self.offset += len(example) + RECORD_FRAMING_SIZE
+
+        # Commit the shard once it is full
+        if self.records >= self.records_per_shard or 0 < self.max_shard_bytes <= self.offset:
+            self.commit()
+
+    def skipped(self, report_file: str):
+        """
+        Records that no record was generated for the given report.
+
+        :param report_file:     The report file.
+        """
+        key = os.path.abspath(report_file)
+        if key in self.fingerprints:
+            self.pending[key] = dict(self.fingerprints[key], shard=None, record=None, offset=None)
+
+    def commit(self):
+        """
+        Closes the current shard (if any) and commits it to the manifest.
+        """
+        shard = None
+        if self.writer is not None:
+            self.writer.close()
+            self.writer = None
+            shard = {"file": os.path.basename(self.shard_file), "run": self.run, "records": self.records}
+            logger.info(f"committed shard: {self.shard_file}")
+            self.shard += 1
+            self.records = 0
+            self.offset = 0
+
+        self.manifest.commit(shard, self.pending)
+        self.pending = {}
+
+
+def prepare_manifest(manifest: Manifest,
+                     output_file: str,
+                     labels: Optional[List[str]],
+                     options: Optional[Dict[str, Any]] = None) -> Optional[List[str]]:
+    """
+    Prepares the manifest for a new conversion run, removing shards left behind
+    by a crashed run and reconciling the labels and options.
+
+    :param manifest:        The manifest.
+    :param output_file:     The output file the shards are named after.
+    :param labels:          The labels given by the user, if any.
+    :param options:         The options that affect the content of the records.
+    :return:                The labels to use, None if they still need to be determined.
+    """
+    remove_uncommitted_shards(manifest, output_file, SHARD_FILE_PATTERN)
+
+    # Keep the records of all runs consistent
+    options = options if options is not None else {}
+    if len(manifest.shards) > 0 and manifest.options != options:
+        raise ValueError(f"Options {options} differ from the ones in manifest {manifest.filename}: "
+                         f"{manifest.options}")
+    manifest.options = options
+
+    # Keep the label indices consistent with the records already written
+    if manifest.labels is None:
+        return labels
+    if labels is not None and labels != manifest.labels:
+        raise ValueError(f"Labels {labels} differ from the ones in manifest {manifest.filename}: {manifest.labels}")
+
+    return manifest.labels
@@ -0,0 +1,64 @@
+from typing import Dict, Optional, Tuple, Union
+
+from ._create_detection_example import create_detection_example
+from ._DetectionExample import DetectionExample
+from ._ImageIndex import ImageLookup
+from ._logging import logger
+from ._ParsedReport import ParsedReport
+from ._profiling import profiler, STAGE_SERIALIZATION
+
+
+def convert_report(report: Union[str, ParsedReport],
+                   image: Optional[ImageLookup],
+                   mappings: Optional[Dict[str, str]],
+                   label_index_map: Dict[str, int],
+                   verbose: bool,
+                   max_dim: int = -1,
+                   jpeg_quality: int = -1) -> Tuple[str, Optional[str], Optional[bytes], Optional[str]]:
+    """
+    Converts a single report (and its associated image) into a serialized
+    Tensorflow example. Only module-level state is used, so this function
+    can be handed to the worker processes of a pool.
+
+    :param report:              The report file to convert, or the already parsed report.
+    :param image:               The associated image of a report file, if already looked up.
+    :param mappings:            Label mappings (only applied to report files).
+    :param label_index_map:     The label index lookup.
+    :param verbose:             Whether to log verbose messages.
+    :param max_dim:             The maximum width/height of the stored image, <= 0 for no limit.
+    :param jpeg_quality:        The JPEG quality to re-encode the stored image with, <= 0 for as-is.
+    :return:                    The report filename, the image filename, the serialized
+                                example and the SHA256 hash of the image (both None if the
+                                report could not be converted).
+    """
+    # Load and parse the report if necessary
+    if not isinstance(report, ParsedReport):
+        report = ParsedReport.from_report_file(report, image, mappings)
+
+    # Log a warning if the image wasn't found
+    if report.image_file is None:
+        logger.warning(f"Failed to determine image for report: {report.report_file}")
+        return report.report_file, None, None, None
+
+    # Skip reports with no annotated objects
+    if len(report.annotations) == 0:
+        return report.report_file, report.image_file, None, None
+
+    # Create the example from the image and annotations
+    example: DetectionExample = create_detection_example(report.image_file,
+                                                         report.image_format,
+                                                         report.to_located_objects(),
+                                                         label_index_map,
+                                                         verbose,
+                                                         max_dim,
+                                                         jpeg_quality)
+
+    # Abort if example-creation failed
+    if example is None:
+        return report.report_file, report.image_file, None, None
+
+    # Encode the example directly, rather than via the tf.train.Example proto
+    with profiler.time(STAGE_SERIALIZATION):
+        serialized = example.encode()
+
+    return report.report_file, report.image_file, serialized, example.sha256
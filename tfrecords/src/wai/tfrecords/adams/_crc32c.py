@@ -0,0 +1,181 @@
+"""
+CRC32C (Castagnoli) checksums, as used by the TFRecord framing, implemented
+with numpy. Short data is processed byte by byte with the usual lookup table.
+Longer data is split into equal-sized chunks whose CRCs are computed side by
+side (one numpy operation per byte position for all chunks), and then combined
+using the linearity of the CRC: appending n zero bytes is a linear map on the
+CRC register, whose lookup tables are cached per n.
+"""
+from functools import lru_cache
+from typing import List
+
+import numpy as np
+
+POLYNOMIAL: int = 0x82F63B78
+""" The (reversed) CRC32C polynomial. """
+
+MASK_DELTA: int = 0xA282EAD8
+""" The constant added when masking CRCs (see masked_crc32c). """
+
+CHUNK_SIZE: int = 32
+""" The size of the chunks processed side by side. """
+
+MIN_VECTORIZED_SIZE: int = 2048
+""" The minimum data size for the vectorized processing to be faster than the byte-wise one. """
+
+
+def _create_table() -> List[int]:
+    """
+    Creates the lookup table for processing a byte.
+
+    :return:    The table.
+    """
+    table = []
+    for i in range(256):
+        crc = i
+        for _ in range(8):
+            crc = (crc >> 1) ^ POLYNOMIAL if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+TABLE: List[int] = _create_table()
+""" The lookup table for processing a byte. """
+
+NP_TABLE: np.ndarray = np.array(TABLE, dtype=np.uint32)
+""" The lookup table for processing a byte, as numpy array. """
+
+
+def _apply(matrix: List[int], value: int) -> int:
+    """
+    Applies a linear map (as the images of the 32 bits) to a CRC register.
+
+    :param matrix:  The linear map.
+    :param value:   The register value.
+    :return:        The mapped value.
+    """
+    result = 0
+    bit = 0
+    while value:
+        if value & 1:
+            result ^= matrix[bit]
+        value >>= 1
+        bit += 1
+    return result
+
+
+@lru_cache(maxsize=None)
+def _zeros_matrix(num_bytes: int) -> List[int]:
+    """
+    Determines the linear map of appending zero bytes to the data.
+
+    :param num_bytes:   The number of zero bytes (at least 1).
+    :return:            The linear map (as the images of the 32 bits).
+    """
+    if num_bytes == 1:
+        return [TABLE[(1 << bit) & 0xFF] ^ ((1 << bit) >> 8) for bit in range(32)]
+
+    # Square and multiply
+    half = _zeros_matrix(num_bytes // 2)
+    result = [_apply(half, column) for column in half]
+    if num_bytes % 2 == 1:
+        one = _zeros_matrix(1)
+        result = [_apply(one, column) for column in result]
+    return result
+
+
+@lru_cache(maxsize=None)
+def _zeros_tables(num_bytes: int) -> np.ndarray:
+    """
+    Creates the lookup tables for appending zero bytes to the data, one per byte of the register.
+
+    :param num_bytes:   The number of zero bytes.
+    :return:            The tables (4x256).
+    """
+    matrix = _zeros_matrix(num_bytes)
+    values = np.arange(256, dtype=np.uint32)
+    tables = np.zeros((4, 256), dtype=np.uint32)
+    for byte in range(4):
+        for bit in range(8):
+            tables[byte] ^= np.where(values & (1 << bit), np.uint32(matrix[byte * 8 + bit]), np.uint32(0))
+    return tables
+
+
+def _update_bytewise(crc: int, data: bytes) -> int:
+    """
+    Processes the data byte by byte.
+
+    :param crc:     The CRC register.
+    :param data:    The data.
+    :return:        The updated register.
+    """
+    table = TABLE
+    for byte in data:
+        crc = table[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc
+
+
+def _update_vectorized(crc: int, data: bytes) -> int:
+    """
+    Processes the data in chunks side by side.
+
+    :param crc:     The CRC register.
+    :param data:    The data (at least 4 bytes).
+    :return:        The updated register.
+    """
+    # Pad the data at the front to a power of 2 number of chunks, as leading zero bytes
+    # don't change a zero register. Starting from a non-zero register is the same as
+    # starting from zero with the register XORed into the first 4 bytes.
+    num_chunks = 1 << ((len(data) - 1) // CHUNK_SIZE).bit_length()
+    start = num_chunks * CHUNK_SIZE - len(data)
+    padded = np.zeros(num_chunks * CHUNK_SIZE, dtype=np.uint8)
+    padded[start:] = np.frombuffer(data, dtype=np.uint8)
+    padded[start:start + 4] ^= np.frombuffer(crc.to_bytes(4, "little"), dtype=np.uint8)
+
+    # The CRCs of the chunks, processed side by side (one row per byte position)
+    columns = padded.reshape(num_chunks, CHUNK_SIZE).T.copy()
+    registers = np.zeros(num_chunks, dtype=np.uint32)
+    index = np.empty(num_chunks, dtype=np.uint32)
+    looked_up = np.empty(num_chunks, dtype=np.uint32)
+    for column in columns:
+        np.bitwise_and(registers, 0xFF, out=index)
+        index ^= column
+        np.take(NP_TABLE, index, out=looked_up)
+        registers >>= 8
+        registers ^= looked_up
+
+    # Combine neighbouring chunks: crc(a + b) = zeros_len(b)(crc(a)) ^ crc(b)
+    chunk_size = CHUNK_SIZE
+    while len(registers) > 1:
+        tables = _zeros_tables(chunk_size)
+        first = registers[0::2]
+        registers = (tables[0][first & 0xFF] ^ tables[1][(first >> 8) & 0xFF]
+                     ^ tables[2][(first >> 16) & 0xFF] ^ tables[3][first >> 24]) ^ registers[1::2]
+        chunk_size *= 2
+
+    return int(registers[0])
+
+
+def crc32c(data: bytes) -> int:
+    """
+    Calculates the CRC32C checksum of the data.
+
+    :param data:    The data.
+    :return:        The checksum.
+    """
+    if len(data) < MIN_VECTORIZED_SIZE:
+        crc = _update_bytewise(0xFFFFFFFF, data)
+    else:
+        crc = _update_vectorized(0xFFFFFFFF, data)
+    return crc ^ 0xFFFFFFFF
+
+
+def masked_crc32c(data: bytes) -> int:
+    """
+    Calculates the masked CRC32C checksum of the data, as stored in TFRecord files.
+
+    :param data:    The data.
+    :return:        The masked checksum.
+    """
+    crc = crc32c(data)
+    return ((((crc >> 15) | (crc << 17)) & 0xFFFFFFFF) + MASK_DELTA) & 0xFFFFFFFF
@@ -0,0 +1,117 @@
+import hashlib
+import os
+from typing import Dict, Optional
+
+from wai.common.adams.imaging.locateobjects import LocatedObjects
+
+from ._DetectionExample import DetectionExample
+from ._logging import logger
+from ._ImageFormat import ImageFormat
+from ._probe_image_size import probe_image_size
+from ._profiling import profiler, STAGE_IMAGE_READ, STAGE_DIMENSION_PROBE, STAGE_IMAGE_RESIZE
+from ._resize_image import resize_image
+from .constants import SUFFIX_TYPE
+
+
+def create_detection_example(imgpath: str,
+                             imgtype: ImageFormat,
+                             objects: LocatedObjects,
+                             labels: Dict[str, int],
+                             verbose: bool,
+                             max_dim: int = -1,
+                             jpeg_quality: int = -1) -> Optional[DetectionExample]:
+    """
+    Creates the content of a tf.Example proto from image.
+
+    Based on:
+    https://github.com/tensorflow/models/blob/master/research/object_detection/g3doc/using_your_own_dataset.md
+    https://github.com/tensorflow/models/blob/master/research/object_detection/dataset_tools/create_kitti_tf_record.py
+
+    :param imgpath:     The path to the image.
+    :param imgtype:     The image type (jpg/png).
+    :param objects:     The associated objects.
+    :param labels:      Lookup for the numeric label indices via their label.
+    :param verbose:     Whether to be verbose when creating the example.
+    :param max_dim:     The maximum width/height of the stored image, larger images
+                        get downscaled, <= 0 for no limit.
+    :param jpeg_quality: The JPEG quality to re-encode the stored image with, <= 0
+                        to store the image as-is (unless downscaled).
+    :return:            The generated example, None if the image has no usable annotations.
+                        Its sha256 is the hash of the source image (before any resizing/re-encoding).
+    """
+    # Read the encoded image, which gets stored as-is unless resizing/re-encoding
+    with profiler.time(STAGE_IMAGE_READ):
+        with open(imgpath, 'rb') as fid:
+            encoded_img = fid.read()
+
+    # Identify the source image by its content
+    key = hashlib.sha256(encoded_img).hexdigest()
+
+    # Determine the dimensions from the image headers (without decoding it)
+    with profiler.time(STAGE_DIMENSION_PROBE):
+        width, height = probe_image_size(encoded_img)
+    filename = (os.path.basename(imgpath)).encode('utf-8')
+
+    # Format and extract the relevant annotation parameters
+    xmins = []
+    xmaxs = []
+    ymins = []
+    ymaxs = []
+    classes_text = []
+    classes = []
+    for o in objects:
+        if SUFFIX_TYPE not in o.metadata:
+            continue
+
+        if o.metadata[SUFFIX_TYPE] not in labels:
+            continue
+
+        if (o.x < 0) or (o.y < 0) or (o.width < 0) or (o.height < 0):
+            continue
+
+        x0 = o.x / width
+        x1 = (o.x + o.width - 1) / width
+        y0 = o.y / height
+        y1 = (o.y + o.height - 1) / height
+        if ((x0 >= 0) and (x0 <= 1.0) and (x1 >= 0) and (x1 <= 1.0) and (x0 < x1)) \
+                and ((y0 >= 0) and (y0 <= 1.0) and (y1 >= 0) and (y1 <= 1.0) and (y0 < y1)):
+            xmins.append(x0)
+            xmaxs.append(x1)
+            ymins.append(y0)
+            ymaxs.append(y1)
+            classes_text.append(o.metadata[SUFFIX_TYPE].encode('utf8'))
+            classes.append(labels[o.metadata[SUFFIX_TYPE]])
+
+    # Skip this image if not annotations are found
+    if len(xmins) == 0:
+        logger.warning(f"No annotations in '{imgpath}', skipping!")
+        return None
+
+    # Downscale/re-encode the image (the box coordinates are normalised, so remain valid)
+    with profiler.time(STAGE_IMAGE_RESIZE):
+        encoded_img, imgtype, width, height = resize_image(encoded_img, imgtype, width, height,
+                                                           max_dim, jpeg_quality)
+
+    # Logging
+    if verbose:
+        logger.info(imgpath)
+        logger.info("xmins: %s", xmins)
+        logger.info("xmaxs: %s", xmaxs)
+        logger.info("ymins: %s", ymins)
+        logger.info("ymaxs: %s", ymaxs)
+        logger.info("classes_text: %s", classes_text)
+        logger.info("classes: %s", classes)
+
+    return DetectionExample(height=height,
+                            width=width,
+                            filename=filename,
+                            source_id=filename,
+                            sha256=key,
+                            encoded=encoded_img,
+                            format=imgtype.name.lower().encode("utf-8"),
+                            xmins=xmins,
+                            xmaxs=xmaxs,
+                            ymins=ymins,
+                            ymaxs=ymaxs,
+                            classes_text=classes_text,
+                            classes=classes)
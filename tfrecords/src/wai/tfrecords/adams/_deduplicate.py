@@ -0,0 +1,104 @@
+import csv
+from typing import Dict, List, Optional, Tuple
+
+from ._ImageIndex import ImageLookup
+from ._logging import logger
+from ._Manifest import fingerprint_file
+from ._ParsedReport import ParsedReport
+
+DEDUPLICATION_NONE: str = "none"
+""" Every report is converted, even if its image is identical to that of another report. """
+
+DEDUPLICATION_SKIP: str = "skip"
+""" Reports whose image is identical to that of an earlier report are skipped. """
+
+DEDUPLICATION_MERGE: str = "merge"
+""" The annotations of reports with identical images are merged into a single record. """
+
+DEDUPLICATIONS: List[str] = [DEDUPLICATION_NONE, DEDUPLICATION_SKIP, DEDUPLICATION_MERGE]
+""" The available deduplication modes. """
+
+
+class DuplicateLog:
+    """
+    Keeps track of the images encountered (by the SHA256 hash of their
+    content), recording the reports whose image duplicates that of an
+    earlier report.
+    """
+    def __init__(self, mode: str = DEDUPLICATION_SKIP):
+        """
+        :param mode:    The deduplication mode (skip/merge), recorded in the log.
+        """
+        if mode not in DEDUPLICATIONS:
+            raise ValueError(f"Unknown deduplication mode '{mode}', available: {DEDUPLICATIONS}")
+
+        self.mode: str = mode
+        # The report that was kept for each image hash
+        self.kept: Dict[str, str] = {}
+        # The (hash, kept report, duplicate report) triples
+        self.duplicates: List[Tuple[str, str, str]] = []
+
+    def check(self, sha256: str, report_file: str) -> Optional[str]:
+        """
+        Checks whether the image with the given hash has been encountered
+        before, recording the report as a duplicate if so.
+
+        :param sha256:          The hash of the image.
+        :param report_file:     The report the image belongs to.
+        :return:                The report that was kept for the image if the
+                                report is a duplicate, None if it isn't.
+        """
+        kept = self.kept.setdefault(sha256, report_file)
+        if kept == report_file:
+            return None
+
+        self.duplicates.append((sha256, kept, report_file))
+        return kept
+
+    def write(self, filename: str):
+        """
+        Writes the recorded duplicates to the given file, in CSV format.
+
+        :param filename:    The file to write to.
+        """
+        with open(filename, "w", newline="") as file:
+            writer = csv.writer(file)
+            writer.writerow(["sha256", "kept_report", "duplicate_report", "action"])
+            for sha256, kept, duplicate in self.duplicates:
+                writer.writerow([sha256, kept, duplicate, self.mode])
+
+    def __len__(self) -> int:
+        return len(self.duplicates)
+
+
+def parse_and_hash_report(report_file: str,
+                          image: Optional[ImageLookup],
+                          mappings: Optional[Dict[str, str]]) -> Tuple[ParsedReport, Optional[str]]:
+    """
+    Parses a report and hashes the content of its associated image (in a
+    worker process).
+
+    :param report_file:     The report file to parse.
+    :param image:           The associated image if already looked up.
+    :param mappings:        The label mappings to apply.
+    :return:                The parsed report, and the SHA256 hash of the image (None if not found).
+    """
+    report = ParsedReport.from_report_file(report_file, image, mappings)
+
+    if report.image_file is None:
+        return report, None
+
+    return report, fingerprint_file(report.image_file)["sha256"]
+
+
+def log_duplicates(duplicate_log: DuplicateLog, dedup_report: Optional[str]):
+    """
+    Logs the number of duplicates found, and writes them to the given file.
+
+    :param duplicate_log:   The duplicates found.
+    :param dedup_report:    The (optional) CSV file to write the duplicates to.
+    """
+    logger.info(f"# duplicate images ({duplicate_log.mode}): {len(duplicate_log)}")
+
+    if dedup_report is not None:
+        duplicate_log.write(dedup_report)
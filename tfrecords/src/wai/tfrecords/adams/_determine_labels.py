@@ -1,5 +1,5 @@
 import re
-from typing import Optional, Dict, Pattern, Set, List
+from typing import Optional, Dict, Pattern, Set, List, Iterable
 
 from wai.common.adams.imaging.locateobjects import LocatedObjects
 from wai.common.file.report import loadf, Report
@@ -20,9 +20,6 @@ def determine_labels(input_files: List[str],
     :param regexp:          The regular expression to use for limiting the labels stored.
     :return:                The list of labels.
     """
-    # Compile the regex if given
-    regexpc: Pattern = re.compile(regexp) if regexp is not None else None
-
     labels: Set[str] = set()
     for report_file in input_files:
         # Load the report
@@ -36,16 +33,29 @@ def determine_labels(input_files: List[str],
             fix_labels(objects, mappings)
 
         # Get the label from each object
-        for obj in objects:
-            # Get the label
-            label: str = obj.metadata[SUFFIX_TYPE] if SUFFIX_TYPE in obj.metadata else DEFAULT_LABEL
+        labels.update(obj.metadata[SUFFIX_TYPE] if SUFFIX_TYPE in obj.metadata else DEFAULT_LABEL
+                      for obj in objects)
+
+    return select_labels(labels, regexp)
+
+
+def select_labels(labels: Iterable[str],
+                  regexp: Optional[str] = None) -> List[str]:
+    """
+    Selects the labels matching the regular expression, and returns them
+    as a sorted list.
+
+    :param labels:          The labels found in the reports.
+    :param regexp:          The regular expression to use for limiting the labels stored.
+    :return:                The sorted list of labels.
+    """
+    # Compile the regex if given
+    regexpc: Pattern = re.compile(regexp) if regexp is not None else None
 
-            # Add the label to the set (if allowed)
-            if regexpc is None or regexpc.match(label):
-                labels.add(label)
+    # Add the labels to the set (if allowed)
+    result = list({label for label in labels if regexpc is None or regexpc.match(label)})
 
     # create sorted list
-    result = list(labels)
     result.sort()
 
     return result
@@ -1,25 +1,38 @@
 import os
-from typing import List
+from typing import List, Optional, Iterator
 
 from wai.common.file.report.constants import EXTENSION as REPORT_EXT
 
+from ._ImageIndex import ImageIndex
 
-def get_files_from_directory(directory: str) -> List[str]:
+
+def get_files_from_directory(directory: str, image_index: Optional[ImageIndex] = None) -> Iterator[str]:
     """
     Recursively gets the report files from all sub-directories of the
-    given directory (including itself).
+    given directory (including itself). The files are produced as the
+    directories are listed, so processing can start before the whole
+    tree has been searched. Each directory is listed only once, and the
+    listing can also be used to index the images.
 
-    :param directory:   The top-level directory to search.
-    :return:            The list of filenames.
+    :param directory:       The top-level directory to search.
+    :param image_index:     The (optional) index to add the images found to.
+    :return:                An iterator over the filenames.
     """
-    # Create the result list
-    report_files: List[str] = []
+    # Process each subdirectory (depth-first, top-down)
+    directories: List[str] = [directory]
+    while len(directories) > 0:
+        current: str = directories.pop()
+        with os.scandir(current) as iterator:
+            entries: List[os.DirEntry] = list(iterator)
+
+        # Index the images in this subdirectory (before its reports get looked up)
+        if image_index is not None:
+            image_index.add_directory(current, entries)
 
-    # Process each subdirectory
-    for subdir, dirs, files in os.walk(directory):
-        # Add any report files in this subdirectory
-        report_files += (os.path.join(directory, subdir, file)
-                         for file in files
-                         if file.endswith(REPORT_EXT))
+        # Produce any report files in this subdirectory
+        yield from (entry.path
+                    for entry in entries
+                    if entry.name.endswith(REPORT_EXT) and entry.is_file())
 
-    return report_files
+        # Descend into subdirectories, in listing order
+        directories += reversed([entry.path for entry in entries if entry.is_dir(follow_symlinks=False)])
@@ -1,11 +1,17 @@
 import argparse
 import os
+import sys
 import traceback
-from typing import Dict, Optional, List
+from typing import Dict, Optional, List, Iterator
 
-from wai.tfrecords.adams import logger, convert
+from wai.tfrecords.adams import logger, convert, ConvertOptions, SHARDING_ROUND_ROBIN, SHARDING_STRATEGIES
+from wai.tfrecords.adams._deduplicate import DEDUPLICATION_NONE, DEDUPLICATIONS
+from wai.tfrecords.adams._ShardWriter import COMPRESSION_NONE, COMPRESSIONS
 from wai.tfrecords.adams.constants import PREFIX_OBJECT, SUFFIX_TYPE, DEFAULT_LABEL
 
+STDIN_INPUT: str = "-"
+""" The input that denotes reading the report file names from stdin. """
+
 
 def main(args: Optional[List[str]] = None):
     """
@@ -18,19 +24,18 @@ def main(args: Optional[List[str]] = None):
     parsed = setup_parser().parse_args(args=args)
 
     # Check the input and output are valid
-    if not os.path.exists(parsed.input):
+    if parsed.input != STDIN_INPUT and not os.path.exists(parsed.input):
         raise IOError("Input does not exist:", parsed.input)
     if os.path.isdir(parsed.output):
         raise IOError("Output is a directory:", parsed.output)
 
-    # Interpret input (dir or file with report file names?)
-    if os.path.isdir(parsed.input):
+    # Interpret input (dir or file/stdin with report file names?)
+    if parsed.input != STDIN_INPUT and os.path.isdir(parsed.input):
         input_dir = parsed.input
         input_files = None
     else:
         input_dir = None
-        with open(parsed.input) as fp:
-            input_files = [line.strip() for line in fp]
+        input_files = read_input_files(parsed.input)
 
     # Generate label mappings
     mappings: Optional[Dict[str, str]] = None
@@ -49,21 +54,59 @@ def main(args: Optional[List[str]] = None):
     # Logging
     if parsed.verbose:
         logger.info("sharding off" if parsed.shards <= 1 else "# shards: " + str(parsed.shards))
+        logger.info("single process" if parsed.workers <= 1 else "# workers: " + str(parsed.workers))
 
-    # Convert using the specified arguments
+    # The options of the conversion
+    options = ConvertOptions(
+        mappings=mappings,
+        regexp=parsed.regexp,
+        labels=labels,
+        protobuf_label_map=parsed.protobuf_label_map,
+        shards=parsed.shards,
+        verbose=parsed.verbose,
+        workers=parsed.workers,
+        single_pass=parsed.single_pass,
+        max_cached_reports=parsed.max_cached_reports,
+        manifest=parsed.manifest,
+        records_per_shard=parsed.records_per_shard,
+        sharding=parsed.sharding,
+        shard_size_mb=parsed.shard_size_mb,
+        profile=parsed.profile,
+        max_dim=parsed.max_dim,
+        jpeg_quality=parsed.jpeg_quality,
+        compression=parsed.compression,
+        deduplication=parsed.deduplication,
+        dedup_report=parsed.dedup_report,
+        index=parsed.index,
+        tf_writer=parsed.tf_writer
+    )
+
+    # Convert using the specified options
     convert(
         input_dir=input_dir,
         input_files=input_files,
         output_file=parsed.output,
-        regexp=parsed.regexp,
-        shards=parsed.shards,
-        mappings=mappings,
-        labels=labels,
-        protobuf_label_map=parsed.protobuf_label_map,
-        verbose=parsed.verbose
+        options=options
     )
 
 
+def read_input_files(filename: str) -> Iterator[str]:
+    """
+    Reads the report file names, one per line, from the given text file (or
+    from stdin). Lines are read as they are needed, so the conversion can
+    start before the whole list is available.
+
+    :param filename:    The text file, or "-" for stdin.
+    :return:            An iterator over the (non-empty) file names.
+    """
+    if filename == STDIN_INPUT:
+        yield from (line.strip() for line in sys.stdin if len(line.strip()) > 0)
+        return
+
+    with open(filename) as fp:
+        yield from (line.strip() for line in fp if len(line.strip()) > 0)
+
+
 def sys_main() -> int:
     """
     Runs the main function using the system cli arguments, and
@@ -93,7 +136,8 @@ def setup_parser() -> argparse.ArgumentParser:
                     + 'be used instead.')
     parser.add_argument(
         "-i", "--input", metavar="dir_or_file", dest="input", required=True,
-        help="input directory with report files or text file with one absolute report file name per line")
+        help="input directory with report files or text file with one absolute report file name per line "
+             + "('" + STDIN_INPUT + "' for reading the file names from stdin)")
     parser.add_argument(
         "-o", "--output", metavar="file", dest="output", required=True,
         help="name of output file for TFRecords")
@@ -113,6 +157,68 @@ def setup_parser() -> argparse.ArgumentParser:
     parser.add_argument(
         "-s", "--shards", metavar="num", dest="shards", required=False, type=int,
         help="number of shards to split the images into (<= 1 for off)", default=-1)
+    parser.add_argument(
+        "-w", "--workers", metavar="num", dest="workers", required=False, type=int,
+        help="number of processes to use for parsing the reports and building the records (<= 1 for off)",
+        default=1)
+    parser.add_argument(
+        "--sharding", metavar="strategy", dest="sharding", required=False, choices=SHARDING_STRATEGIES,
+        help="how to assign the records to the shards: " + SHARDING_ROUND_ROBIN + " (in turn) or balanced "
+             + "(to the shard with the fewest bytes so far)", default=SHARDING_ROUND_ROBIN)
+    parser.add_argument(
+        "--shard_size_mb", metavar="mb", dest="shard_size_mb", required=False, type=float,
+        help="target size of the shards in MB, determines the number of shards automatically (using balanced "
+             + "sharding) instead of -s/--shards; also limits the shard size when using a manifest (<= 0 for off)",
+        default=-1)
+    parser.add_argument(
+        "--single_pass", action="store_true", dest="single_pass", required=False,
+        help="whether to parse each report only once when determining the labels (ie no -l/--labels given), "
+             + "caching the parsed reports for the conversion")
+    parser.add_argument(
+        "--max_cached_reports", metavar="num", dest="max_cached_reports", required=False, type=int,
+        help="the maximum number of parsed reports to keep in memory in single-pass mode, before spilling them "
+             + "to a temporary file (< 0 for unlimited)", default=-1)
+    parser.add_argument(
+        "--manifest", action="store_true", dest="manifest", required=False,
+        help="whether to keep track of the converted report/image pairs in a manifest next to the output file; "
+             + "if the manifest already exists, only new/changed pairs get converted (into new shards) and the "
+             + "records of changed/removed pairs are marked as stale; crashed runs resume from the last "
+             + "committed shard")
+    parser.add_argument(
+        "--records_per_shard", metavar="num", dest="records_per_shard", required=False, type=int,
+        help="the maximum number of records per shard when using a manifest", default=1000)
+    parser.add_argument(
+        "--compression", metavar="type", dest="compression", required=False, choices=COMPRESSIONS,
+        help="the compression of the TFRecords: " + "/".join(COMPRESSIONS) + " (gets recorded in the manifest "
+             + "and the protobuf label map)", default=COMPRESSION_NONE)
+    parser.add_argument(
+        "--max_dim", metavar="px", dest="max_dim", required=False, type=int,
+        help="the maximum width/height of the stored images, larger images get downscaled (keeping the aspect "
+             + "ratio) and re-encoded (<= 0 for no limit)", default=-1)
+    parser.add_argument(
+        "--jpeg_quality", metavar="quality", dest="jpeg_quality", required=False, type=int,
+        help="the JPEG quality (1-95) to re-encode all stored images with, converting PNGs to JPEGs "
+             + "(<= 0 to store the images as-is, unless downscaled)", default=-1)
+    parser.add_argument(
+        "--deduplication", metavar="mode", dest="deduplication", required=False, choices=DEDUPLICATIONS,
+        help="how to treat reports whose image is byte-identical to that of an earlier report: none (convert "
+             + "anyway), skip (only convert the first report) or merge (merge the annotations of all the reports "
+             + "into a single record)", default=DEDUPLICATION_NONE)
+    parser.add_argument(
+        "--dedup_report", metavar="file", dest="dedup_report", required=False,
+        help="the CSV file to list the deduplicated reports in", default=None)
+    parser.add_argument(
+        "--index", action="store_true", dest="index", required=False,
+        help="whether to write an index (offset, length, source ID and labels of each record) next to each output "
+             + "file, for random access to the records via wai.tfrecords.reader")
+    parser.add_argument(
+        "--tf_writer", action="store_true", dest="tf_writer", required=False,
+        help="whether to write the records with Tensorflow's TFRecordWriter, rather than the built-in writer "
+             + "(which doesn't require importing Tensorflow)")
+    parser.add_argument(
+        "--profile", metavar="file", dest="profile", required=False,
+        help="JSON file to write the time spent in each stage of the conversion to (the timings also get "
+             + "logged)", default=None)
     parser.add_argument(
         "-v", "--verbose", action="store_true", dest="verbose", required=False,
         help="whether to be more verbose when generating the records")
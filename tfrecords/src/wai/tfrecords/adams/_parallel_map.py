@@ -0,0 +1,89 @@
+from collections import deque
+from itertools import starmap, islice
+from multiprocessing import Pool
+from typing import Callable, Iterable, Iterator, TypeVar, List, Deque, Tuple, Dict
+
+from ._profiling import profiler
+
+ItemType = TypeVar("ItemType")
+ResultType = TypeVar("ResultType")
+
+WORKER_CHUNK_SIZE: int = 16
+""" The number of items handed to a worker process at a time. """
+
+MAX_PENDING_CHUNKS_PER_WORKER: int = 4
+""" The maximum number of chunks queued up per worker process, bounding memory use on long inputs. """
+
+
+def parallel_map(function: Callable[[ItemType], ResultType],
+                 items: Iterable[ItemType],
+                 workers: int = 1,
+                 star: bool = False) -> Iterator[ResultType]:
+    """
+    Applies the function to each of the items, either in the calling process
+    or in a pool of worker processes. Results are always produced in the same
+    order as the items. The items are consumed lazily, only a limited number
+    of them being in flight at any time, so the items can be streamed from
+    a generator.
+
+    :param function:    The function to apply. Must be picklable if workers > 1.
+    :param items:       The items to apply the function to.
+    :param workers:     The number of worker processes, <= 1 for in-process.
+    :param star:        Whether the items are tuples of arguments to unpack
+                        when calling the function.
+    :return:            An iterator over the results.
+    """
+    # In-process
+    if workers <= 1:
+        yield from (starmap if star else map)(function, items)
+        return
+
+    items = iter(items)
+    max_pending = workers * MAX_PENDING_CHUNKS_PER_WORKER
+
+    # Pool of processes (closed once all results have been consumed)
+    with Pool(workers, initializer=init_worker, initargs=(profiler.enabled,)) as pool:
+        pending: Deque = deque()
+        while True:
+            # Keep the workers busy
+            while len(pending) < max_pending:
+                chunk = list(islice(items, WORKER_CHUNK_SIZE))
+                if len(chunk) == 0:
+                    break
+                pending.append(pool.apply_async(apply_chunk, (function, chunk, star)))
+
+            # Finished
+            if len(pending) == 0:
+                return
+
+            # Produce the results of the oldest chunk
+            results, stages = pending.popleft().get()
+            profiler.merge(stages)
+            yield from results
+
+
+def init_worker(profile: bool):
+    """
+    Initialises a worker process.
+
+    :param profile:     Whether the main process is profiling.
+    """
+    # Discard any statistics inherited from the main process
+    profiler.enabled = profile
+    profiler.drain()
+
+
+def apply_chunk(function: Callable[..., ResultType],
+                chunk: List,
+                star: bool) -> Tuple[List[ResultType], Dict[str, List[float]]]:
+    """
+    Applies the function to a chunk of items (in a worker process).
+
+    :param function:    The function to apply.
+    :param chunk:       The items.
+    :param star:        Whether the items are tuples of arguments to unpack.
+    :return:            The results, and the profiling statistics gathered while
+                        producing them.
+    """
+    results = list((starmap if star else map)(function, chunk))
+    return results, profiler.drain()
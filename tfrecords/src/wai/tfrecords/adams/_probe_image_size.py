@@ -0,0 +1,96 @@
+import io
+import struct
+from typing import Optional, Tuple
+
+from PIL import Image as pil
+
+PNG_SIGNATURE: bytes = b"\x89PNG\r\n\x1a\n"
+""" The signature at the start of every PNG file. """
+
+JPEG_SOI: bytes = b"\xff\xd8"
+""" The start-of-image marker at the start of every JPEG file. """
+
+JPEG_SOF_MARKERS: frozenset = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+""" The JPEG start-of-frame markers (which hold the image dimensions). """
+
+JPEG_STANDALONE_MARKERS: frozenset = frozenset(range(0xD0, 0xD8)) | {0x01}
+""" The JPEG markers that have no length/payload. """
+
+
+def probe_image_size(encoded_img: bytes) -> Tuple[int, int]:
+    """
+    Determines the dimensions of an encoded image by parsing only its
+    headers (the SOF segment of a JPEG or the IHDR chunk of a PNG), without
+    decoding any pixel data. Falls back to PIL's lazy header parsing for
+    other formats or unexpected header layouts.
+
+    :param encoded_img:     The encoded image.
+    :return:                The width and height of the image.
+    """
+    # Try the header parsers first
+    if encoded_img.startswith(PNG_SIGNATURE):
+        size = _probe_png_size(encoded_img)
+    elif encoded_img.startswith(JPEG_SOI):
+        size = _probe_jpeg_size(encoded_img)
+    else:
+        size = None
+
+    # Let PIL read the header (opening is lazy, so no pixel data is decoded)
+    if size is None:
+        with pil.open(io.BytesIO(encoded_img)) as image:
+            size = image.size
+
+    return size
+
+
+def _probe_png_size(encoded_img: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Reads the dimensions of a PNG image from its IHDR chunk, which
+    must immediately follow the signature.
+
+    :param encoded_img:     The encoded PNG image.
+    :return:                The width and height, or None if the header is malformed.
+    """
+    if len(encoded_img) < 24 or encoded_img[12:16] != b"IHDR":
+        return None
+
+    return struct.unpack(">II", encoded_img[16:24])
+
+
+def _probe_jpeg_size(encoded_img: bytes) -> Optional[Tuple[int, int]]:
+    """
+    Reads the dimensions of a JPEG image from its start-of-frame segment,
+    skipping over any preceding segments (APPn, DQT, DHT, etc.).
+
+    :param encoded_img:     The encoded JPEG image.
+    :return:                The width and height, or None if no frame header was found.
+    """
+    offset = len(JPEG_SOI)
+    length = len(encoded_img)
+    while offset + 4 <= length:
+        # Every segment starts with a marker
+        if encoded_img[offset] != 0xFF:
+            return None
+        marker = encoded_img[offset + 1]
+
+        # Skip fill bytes and standalone markers
+        if marker == 0xFF or marker in JPEG_STANDALONE_MARKERS:
+            offset += 1 if marker == 0xFF else 2
+            continue
+
+        # Start of scan without a frame header, or end of image
+        if marker in (0xDA, 0xD9):
+            return None
+
+        segment_length = struct.unpack(">H", encoded_img[offset + 2:offset + 4])[0]
+
+        # Frame header: length (2), precision (1), height (2), width (2)
+        if marker in JPEG_SOF_MARKERS:
+            if offset + 9 > length:
+                return None
+            height, width = struct.unpack(">HH", encoded_img[offset + 5:offset + 9])
+            return (width, height) if width > 0 and height > 0 else None
+
+        offset += 2 + segment_length
+
+    return None
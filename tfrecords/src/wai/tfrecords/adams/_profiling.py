@@ -0,0 +1,181 @@
+"""
+Sets up the profiler for this package, which records the time spent in
+each stage of the conversion when enabled.
+"""
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, List, Iterable, Iterator, TypeVar
+
+ItemType = TypeVar("ItemType")
+
+# The stages of the conversion, in pipeline order
+STAGE_DISCOVERY: str = "discovery"
+STAGE_IMAGE_LOOKUP: str = "image lookup"
+STAGE_REPORT_PARSING: str = "report parsing"
+STAGE_IMAGE_READ: str = "image read"
+STAGE_DIMENSION_PROBE: str = "dimension probe"
+STAGE_IMAGE_RESIZE: str = "image resize"
+STAGE_EXAMPLE_CREATION: str = "example creation"
+STAGE_SERIALIZATION: str = "example serialization"
+# Handing the record to a writer thread (includes waiting for its queue to have room)
+STAGE_WRITE_QUEUE: str = "write queue"
+# Writing (and compressing/indexing) the record, on the writer thread
+STAGE_WRITE: str = "write"
+STAGES: List[str] = [STAGE_DISCOVERY, STAGE_IMAGE_LOOKUP, STAGE_REPORT_PARSING, STAGE_IMAGE_READ,
+                     STAGE_DIMENSION_PROBE, STAGE_IMAGE_RESIZE, STAGE_EXAMPLE_CREATION, STAGE_SERIALIZATION,
+                     STAGE_WRITE_QUEUE, STAGE_WRITE]
+
+
+class Profiler:
+    """
+    Accumulates the number of items processed and the time taken by each
+    stage. Each process has its own profiler; the statistics of worker
+    processes get drained and merged into the profiler of the main process.
+    Timings can be added from several threads (eg the writer threads).
+    """
+    def __init__(self):
+        self.enabled: bool = False
+        # count, total, min, max per stage
+        self._stages: Dict[str, List[float]] = {}
+        self._start: float = time.perf_counter()
+        self._lock: threading.Lock = threading.Lock()
+
+    def start(self):
+        """
+        Enables the profiler and resets all statistics.
+        """
+        self.enabled = True
+        self._stages = {}
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def time(self, stage: str):
+        """
+        Context manager for timing a single item in the given stage.
+
+        :param stage:   The stage.
+        """
+        if not self.enabled:
+            yield
+            return
+
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, time.perf_counter() - start)
+
+    def iterate(self, stage: str, items: Iterable[ItemType]) -> Iterator[ItemType]:
+        """
+        Wraps an iterable, timing the production of each item in the given stage.
+
+        :param stage:   The stage.
+        :param items:   The items.
+        :return:        An iterator over the items.
+        """
+        if not self.enabled:
+            yield from items
+            return
+
+        iterator = iter(items)
+        while True:
+            start = time.perf_counter()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.add(stage, time.perf_counter() - start)
+            yield item
+
+    def add(self, stage: str, seconds: float, count: int = 1):
+        """
+        Adds the timing of one or more items to the given stage.
+
+        :param stage:       The stage.
+        :param seconds:     The time taken.
+        :param count:       The number of items.
+        """
+        with self._lock:
+            stats = self._stages.get(stage, None)
+            if stats is None:
+                self._stages[stage] = [count, seconds, seconds / count, seconds / count]
+            else:
+                stats[0] += count
+                stats[1] += seconds
+                stats[2] = min(stats[2], seconds / count)
+                stats[3] = max(stats[3], seconds / count)
+
+    def drain(self) -> Dict[str, List[float]]:
+        """
+        Returns the statistics gathered so far and resets them (for sending
+        them from a worker process to the main process).
+
+        :return:    The statistics.
+        """
+        with self._lock:
+            stages, self._stages = self._stages, {}
+        return stages
+
+    def merge(self, stages: Dict[str, List[float]]):
+        """
+        Merges the (drained) statistics of another profiler into this one.
+
+        :param stages:  The statistics.
+        """
+        with self._lock:
+            for stage, (count, total, minimum, maximum) in stages.items():
+                stats = self._stages.get(stage, None)
+                if stats is None:
+                    self._stages[stage] = [count, total, minimum, maximum]
+                else:
+                    stats[0] += count
+                    stats[1] += total
+                    stats[2] = min(stats[2], minimum)
+                    stats[3] = max(stats[3], maximum)
+
+    def to_dict(self) -> Dict:
+        """
+        Gets the statistics as a dictionary (times in seconds).
+
+        :return:    The statistics.
+        """
+        order = {stage: index for index, stage in enumerate(STAGES)}
+        return {
+            "wall_time": time.perf_counter() - self._start,
+            "stages": {
+                stage: {"count": int(count), "total": total, "mean": total / count if count > 0 else 0.0,
+                        "min": minimum, "max": maximum}
+                for stage, (count, total, minimum, maximum)
+                in sorted(self._stages.items(), key=lambda item: order.get(item[0], len(order)))
+            }
+        }
+
+    def summary(self) -> str:
+        """
+        Formats the statistics as a table.
+
+        :return:    The table.
+        """
+        stats = self.to_dict()
+        lines = [f"{'stage':<22}{'count':>10}{'total (s)':>12}{'mean (ms)':>12}{'min (ms)':>12}{'max (ms)':>12}"]
+        for stage, stage_stats in stats["stages"].items():
+            lines.append(f"{stage:<22}{stage_stats['count']:>10}{stage_stats['total']:>12.3f}"
+                         f"{stage_stats['mean'] * 1000:>12.3f}{stage_stats['min'] * 1000:>12.3f}"
+                         f"{stage_stats['max'] * 1000:>12.3f}")
+        lines.append(f"wall time: {stats['wall_time']:.3f}s (stage totals are summed over all processes)")
+        return "\n".join(lines)
+
+    def write(self, filename: str):
+        """
+        Writes the statistics to the given file, in JSON format.
+
+        :param filename:    The file to write to.
+        """
+        with open(filename, "w") as file:
+            json.dump(self.to_dict(), file, indent=2)
+
+
+# Create the profiler
+profiler = Profiler()
@@ -0,0 +1,64 @@
+import io
+from typing import Tuple
+
+from PIL import Image as pil
+
+from ._ImageFormat import ImageFormat
+
+DEFAULT_JPEG_QUALITY: int = 95
+""" The quality for re-encoding downscaled JPEGs if no quality is specified. """
+
+
+def resize_image(encoded_img: bytes,
+                 imgtype: ImageFormat,
+                 width: int,
+                 height: int,
+                 max_dim: int = -1,
+                 jpeg_quality: int = -1) -> Tuple[bytes, ImageFormat, int, int]:
+    """
+    Downscales an encoded image so that its largest side is at most the given
+    number of pixels (keeping the aspect ratio), and/or re-encodes it as a JPEG
+    of the given quality. Images that need neither are returned as-is, so no
+    decoding takes place.
+
+    :param encoded_img:     The encoded image.
+    :param imgtype:         The format of the encoded image.
+    :param width:           The width of the image.
+    :param height:          The height of the image.
+    :param max_dim:         The maximum width/height, <= 0 for no limit.
+    :param jpeg_quality:    The JPEG quality (1-95) to re-encode all images with (converting
+                            PNGs to JPEGs), <= 0 to keep the format (re-encoding downscaled
+                            JPEGs with the default quality).
+    :return:                The encoded image, its format, width and height.
+    """
+    resize: bool = 0 < max_dim < max(width, height)
+
+    # Nothing to do
+    if not resize and jpeg_quality <= 0:
+        return encoded_img, imgtype, width, height
+
+    image: pil.Image = pil.open(io.BytesIO(encoded_img))
+
+    if resize:
+        scale = max_dim / max(width, height)
+        width, height = max(1, round(width * scale)), max(1, round(height * scale))
+
+        # Let the JPEG decoder skip most of the work by decoding at a reduced scale
+        if imgtype is ImageFormat.JPG:
+            image.draft("RGB", (width, height))
+
+        image = image.resize((width, height), pil.LANCZOS)
+
+    # Encode in the output format
+    if jpeg_quality > 0 or imgtype is ImageFormat.JPG:
+        if image.mode not in ("RGB", "L"):
+            image = image.convert("RGB")
+        imgtype = ImageFormat.JPG
+        save_options = {"quality": jpeg_quality if jpeg_quality > 0 else DEFAULT_JPEG_QUALITY}
+    else:
+        save_options = {}
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG" if imgtype is ImageFormat.JPG else "PNG", **save_options)
+
+    return buffer.getvalue(), imgtype, width, height
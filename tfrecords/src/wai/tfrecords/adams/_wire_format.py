@@ -0,0 +1,241 @@
+"""
+Functions for encoding tf.train.Example messages directly in the protobuf
+wire format, without building the message objects first. The map entries
+are written in key order, so the output is identical to that of
+SerializeToString(deterministic=True) on the equivalent message.
+
+Encoded features are passed around as lists of byte strings, so large values
+(eg the encoded image) are only copied once, when joining the final message.
+
+Also contains a minimal decoder for reading the bytes features of serialized
+examples, without parsing them into message objects.
+"""
+import struct
+from functools import lru_cache
+from typing import Collection, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+# The wire types used by tf.train.Example
+WIRE_TYPE_VARINT: int = 0
+WIRE_TYPE_FIXED64: int = 1
+WIRE_TYPE_LENGTH_DELIMITED: int = 2
+WIRE_TYPE_FIXED32: int = 5
+
+# The field numbers of the Feature oneof
+FIELD_BYTES_LIST: int = 1
+FIELD_FLOAT_LIST: int = 2
+FIELD_INT64_LIST: int = 3
+
+# An encoded message, as parts to join
+Parts = List[bytes]
+
+
+def encode_varint(value: int) -> bytes:
+    """
+    Encodes an integer as a varint (negative values as 64-bit two's complement).
+
+    :param value:   The value.
+    :return:        The encoded value.
+    """
+    if value < 0:
+        value += 1 << 64
+
+    # Fast path for small values
+    if value < 0x80:
+        return bytes((value,))
+
+    result = bytearray()
+    while value >= 0x80:
+        result.append((value & 0x7F) | 0x80)
+        value >>= 7
+    result.append(value)
+    return bytes(result)
+
+
+def encode_tag(field: int, wire_type: int) -> bytes:
+    """
+    Encodes the tag of a field.
+
+    :param field:       The field number.
+    :param wire_type:   The wire type.
+    :return:            The encoded tag.
+    """
+    return encode_varint((field << 3) | wire_type)
+
+
+# The (constant) tags used when encoding, as the per-call encoding dominates otherwise
+TAG_VALUE: bytes = encode_tag(1, WIRE_TYPE_LENGTH_DELIMITED)
+TAG_BYTES_LIST: bytes = encode_tag(FIELD_BYTES_LIST, WIRE_TYPE_LENGTH_DELIMITED)
+TAG_FLOAT_LIST: bytes = encode_tag(FIELD_FLOAT_LIST, WIRE_TYPE_LENGTH_DELIMITED)
+TAG_INT64_LIST: bytes = encode_tag(FIELD_INT64_LIST, WIRE_TYPE_LENGTH_DELIMITED)
+TAG_MAP_KEY: bytes = encode_tag(1, WIRE_TYPE_LENGTH_DELIMITED)
+TAG_MAP_VALUE: bytes = encode_tag(2, WIRE_TYPE_LENGTH_DELIMITED)
+
+
+def encode_bytes_feature(values: Iterable[bytes]) -> Parts:
+    """
+    Encodes a Feature holding a BytesList.
+
+    :param values:  The values.
+    :return:        The encoded feature.
+    """
+    bytes_list: Parts = [b""]
+    length = 0
+    for value in values:
+        header = TAG_VALUE + encode_varint(len(value))
+        bytes_list.append(header)
+        bytes_list.append(value)
+        length += len(header) + len(value)
+    bytes_list[0] = TAG_BYTES_LIST + encode_varint(length)
+    return bytes_list
+
+
+def encode_float_feature(values: Sequence[float]) -> Parts:
+    """
+    Encodes a Feature holding a (packed) FloatList.
+
+    :param values:  The values.
+    :return:        The encoded feature.
+    """
+    if len(values) == 0:
+        return [TAG_FLOAT_LIST + b"\x00"]
+
+    packed = struct.pack(f"<{len(values)}f", *values)
+    float_list = TAG_VALUE + encode_varint(len(packed)) + packed
+    return [TAG_FLOAT_LIST + encode_varint(len(float_list)) + float_list]
+
+
+def encode_int64_feature(values: Iterable[int]) -> Parts:
+    """
+    Encodes a Feature holding a (packed) Int64List.
+
+    :param values:  The values.
+    :return:        The encoded feature.
+    """
+    packed = b"".join(map(encode_varint, values))
+    if len(packed) == 0:
+        return [TAG_INT64_LIST + b"\x00"]
+
+    int64_list = TAG_VALUE + encode_varint(len(packed)) + packed
+    return [TAG_INT64_LIST + encode_varint(len(int64_list)) + int64_list]
+
+
+@lru_cache(maxsize=None)
+def encode_map_key(key: str) -> bytes:
+    """
+    Encodes the key field of a feature map entry. Cached, as the same
+    keys get used for every example.
+
+    :param key:     The feature name.
+    :return:        The encoded key field.
+    """
+    encoded = key.encode("utf-8")
+    return TAG_MAP_KEY + encode_varint(len(encoded)) + encoded
+
+
+def encode_example(features: Dict[str, Parts]) -> bytes:
+    """
+    Encodes a tf.train.Example from its (encoded) features.
+
+    :param features:    The encoded features, keyed by name.
+    :return:            The serialized example.
+    """
+    entries: Parts = [b""]
+    length = 0
+    for key in sorted(features):
+        feature = features[key]
+        feature_length = sum(map(len, feature))
+        entry = encode_map_key(key) + TAG_MAP_VALUE + encode_varint(feature_length)
+        entry = TAG_VALUE + encode_varint(len(entry) + feature_length) + entry
+        entries.append(entry)
+        entries += feature
+        length += len(entry) + feature_length
+
+    # Example.features
+    entries[0] = TAG_VALUE + encode_varint(length)
+    return b"".join(entries)
+
+
+def decode_varint(data: memoryview, position: int) -> Tuple[int, int]:
+    """
+    Decodes a varint.
+
+    :param data:        The encoded data.
+    :param position:    The position of the varint in the data.
+    :return:            The value and the position following the varint.
+    """
+    result = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        result |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return result, position
+        shift += 7
+
+
+def iterate_fields(data: memoryview) -> Iterator[Tuple[int, int, memoryview]]:
+    """
+    Iterates over the fields of an encoded message. Values of length-delimited
+    fields are views of the data (not copies).
+
+    :param data:    The encoded message.
+    :return:        An iterator over the field numbers, wire types and (encoded) values.
+    """
+    position = 0
+    while position < len(data):
+        tag, position = decode_varint(data, position)
+        wire_type = tag & 0x07
+        if wire_type == WIRE_TYPE_VARINT:
+            end = decode_varint(data, position)[1]
+        elif wire_type == WIRE_TYPE_FIXED64:
+            end = position + 8
+        elif wire_type == WIRE_TYPE_LENGTH_DELIMITED:
+            length, position = decode_varint(data, position)
+            end = position + length
+        elif wire_type == WIRE_TYPE_FIXED32:
+            end = position + 4
+        else:
+            raise ValueError(f"Unsupported wire type {wire_type}")
+        if end > len(data):
+            raise ValueError("Truncated message")
+        yield tag >> 3, wire_type, data[position:end]
+        position = end
+
+
+def decode_bytes_features(record: bytes, names: Collection[str]) -> Dict[str, List[bytes]]:
+    """
+    Decodes the given bytes features of a serialized tf.train.Example.
+    Other features are skipped without being decoded.
+
+    :param record:  The serialized example.
+    :param names:   The names of the features to decode.
+    :return:        The values of the features, keyed by name (missing features
+                    and features of other types have no values).
+    """
+    result: Dict[str, List[bytes]] = {name: [] for name in names}
+    for field, wire_type, features in iterate_fields(memoryview(record)):
+        # Example.features
+        if field != 1 or wire_type != WIRE_TYPE_LENGTH_DELIMITED:
+            continue
+        for entry_field, entry_wire_type, entry in iterate_fields(features):
+            # Features.feature map entries
+            if entry_field != 1 or entry_wire_type != WIRE_TYPE_LENGTH_DELIMITED:
+                continue
+            name = None
+            feature = None
+            for map_field, _, value in iterate_fields(entry):
+                if map_field == 1:
+                    name = bytes(value).decode("utf-8")
+                elif map_field == 2:
+                    feature = value
+            if name not in result or feature is None:
+                continue
+            # Later entries replace earlier ones, as for messages
+            values = []
+            for kind, _, bytes_list in iterate_fields(feature):
+                if kind == FIELD_BYTES_LIST:
+                    values = [bytes(value) for field_number, _, value in iterate_fields(bytes_list)
+                              if field_number == 1]
+            result[name] = values
+    return result
@@ -1,13 +1,18 @@
-from typing import Dict, List
+from typing import Dict, List, Optional
 
+COMPRESSION_TYPE_COMMENT: str = "# compression_type: {}\n"
+""" The comment recording the compression of the TFRecords in the label map (ignored by protobuf parsers). """
 
-def write_protobuf_label_map(label_map: Dict[str, int], filename: str):
+
+def write_protobuf_label_map(label_map: Dict[str, int], filename: str, compression_type: Optional[str] = None):
     """
     Writes the label-to-index mapping to the given file, in
     protobuf format.
 
-    :param label_map:   The mapping from labels to indices.
-    :param filename:    The file to write the mapping to.
+    :param label_map:           The mapping from labels to indices.
+    :param filename:            The file to write the mapping to.
+    :param compression_type:    The compression type of the TFRecords (GZIP/ZLIB), which gets
+                                recorded as a comment, None or empty if uncompressed.
     """
     # Format the label index map
     protobuf: List[str] = ["item {\n" +
@@ -16,6 +21,10 @@ def write_protobuf_label_map(label_map: Dict[str, int], filename: str):
                            "}\n"
                            for label, index in label_map.items()]
 
+    # Record the compression, so readers can open the TFRecords
+    if compression_type:
+        protobuf.insert(0, COMPRESSION_TYPE_COMMENT.format(compression_type))
+
     # Write the lines to the specified file
     with open(filename, 'w') as file:
         file.writelines(protobuf)
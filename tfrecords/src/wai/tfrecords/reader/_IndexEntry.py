@@ -0,0 +1,30 @@
+from typing import NamedTuple, Tuple
+
+RECORD_HEADER_SIZE: int = 12
+""" The number of bytes preceding the data of a TFRecord (length, length CRC). """
+
+RECORD_FOOTER_SIZE: int = 4
+""" The number of bytes following the data of a TFRecord (data CRC). """
+
+
+class IndexEntry(NamedTuple):
+    """
+    The location and content summary of a single record in a TFRecord shard.
+    """
+    # The number of the record in the shard
+    record: int
+    # The byte offset of the record in the (uncompressed) shard
+    offset: int
+    # The length of the record's data
+    length: int
+    # The image/source_id of the example
+    source_id: str
+    # The labels of the example's objects
+    labels: Tuple[str, ...]
+
+    @property
+    def end(self) -> int:
+        """
+        The byte offset just past the end of the record.
+        """
+        return self.offset + RECORD_HEADER_SIZE + self.length + RECORD_FOOTER_SIZE
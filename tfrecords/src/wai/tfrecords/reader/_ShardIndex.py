@@ -0,0 +1,124 @@
+import bisect
+import json
+from typing import Dict, List, Tuple, Optional
+
+from ._IndexEntry import IndexEntry
+
+INDEX_SUFFIX: str = ".index"
+""" The suffix appended to a shard's filename to obtain its index file. """
+
+INDEX_VERSION: int = 1
+""" The version of the index format. """
+
+
+class ShardIndex:
+    """
+    The index of a TFRecord shard, stored in a sidecar file next to it. The
+    file holds a JSON header line (format version and the compression type
+    of the shard), followed by one JSON line per record.
+    """
+    def __init__(self, shard_file: str, compression_type: str, entries: List[IndexEntry]):
+        """
+        :param shard_file:          The shard the index is for.
+        :param compression_type:    The compression type of the shard ("", GZIP or ZLIB).
+        :param entries:             The entries, in record order.
+        """
+        self.shard_file: str = shard_file
+        self.compression_type: str = compression_type
+        self.entries: List[IndexEntry] = entries
+        self._offsets: List[int] = [entry.offset for entry in entries]
+        self._by_source_id: Optional[Dict[str, List[IndexEntry]]] = None
+        self._by_label: Optional[Dict[str, List[IndexEntry]]] = None
+
+    @classmethod
+    def filename_for(cls, shard_file: str) -> str:
+        """
+        Gets the filename of the index for the given shard.
+
+        :param shard_file:  The shard.
+        :return:            The index filename.
+        """
+        return shard_file + INDEX_SUFFIX
+
+    @classmethod
+    def load(cls, shard_file: str) -> "ShardIndex":
+        """
+        Loads the index of the given shard.
+
+        :param shard_file:  The shard.
+        :return:            The index.
+        """
+        filename = cls.filename_for(shard_file)
+        with open(filename, "r") as file:
+            header = json.loads(file.readline())
+            if header.get("version", None) != INDEX_VERSION:
+                raise ValueError(f"Unsupported index version in {filename}: {header.get('version', None)}")
+
+            entries = [IndexEntry(record["record"], record["offset"], record["length"], record["source_id"],
+                                  tuple(record["labels"]))
+                       for record in map(json.loads, file)]
+
+        return cls(shard_file, header["compression_type"], entries)
+
+    @property
+    def size(self) -> int:
+        """
+        The size of the (uncompressed) shard in bytes.
+        """
+        return self.entries[-1].end if len(self.entries) > 0 else 0
+
+    def by_source_id(self, source_id: str) -> List[IndexEntry]:
+        """
+        Gets the entries of the records with the given source ID.
+
+        :param source_id:   The source ID.
+        :return:            The entries, in record order.
+        """
+        if self._by_source_id is None:
+            self._by_source_id = {}
+            for entry in self.entries:
+                self._by_source_id.setdefault(entry.source_id, []).append(entry)
+
+        return self._by_source_id.get(source_id, [])
+
+    def by_label(self, label: str) -> List[IndexEntry]:
+        """
+        Gets the entries of the records containing objects with the given label.
+
+        :param label:   The label.
+        :return:        The entries, in record order.
+        """
+        if self._by_label is None:
+            self._by_label = {}
+            for entry in self.entries:
+                for entry_label in set(entry.labels):
+                    self._by_label.setdefault(entry_label, []).append(entry)
+
+        return self._by_label.get(label, [])
+
+    def in_range(self, start: int, end: int) -> List[IndexEntry]:
+        """
+        Gets the entries of the records starting within the given byte range.
+
+        :param start:   The start of the range (inclusive).
+        :param end:     The end of the range (exclusive).
+        :return:        The entries, in record order.
+        """
+        return self.entries[bisect.bisect_left(self._offsets, start):bisect.bisect_left(self._offsets, end)]
+
+    def split(self, num_splits: int) -> List[Tuple[int, int]]:
+        """
+        Splits the shard into byte ranges of roughly equal size, aligned to
+        record boundaries, so that several readers can process it in parallel.
+
+        :param num_splits:  The (maximum) number of ranges.
+        :return:            The (start, end) byte ranges, end exclusive.
+        """
+        size = self.size
+        boundaries = sorted({self._offsets[index]
+                             for index in (bisect.bisect_left(self._offsets, size * split / num_splits)
+                                           for split in range(num_splits))
+                             if index < len(self._offsets)})
+
+        return list(zip(boundaries, boundaries[1:] + [size]))
+
@@ -0,0 +1,40 @@
+import json
+from typing import IO, Iterable
+
+from ._IndexEntry import IndexEntry
+from ._ShardIndex import ShardIndex, INDEX_VERSION
+
+
+class ShardIndexWriter:
+    """
+    Writes the index of a TFRecord shard as its records are written.
+    """
+    def __init__(self, shard_file: str, compression_type: str = ""):
+        """
+        :param shard_file:          The shard being written.
+        :param compression_type:    The compression type of the shard ("", GZIP or ZLIB).
+        """
+        self._file: IO[str] = open(ShardIndex.filename_for(shard_file), "w")
+        self._file.write(json.dumps({"version": INDEX_VERSION, "compression_type": compression_type}) + "\n")
+        self._record: int = 0
+        self._offset: int = 0
+
+    def add(self, length: int, source_id: str, labels: Iterable[str]):
+        """
+        Adds the next record written to the shard.
+
+        :param length:      The length of the record's data.
+        :param source_id:   The image/source_id of the example.
+        :param labels:      The labels of the example's objects.
+        """
+        entry = IndexEntry(self._record, self._offset, length, source_id, tuple(labels))
+        self._file.write(json.dumps({"record": entry.record, "offset": entry.offset, "length": entry.length,
+                                     "source_id": entry.source_id, "labels": entry.labels}) + "\n")
+        self._record += 1
+        self._offset = entry.end
+
+    def close(self):
+        """
+        Closes the index file.
+        """
+        self._file.close()
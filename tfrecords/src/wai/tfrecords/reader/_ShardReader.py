@@ -0,0 +1,138 @@
+import gzip
+import io
+import struct
+from typing import IO, Iterable, Iterator, List, Optional
+
+from ._IndexEntry import IndexEntry, RECORD_HEADER_SIZE
+from ._ShardIndex import ShardIndex
+from ._ZlibReader import ZlibReader
+
+SKIP_BUFFER_SIZE: int = 1024 * 1024
+""" The number of bytes to read at a time when skipping forward in a compressed shard. """
+
+
+class ShardReader:
+    """
+    Reads records from a TFRecord shard, using its index to go straight to
+    the records of interest. Records are returned as serialized examples
+    (parse them with tf.train.Example.FromString). Uncompressed shards are
+    read by seeking; compressed shards can't be seeked, so they are
+    decompressed up to the requested records instead (reading several
+    records in offset order only decompresses the shard once).
+    """
+    def __init__(self, shard_file: str, index: Optional[ShardIndex] = None):
+        """
+        :param shard_file:  The shard to read.
+        :param index:       The index of the shard, loaded from the sidecar file if None.
+        """
+        self.shard_file: str = shard_file
+        self.index: ShardIndex = index if index is not None else ShardIndex.load(shard_file)
+        self._file: Optional[IO[bytes]] = None
+        self._position: int = 0
+
+    def _open(self) -> IO[bytes]:
+        """
+        Opens the shard, decompressing it if necessary.
+
+        :return:    The file object.
+        """
+        if self.index.compression_type == "GZIP":
+            return gzip.open(self.shard_file, "rb")
+        elif self.index.compression_type == "ZLIB":
+            return io.BufferedReader(ZlibReader(self.shard_file))
+        else:
+            return open(self.shard_file, "rb")
+
+    def _seek(self, offset: int):
+        """
+        Moves to the given offset in the (uncompressed) shard.
+
+        :param offset:  The offset.
+        """
+        if self._file is None or (self.index.compression_type and offset < self._position):
+            self.close()
+            self._file = self._open()
+            self._position = 0
+
+        if not self.index.compression_type:
+            self._file.seek(offset)
+        else:
+            while self._position < offset:
+                skipped = len(self._file.read(min(SKIP_BUFFER_SIZE, offset - self._position)))
+                if skipped == 0:
+                    raise EOFError(f"Offset {offset} is beyond the end of {self.shard_file}")
+                self._position += skipped
+
+        self._position = offset
+
+    def read(self, entry: IndexEntry) -> bytes:
+        """
+        Reads the record of the given index entry.
+
+        :param entry:   The entry.
+        :return:        The record (serialized example).
+        """
+        self._seek(entry.offset)
+
+        header = self._file.read(RECORD_HEADER_SIZE)
+        length, = struct.unpack("<Q", header[:8]) if len(header) == RECORD_HEADER_SIZE else (None,)
+        if length != entry.length:
+            raise ValueError(f"Record {entry.record} in {self.shard_file} doesn't match the index")
+
+        data = self._file.read(entry.length + 4)[:entry.length]
+        self._position = entry.end
+
+        return data
+
+    def read_all(self, entries: Iterable[IndexEntry]) -> Iterator[bytes]:
+        """
+        Reads the records of the given index entries, in offset order.
+
+        :param entries:     The entries.
+        :return:            An iterator over the records.
+        """
+        for entry in sorted(entries, key=lambda entry: entry.offset):
+            yield self.read(entry)
+
+    def by_source_id(self, source_id: str) -> List[bytes]:
+        """
+        Reads the records with the given source ID.
+
+        :param source_id:   The source ID.
+        :return:            The records.
+        """
+        return list(self.read_all(self.index.by_source_id(source_id)))
+
+    def by_label(self, label: str) -> Iterator[bytes]:
+        """
+        Reads the records containing objects with the given label.
+
+        :param label:   The label.
+        :return:        An iterator over the records.
+        """
+        return self.read_all(self.index.by_label(label))
+
+    def read_range(self, start: int, end: int) -> Iterator[bytes]:
+        """
+        Reads the records starting within the given byte range (as produced
+        by ShardIndex.split).
+
+        :param start:   The start of the range (inclusive).
+        :param end:     The end of the range (exclusive).
+        :return:        An iterator over the records.
+        """
+        return self.read_all(self.index.in_range(start, end))
+
+    def close(self):
+        """
+        Closes the shard.
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def __enter__(self) -> "ShardReader":
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,44 @@
+import io
+import zlib
+from typing import IO
+
+READ_BUFFER_SIZE: int = 1024 * 1024
+""" The number of compressed bytes to read at a time. """
+
+
+class ZlibReader(io.RawIOBase):
+    """
+    Read-only file object decompressing a ZLIB-compressed file.
+    """
+    def __init__(self, filename: str):
+        """
+        :param filename:    The compressed file.
+        """
+        self._file: IO[bytes] = open(filename, "rb")
+        self._decompressor = zlib.decompressobj()
+        # The current chunk of decompressed data, and how much of it has been read
+        self._buffer: bytes = b""
+        self._offset: int = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        # Decompress until some data is available (or the file is exhausted)
+        while self._offset >= len(self._buffer):
+            compressed = self._file.read(READ_BUFFER_SIZE)
+            self._offset = 0
+            if len(compressed) == 0:
+                self._buffer = self._decompressor.flush()
+                break
+            self._buffer = self._decompressor.decompress(compressed)
+
+        # Copy from the chunk without slicing off the rest (which would copy it on every read)
+        size = min(len(buffer), len(self._buffer) - self._offset)
+        buffer[:size] = memoryview(self._buffer)[self._offset:self._offset + size]
+        self._offset += size
+        return size
+
+    def close(self):
+        self._file.close()
+        super().close()
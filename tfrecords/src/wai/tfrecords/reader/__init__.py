@@ -0,0 +1,9 @@
+"""
+Package for random access to TFRecord shards, via the sidecar index
+files written alongside them (see the --index option of tfrecords-convert).
+"""
+from ._IndexEntry import IndexEntry
+from ._ShardIndex import ShardIndex, INDEX_SUFFIX
+from ._ShardIndexWriter import ShardIndexWriter
+from ._ShardReader import ShardReader
+from ._ZlibReader import ZlibReader